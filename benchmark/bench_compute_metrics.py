@@ -0,0 +1,102 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Benchmark of the vectorized compute_metrics v.s. nested comprehensions over tokens
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+import numpy as np
+import run.globals as globals
+from torch.nn import CrossEntropyLoss as CE
+from utils.evaluation.evaluation import align_predictions, compute_metrics
+from utils.evaluation.span_metric import SpanMetric
+from benchmark.bench_span_metric import seqeval_compute
+
+
+def align_predictions_loop(predictions, labels):
+    """
+    The former compute_metrics: argmax over all positions and nested comprehensions over every token.
+    """
+
+    predictions = np.argmax(predictions, axis=2)
+    pad_token_label_id = CE().ignore_index
+    true_predictions = [
+        [
+            globals.label_list[p]
+            for (p, l) in zip(prediction, label)
+            if l != pad_token_label_id
+        ]
+        for prediction, label in zip(predictions, labels)
+    ]
+    true_labels = [
+        [
+            globals.label_list[l]
+            for (p, l) in zip(prediction, label)
+            if l != pad_token_label_id
+        ]
+        for prediction, label in zip(predictions, labels)
+    ]
+    return true_predictions, true_labels
+
+
+def make_eval_set(n_features, seq_len, num_labels, seed=0):
+    """
+    Random logits and labels, where labels are -100 on special tokens, non-first subwords and paddings.
+    """
+
+    rng = np.random.RandomState(seed)
+    predictions = rng.randn(n_features, seq_len, num_labels).astype(np.float32)
+    labels = rng.randint(0, num_labels, size=(n_features, seq_len))
+    lengths = rng.randint(8, seq_len + 1, size=n_features)
+    labels[np.arange(seq_len)[None, :] >= lengths[:, None]] = -100
+    labels[rng.rand(n_features, seq_len) < 0.3] = -100
+    labels[:, 0] = -100
+    return predictions, labels
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_features", type=int, default=50000)
+    parser.add_argument("--seq_len", type=int, default=128)
+    parser.add_argument("--label_strategy", default="iob2", choices=["iob2", "iobes"])
+    args = parser.parse_args()
+
+    globals.label_list = (
+        ["O", "B", "I"] if args.label_strategy == "iob2" else ["O", "B", "I", "E", "S"]
+    )
+    globals.metric = SpanMetric(globals.label_list)
+    predictions, labels = make_eval_set(
+        args.n_features, args.seq_len, len(globals.label_list)
+    )
+    print(
+        f"{args.n_features} features, seq_len={args.seq_len}, {int((labels != -100).sum())} labeled tokens"
+    )
+
+    start = time.perf_counter()
+    expected = align_predictions_loop(predictions, labels)
+    loop_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = align_predictions(predictions, labels)
+    vectorized_elapsed = time.perf_counter() - start
+    assert actual == expected, "Tags differ from the nested comprehensions"
+    print(
+        f"align: comprehensions {loop_elapsed:.2f} s, vectorized {vectorized_elapsed:.2f} s, "
+        f"speedup {loop_elapsed / vectorized_elapsed:.1f}x"
+    )
+
+    start = time.perf_counter()
+    results = compute_metrics((predictions, labels))
+    elapsed = time.perf_counter() - start
+    expected_results = seqeval_compute(*expected)
+    for key in ["overall_precision", "overall_recall", "overall_f1"]:
+        assert results[key] == expected_results[key], key
+    print(
+        f"compute_metrics: {elapsed:.2f} s in total, overall_f1 {results['overall_f1']:.4f} (identical)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Memory of evaluation that gathers logits v.s. argmax label ids v.s. streaming span counts
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.append(os.getcwd())
+import numpy as np
+import torch
+import run.globals as globals
+from datasets import Dataset
+from transformers import (
+    AutoConfig,
+    AutoModelForTokenClassification,
+    TrainingArguments,
+)
+from utils.evaluation.evaluation import compute_metrics
+from utils.evaluation.span_metric import SpanMetric
+from utils.feature_generation.collator import DataCollatorWithDynamicPadding
+from utils.trainer.trainer import QASLTrainer
+
+MODES = ["logits", "argmax", "streaming"]
+
+
+def make_features(n_features, seq_len, vocab_size, num_labels, seed=0):
+    """
+    Random features of MRC-like length, with -100 on special tokens, the question and paddings.
+    """
+
+    rng = np.random.RandomState(seed)
+    lengths = rng.randint(seq_len // 2, seq_len + 1, size=n_features)
+    input_ids, labels = list(), list()
+    for length in lengths:
+        input_ids.append(rng.randint(1000, vocab_size, size=length).tolist())
+        label_ids = rng.randint(0, num_labels, size=length)
+        label_ids[: min(8, length)] = -100
+        labels.append(label_ids.tolist())
+    return Dataset.from_dict(
+        {
+            "input_ids": input_ids,
+            "attention_mask": [[1] * n for n in lengths],
+            "labels": labels,
+            "length": lengths.tolist(),
+        }
+    )
+
+
+def evaluate(args):
+    """
+    Evaluate in one mode and report the peak RSS it adds and the bytes of gathered predictions.
+    """
+
+    globals.label_list = ["O", "B", "I", "E", "S"][: args.num_labels]
+    globals.metric = SpanMetric(globals.label_list)
+    config = AutoConfig.from_pretrained(args.model, num_labels=args.num_labels)
+    torch.manual_seed(0)
+    model = AutoModelForTokenClassification.from_config(config)
+    features = make_features(
+        args.n_features, args.seq_len, config.vocab_size, args.num_labels
+    )
+    trainer = QASLTrainer(
+        model=model,
+        args=TrainingArguments(
+            output_dir=os.path.join(args.output_dir, args.mode),
+            per_device_eval_batch_size=args.batch_size,
+            no_cuda=args.no_cuda,
+        ),
+        data_collator=DataCollatorWithDynamicPadding(pad_token_id=0),
+        eval_dataset=features,
+        compute_metrics=compute_metrics,
+        argmax_logits=args.mode == "argmax",
+        streaming_metric=globals.metric if args.mode == "streaming" else None,
+    )
+    gathered = dict()
+    score = trainer.compute_metrics
+
+    def measured_compute_metrics(p):
+        gathered["bytes"] = p.predictions.nbytes + p.label_ids.nbytes
+        return score(p)
+
+    trainer.compute_metrics = measured_compute_metrics
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    metrics = trainer.evaluate()
+    elapsed = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        json.dumps(
+            {
+                "mode": args.mode,
+                "peak_rss_mb": (after - before) / 1024,
+                "gathered_mb": gathered["bytes"] / 2**20,
+                "seconds": elapsed,
+                "overall_f1": metrics["eval_overall_f1"],
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="bert-base-uncased")
+    parser.add_argument("--n_features", type=int, default=20000)
+    parser.add_argument("--seq_len", type=int, default=256)
+    parser.add_argument("--num_labels", type=int, default=5)
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--output_dir", default="/tmp/bench_eval_memory")
+    parser.add_argument("--no_cuda", action="store_true")
+    parser.add_argument("--mode", choices=MODES, default=None)
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        evaluate(args)
+        return
+
+    # Each mode runs in its own process, since the peak RSS of a process never goes down.
+    baseline = None
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable] + sys.argv + ["--mode", mode],
+            check=True,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        baseline = baseline or result
+        print(
+            f"{mode}: peak RSS +{result['peak_rss_mb']:.0f} MB, gathered {result['gathered_mb']:.1f} MB, "
+            f"{result['seconds']:.1f} s, overall_f1 {result['overall_f1']:.4f}, "
+            f"gathered {baseline['gathered_mb'] / max(result['gathered_mb'], 1e-9):.0f}x less than logits"
+        )
+
+
+if __name__ == "__main__":
+    main()
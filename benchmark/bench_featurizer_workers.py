@@ -0,0 +1,96 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Benchmark of featurization with several numbers of worker processes
+
+import argparse
+import os
+import pickle
+import sys
+import time
+
+sys.path.append(os.getcwd())
+import numpy as np
+from datasets import Dataset
+from transformers import AutoTokenizer
+from utils.feature_generation.feature_generation import Featurizer
+
+QUERIES = {
+    "G#DNA": "find all DNA entities in the passage .",
+    "G#RNA": "find all RNA entities in the passage .",
+    "G#protein": "find all protein entities in the passage .",
+    "G#cell_line": "find all cell line entities in the passage .",
+    "G#cell_type": "find all cell type entities in the passage .",
+}
+
+
+def make_mrc_dataset(tokenizer, n_passages, n_words, seed=0):
+    """
+    Synthesize a GENIA-like MRC dataset: each passage is repeated once per query.
+    Words are sampled from the vocab of the tokenizer.
+    """
+
+    rng = np.random.RandomState(seed)
+    vocab = [w for w in tokenizer.get_vocab() if w.isalpha()]
+    examples = {"question": [], "passage_tokens": [], "answers": []}
+    for _ in range(n_passages):
+        passage_tokens = rng.choice(vocab, size=rng.randint(5, n_words * 2)).tolist()
+        for tag, question in QUERIES.items():
+            start = int(rng.randint(0, len(passage_tokens)))
+            examples["question"].append(question)
+            examples["passage_tokens"].append(passage_tokens)
+            examples["answers"].append(
+                {
+                    "type": [tag],
+                    "text": [passage_tokens[start]],
+                    "start_pos": [start],
+                    "end_pos": [start + 1],
+                }
+            )
+    return Dataset.from_dict(examples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokenizer", default="bert-base-uncased")
+    parser.add_argument("--n_passages", type=int, default=18000)
+    parser.add_argument("--n_words", type=int, default=27)
+    parser.add_argument("--max_seq_length", type=int, default=128)
+    parser.add_argument("--doc_stride", type=int, default=50)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--encode_passage_once", action="store_true")
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer, use_fast=True)
+    featurizer = Featurizer(
+        tokenizer=tokenizer,
+        label_to_id={"O": 0, "B": 1, "I": 2},
+        max_seq_length=args.max_seq_length,
+        doc_stride=args.doc_stride,
+        encode_passage_once=args.encode_passage_once,
+    )
+    assert pickle.loads(pickle.dumps(featurizer)).max_seq_length == args.max_seq_length
+
+    dataset = make_mrc_dataset(tokenizer, args.n_passages, args.n_words)
+    print(f"{featurizer}\n{len(dataset)} examples")
+
+    baseline = None
+    for num_proc in args.workers:
+        start = time.perf_counter()
+        features = dataset.map(
+            featurizer,
+            batched=True,
+            num_proc=num_proc if num_proc > 1 else None,
+            load_from_cache_file=False,
+            remove_columns=dataset.column_names,
+        )
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(
+            f"num_proc={num_proc}: {elapsed:.2f} s, "
+            f"{len(dataset) / elapsed:.0f} examples/s, "
+            f"{len(features)} features, speedup {baseline / elapsed:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Benchmark of aligning label ids to features (python loop v.s. numpy)
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+import numpy as np
+from utils.feature_generation.feature_generation import align_labels
+from utils.feature_generation.strategy import LabelStrategy
+from utils.prediction.decoding import decode_spans, spans_to_answers
+
+LABEL_TO_ID = {"O": 0, "B": 1, "I": 2}
+IOBES_LABEL_TO_ID = {"O": 0, "B": 1, "I": 2, "E": 3, "S": 4}
+
+
+def make_batch(n_features, n_words, n_answers, n_question_tokens, seed):
+    """
+    Synthesize a batch of (word_ids, answers) that looks like GENIA features.
+    Each word is split into 1~3 subwords, and answers are random (possibly nested) spans.
+    """
+
+    rng = np.random.RandomState(seed)
+    batch = list()
+    for _ in range(n_features):
+        length = rng.randint(n_words // 2, n_words * 2)
+        word_ids = [None] + [0] * n_question_tokens + [None]
+        for w in range(length):
+            word_ids.extend([w] * rng.randint(1, 4))
+        word_ids.append(None)
+        starts = rng.randint(0, length, size=rng.randint(1, n_answers + 1))
+        ends = np.minimum(starts + rng.randint(1, 5, size=len(starts)), length)
+        order = np.lexsort((ends, starts))
+        answers = {
+            "start_pos": starts[order].tolist(),
+            "end_pos": ends[order].tolist(),
+        }
+        batch.append((word_ids, answers))
+    return batch
+
+
+def loop_align_labels(word_ids, answers, label_to_id):
+    """
+    Per-token python loop of the previous implementation in `tokenize_and_align_labels`, kept verbatim.
+    Each answer repaints every first subword, so only the last answer survives with several answers.
+    It paints `end` as an inclusive end, i.e. one word past an answer of the data.
+    """
+
+    first_passage_token = word_ids.index(None, 1) + 1
+    label_ids = [-100] * first_passage_token
+    after_first_sep = word_ids[first_passage_token:]
+    passage_label_ids = [-100] * len(after_first_sep)
+    for start, end in zip(answers["start_pos"], answers["end_pos"]):
+        prev_word_id = None
+        for idx, word_id in enumerate(after_first_sep):
+            if word_id is None:
+                pass
+            elif word_id != prev_word_id:
+                if word_id == start:
+                    passage_label_ids[idx] = label_to_id["B"]
+                elif start < word_id <= end:
+                    passage_label_ids[idx] = label_to_id["I"]
+                else:
+                    passage_label_ids[idx] = label_to_id["O"]
+            else:
+                pass
+            prev_word_id = word_id
+    label_ids.extend(passage_label_ids)
+    return label_ids
+
+
+def reference_align_labels(word_ids, answers, label_to_id, label_strategy):
+    """
+    Per-token reference of `align_labels` with several answers: every span covers words
+    from `start_pos` to `end_pos` (exclusive), a later answer wins where spans overlap,
+    and words outside all spans are O.
+    """
+
+    first_passage_token = word_ids.index(None, 1) + 1
+    label_ids = [-100] * first_passage_token
+    after_first_sep = word_ids[first_passage_token:]
+    passage_label_ids = [-100] * len(after_first_sep)
+    for start, end in zip(answers["start_pos"], answers["end_pos"]):
+        prev_word_id = None
+        for idx, word_id in enumerate(after_first_sep):
+            if word_id is not None and word_id != prev_word_id:
+                if not start <= word_id < end:
+                    if passage_label_ids[idx] == -100:
+                        passage_label_ids[idx] = label_to_id["O"]
+                elif label_strategy == LabelStrategy.IOBES and end - start == 1:
+                    passage_label_ids[idx] = label_to_id["S"]
+                elif word_id == start:
+                    passage_label_ids[idx] = label_to_id["B"]
+                elif label_strategy == LabelStrategy.IOBES and word_id == end - 1:
+                    passage_label_ids[idx] = label_to_id["E"]
+                else:
+                    passage_label_ids[idx] = label_to_id["I"]
+            prev_word_id = word_id
+    label_ids.extend(passage_label_ids)
+    return label_ids
+
+
+def vectorized_align_labels(
+    batch, label_to_id=LABEL_TO_ID, label_strategy=LabelStrategy.IOB2
+):
+    batched_word_ids, batched_answers = zip(*batch)
+    return align_labels(
+        list(batched_word_ids),
+        list(range(len(batch))),
+        list(batched_answers),
+        label_to_id,
+        label_strategy,
+    )
+
+
+def inclusive_ends(answers):
+    return {
+        "start_pos": answers["start_pos"],
+        "end_pos": [end - 1 for end in answers["end_pos"]],
+    }
+
+
+def round_trip_cases(n_cases, n_words, seed):
+    """
+    Non-overlapping gold spans (start, end exclusive) of an `n_words` passage, which tags can represent exactly:
+    adjacent, single-word and end-of-passage spans, then random ones.
+    """
+
+    cases = [
+        [(0, 2), (2, 4)],
+        [(3, 4)],
+        [(6, n_words)],
+        [(0, 1), (1, 2), (n_words - 1, n_words)],
+        [(0, n_words)],
+        [],
+    ]
+    rng = np.random.RandomState(seed)
+    for _ in range(n_cases):
+        cuts = np.sort(rng.choice(np.arange(n_words + 1), size=8, replace=False))
+        cases.append([(s, e) for s, e in zip(cuts[:-1], cuts[1:]) if rng.rand() < 0.6])
+    return cases
+
+
+def check_round_trip(label_to_id, label_strategy, n_words=8, n_cases=1000, seed=0):
+    """
+    Gold answers -> `align_labels` -> `decode_spans` -> `spans_to_answers` must give back the gold answers.
+    """
+
+    id_to_label = {v: k for k, v in label_to_id.items()}
+    tokens = [f"w{i}" for i in range(n_words)]
+    word_ids = [None, 0, None] + list(range(n_words)) + [None]
+    for spans in round_trip_cases(n_cases, n_words, seed):
+        answers = {
+            "start_pos": [int(s) for s, _ in spans] or [-1],
+            "end_pos": [int(e) for _, e in spans] or [-1],
+        }
+        label_ids = align_labels(
+            [word_ids], [0], [answers], label_to_id, label_strategy
+        )
+        decoded = spans_to_answers(
+            decode_spans(label_ids[0][3:-1], id_to_label), tokens, "T"
+        )
+        expected = [(s, e, " ".join(tokens[s:e])) for s, e in spans]
+        assert [(a.start_pos, a.end_pos, a.text) for a in decoded] == expected, (
+            label_strategy,
+            spans,
+            decoded,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_batches", type=int, default=20)
+    parser.add_argument("--batch_size", type=int, default=1000)
+    parser.add_argument("--n_words", type=int, default=27)
+    parser.add_argument("--n_answers", type=int, default=24)
+    parser.add_argument("--n_question_tokens", type=int, default=8)
+    args = parser.parse_args()
+
+    batches = [
+        make_batch(
+            args.batch_size, args.n_words, args.n_answers, args.n_question_tokens, i
+        )
+        for i in range(args.n_batches)
+    ]
+
+    check_round_trip(LABEL_TO_ID, LabelStrategy.IOB2)
+    check_round_trip(IOBES_LABEL_TO_ID, LabelStrategy.IOBES)
+
+    # Every feature must match the reference of exclusive ends, for both label strategies.
+    # With one answer, the previous loop agrees once its inclusive end is moved back by one word;
+    # with several, it kept only the last answer, whereas `align_labels` keeps every span.
+    n_single = 0
+    for batch in batches:
+        got = [g.tolist() for g in vectorized_align_labels(batch)]
+        got_iobes = [
+            g.tolist()
+            for g in vectorized_align_labels(
+                batch, IOBES_LABEL_TO_ID, LabelStrategy.IOBES
+            )
+        ]
+        for (w, a), g, g_iobes in zip(batch, got, got_iobes):
+            assert g == reference_align_labels(w, a, LABEL_TO_ID, LabelStrategy.IOB2)
+            assert g_iobes == reference_align_labels(
+                w, a, IOBES_LABEL_TO_ID, LabelStrategy.IOBES
+            )
+            if len(a["start_pos"]) == 1:
+                assert g == loop_align_labels(w, inclusive_ends(a), LABEL_TO_ID)
+                n_single += 1
+    assert n_single > 0, "No single-answer feature to compare with the previous loop"
+
+    results = dict()
+    for name, fn in [
+        (
+            "python loop",
+            lambda batch: [loop_align_labels(w, a, LABEL_TO_ID) for w, a in batch],
+        ),
+        ("numpy", vectorized_align_labels),
+    ]:
+        start = time.perf_counter()
+        for batch in batches:
+            fn(batch)
+        results[name] = time.perf_counter() - start
+
+    n_features = args.n_batches * args.batch_size
+    for name, elapsed in results.items():
+        print(
+            f"{name:12s}: {elapsed:.3f} s for {n_features} features "
+            f"({n_features / elapsed:.0f} features/s)"
+        )
+    print(f"speedup     : {results['python loop'] / results['numpy']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Write time, read time and file size of MRCStruct as json v.s. parquet
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+import numpy as np
+import pyarrow.parquet as pq
+from utils.data_preprocess.parse_genia import GENIA
+from utils.data_structure.mrc import (
+    AnswerStruct,
+    DataStruct,
+    dict2mrcStruct,
+    table2mrcStruct,
+)
+from benchmark.bench_mrc_expansion import load_script
+
+
+def synthetic_data(n_passages, n_types=36, n_answers=4, n_words=27, seed=0):
+    """
+    Passages of the size of GENIA sentences, for machines without the corpus.
+    """
+
+    rng = np.random.RandomState(seed)
+    data = list()
+    for pid in range(n_passages):
+        words = [f"w{i}" for i in rng.randint(0, 5000, size=n_words)]
+        answers = list()
+        for _ in range(n_answers):
+            start = int(rng.randint(0, n_words))
+            end = int(min(n_words, start + rng.randint(1, 6)))
+            answers.append(
+                AnswerStruct(
+                    type=f"G#T{rng.randint(n_types)}",
+                    text=" ".join(words[start:end]),
+                    start_pos=start,
+                    end_pos=end,
+                )
+            )
+        data.append(
+            DataStruct(pid=f"MEDLINE:{pid}", passage=" ".join(words), answers=answers)
+        )
+    return data
+
+
+def timed(function, *args):
+    """
+    Output and seconds of a call. Garbage collection is paused, so objects left by a former call do not slow it down.
+    """
+
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        output = function(*args)
+        return output, time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def read_json(file_path):
+    with open(file_path, "r", encoding="utf-8") as f:
+        return dict2mrcStruct(json.load(f))
+
+
+def read_parquet(file_path):
+    return table2mrcStruct(pq.read_table(file_path))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--corpus",
+        default=os.path.join(
+            "dataset", "GENIAcorpus3.02p", "GENIAcorpus3.02.merged.xml"
+        ),
+    )
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        default=0,
+        help="Use this number of synthetic passages instead of the corpus",
+    )
+    parser.add_argument(
+        "--script",
+        default=None,
+        help="Also time records of `_iter_records` of this loading script, e.g. utils/data_loading_script/load_dataset_genia.py",
+    )
+    parser.add_argument("--output_dir", default="/tmp/bench_mrc_parquet")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        data = synthetic_data(args.synthetic)
+    else:
+        data = GENIA(args.corpus).parse2mrc()
+    print(
+        f"{len(data)} passages, {sum(map(len, data))} answers"
+        + (" (synthetic)" if args.synthetic else f" of {args.corpus}")
+    )
+
+    json_path = os.path.join(args.output_dir, "all.json")
+    parquet_path = os.path.join(args.output_dir, "all.parquet")
+    _, json_write = timed(GENIA.save2json, "", "", json_path, data)
+    _, parquet_write = timed(GENIA.save2parquet, "", "", parquet_path, data)
+    json_mrc, json_read = timed(read_json, json_path)
+    parquet_mrc, parquet_read = timed(read_parquet, parquet_path)
+    assert json_mrc == parquet_mrc, "MRCStructs of json and parquet differ"
+    json_size, parquet_size = os.path.getsize(json_path), os.path.getsize(parquet_path)
+
+    print(
+        f"write: json {json_write:.2f} s, parquet {parquet_write:.2f} s, "
+        f"{json_write / parquet_write:.1f}x faster"
+    )
+    print(
+        f"read to MRCStruct: json {json_read:.2f} s, parquet {parquet_read:.2f} s, "
+        f"{json_read / parquet_read:.1f}x faster, identical"
+    )
+    print(
+        f"size: json {json_size / 2**20:.1f} MB, parquet {parquet_size / 2**20:.1f} MB, "
+        f"{json_size / parquet_size:.1f}x smaller"
+    )
+
+    if args.script:
+        module = load_script(args.script)
+        json_records, json_read = timed(list, module._iter_records(json_path))
+        parquet_records, parquet_read = timed(list, module._iter_records(parquet_path))
+        assert json_records == parquet_records, "Records of json and parquet differ"
+        print(
+            f"records of the loading script: json {json_read:.2f} s, parquet {parquet_read:.2f} s, "
+            f"{json_read / parquet_read:.1f}x faster, identical"
+        )
+
+
+if __name__ == "__main__":
+    main()
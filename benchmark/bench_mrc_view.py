@@ -0,0 +1,126 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Cache size and load time of a MRC config v.s. a lazy MRC view over its plain config
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+sys.path.append(os.getcwd())
+from datasets import load_dataset
+from utils.feature_generation.mrc_view import mrc_views
+
+
+def load(config, name, cache_dir):
+    """
+    Load a config of the loading script from scratch, and return it with the seconds it takes.
+    """
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    start = time.perf_counter()
+    dataset = load_dataset(
+        path=config["dataset_script_file"], name=name, cache_dir=cache_dir
+    )
+    return dataset, time.perf_counter() - start
+
+
+def cache_size(dataset) -> int:
+    return sum(
+        os.path.getsize(f["filename"])
+        for split in dataset.values()
+        for f in split.cache_files
+    )
+
+
+def featurize(dataset, featurizer):
+    start = time.perf_counter()
+    features = {
+        split: split_dataset.map(
+            featurizer,
+            batched=True,
+            remove_columns=split_dataset.column_names,
+            features=featurizer.features,
+        )
+        for split, split_dataset in dataset.items()
+    }
+    return features, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--config",
+        default="run/configs/genia_mrc_config.json",
+        help="A run_ner config of a MRC config, whose plain config has the same name without `_mrc`",
+    )
+    parser.add_argument(
+        "--tokenizer",
+        default=None,
+        help="Also featurize both with this tokenizer, and check that features are the same",
+    )
+    parser.add_argument("--output_dir", default="/tmp/bench_mrc_view")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    with open(config["query_file"], "r", encoding="utf-8") as f:
+        queries = json.load(f)
+    mrc_name = config["dataset_config_name"]
+    plain_name = mrc_name[: -len("_mrc")]
+
+    mrc, mrc_elapsed = load(config, mrc_name, os.path.join(args.output_dir, "mrc"))
+    plain, plain_elapsed = load(
+        config, plain_name, os.path.join(args.output_dir, "plain")
+    )
+    start = time.perf_counter()
+    views = mrc_views(plain, queries)
+    view_elapsed = plain_elapsed + time.perf_counter() - start
+    for split in mrc:
+        assert list(views[split]) == list(mrc[split]), f"Rows of {split} differ"
+    mrc_size, view_size = cache_size(mrc), cache_size(plain)
+    print(
+        f"{sum(map(len, mrc.values()))} MRC rows of {sum(map(len, plain.values()))} passages x {len(queries)} queries, "
+        f"rows identical"
+    )
+    print(
+        f"cache: {mrc_name} {mrc_size / 2**20:.1f} MB, view {view_size / 2**20:.1f} MB, "
+        f"{mrc_size / view_size:.1f}x smaller"
+    )
+    print(
+        f"load: {mrc_name} {mrc_elapsed:.1f} s, view {view_elapsed:.1f} s, "
+        f"{mrc_elapsed / view_elapsed:.1f}x faster"
+    )
+
+    if args.tokenizer:
+        from transformers import AutoTokenizer
+        from utils.feature_generation.feature_generation import Featurizer
+
+        label_to_id = (
+            {"O": 0, "B": 1, "I": 2}
+            if config.get("label_strategy", "iob2") == "iob2"
+            else {"O": 0, "B": 1, "I": 2, "E": 3, "S": 4}
+        )
+        featurizer = Featurizer(
+            tokenizer=AutoTokenizer.from_pretrained(args.tokenizer, use_fast=True),
+            label_to_id=label_to_id,
+            max_seq_length=config.get("max_seq_length", 128),
+            doc_stride=config.get("doc_stride", 128),
+            padding_strategy=config.get("padding_strategy", "max_length"),
+            label_strategy=config.get("label_strategy", "iob2"),
+        )
+        mrc_features, mrc_elapsed = featurize(mrc, featurizer)
+        view_features, view_elapsed = featurize(views, featurizer)
+        for split in mrc_features:
+            assert (
+                mrc_features[split].to_dict() == view_features[split].to_dict()
+            ), f"Features of {split} differ"
+        print(
+            f"featurize: {mrc_name} {mrc_elapsed:.1f} s, view {view_elapsed:.1f} s, features identical"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Nested evaluation of gold tags decoded through the Predictor, which must score F1 of 1.0
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+import numpy as np
+import torch
+from datasets import Dataset
+from transformers import AutoTokenizer
+from utils.evaluation.nested_evaluation import NestedSpanEvaluator
+from utils.feature_generation.feature_generation import Featurizer, align_labels
+from utils.feature_generation.mrc_view import expand_batch
+from utils.feature_generation.strategy import LabelStrategy
+from utils.prediction.predictor import Predictor
+from utils.prediction.query_filter import group_passages
+from benchmark.bench_featurizer_workers import QUERIES
+
+LABEL_TO_IDS = {
+    LabelStrategy.IOB2: {"O": 0, "B": 1, "I": 2},
+    LabelStrategy.IOBES: {"O": 0, "B": 1, "I": 2, "E": 3, "S": 4},
+}
+
+
+def make_plain_dataset(tokenizer, n_passages, n_words, seed=0):
+    """
+    GENIA-like passages whose answers of different types nest, while answers of one type never overlap,
+    so tags of every type represent its answers exactly. Adjacent, single-word and end-of-passage answers are common.
+    """
+
+    rng = np.random.RandomState(seed)
+    vocab = [w for w in tokenizer.get_vocab() if w.isalpha()]
+    examples = {"pid": [], "passage": [], "passage_tokens": [], "answers": []}
+    for pid in range(n_passages):
+        passage_tokens = rng.choice(vocab, size=rng.randint(5, n_words * 2)).tolist()
+        answers = {"type": [], "text": [], "start_pos": [], "end_pos": []}
+        for tag in QUERIES:
+            cuts = np.sort(
+                rng.choice(
+                    np.arange(len(passage_tokens) + 1),
+                    size=len(passage_tokens) // 2 + 1,
+                    replace=False,
+                )
+            )
+            for start, end in zip(cuts[:-1].tolist(), cuts[1:].tolist()):
+                if end - start <= 4 and rng.rand() < 0.5:
+                    answers["type"].append(tag)
+                    answers["text"].append(" ".join(passage_tokens[start:end]))
+                    answers["start_pos"].append(start)
+                    answers["end_pos"].append(end)
+        examples["pid"].append(str(pid))
+        examples["passage"].append(" ".join(passage_tokens))
+        examples["passage_tokens"].append(passage_tokens)
+        examples["answers"].append(answers)
+    return Dataset.from_dict(examples)
+
+
+def gold_tags(passage_tokens, answers, tag, label_to_id, label_strategy):
+    """
+    Word-level gold tag ids of the answers of a type, painted by `align_labels` as features are.
+    """
+
+    n_words = len(passage_tokens)
+    spans = [
+        (s, e)
+        for t, s, e in zip(answers["type"], answers["start_pos"], answers["end_pos"])
+        if t == tag
+    ] or [(-1, -1)]
+    word_ids = [None, 0, None] + list(range(n_words)) + [None]
+    label_ids = align_labels(
+        [word_ids],
+        [0],
+        [{"start_pos": [s for s, _ in spans], "end_pos": [e for _, e in spans]}],
+        label_to_id,
+        label_strategy,
+    )[0]
+    return label_ids[3 : 3 + n_words].astype(np.int64)
+
+
+class GoldTagPredictor(Predictor):
+    """
+    A `Predictor` whose logits are one-hot gold tags of each example instead of outputs of a model,
+    so featurization, stitching of windows, decoding and merging are exercised as in `run_ner.py`.
+    """
+
+    def __init__(self, example_tags, **kwargs):
+        super().__init__(model=torch.nn.Identity(), **kwargs)
+        self.example_tags = example_tags
+
+    def _forward(self, batch):
+        n_labels = len(self.id_to_label)
+        self.n_features += len(batch)
+        outputs = list()
+        for f in batch:
+            word_ids = np.asarray(f["word_ids"], dtype=np.int64)
+            word_ids = word_ids[word_ids >= 0]
+            tags = self.example_tags[f["example_id"]][word_ids]
+            outputs.append((word_ids, np.eye(n_labels, dtype=np.float32)[tags]))
+        return outputs
+
+
+def evaluate(predictor, dataset):
+    evaluator = NestedSpanEvaluator()
+    start = time.perf_counter()
+    for _ in evaluator.evaluate(group_passages(dataset), predictor.predict(dataset)):
+        pass
+    return evaluator.results(), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokenizer", default="bert-base-uncased")
+    parser.add_argument("--n_passages", type=int, default=500)
+    parser.add_argument("--n_words", type=int, default=60)
+    parser.add_argument(
+        "--max_seq_length",
+        type=int,
+        default=128,
+        help="Short enough that long passages are split into windows, whose logits are stitched.",
+    )
+    parser.add_argument("--doc_stride", type=int, default=32)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer, use_fast=True)
+    plain_dataset = make_plain_dataset(tokenizer, args.n_passages, args.n_words)
+    mrc_dataset = Dataset.from_dict(expand_batch(plain_dataset[:], QUERIES))
+    n_answers = sum(len(answers["type"]) for answers in plain_dataset["answers"])
+    print(
+        f"{len(plain_dataset)} passages, {len(QUERIES)} types, {n_answers} gold answers"
+    )
+
+    for label_strategy, label_to_id in LABEL_TO_IDS.items():
+        per_type = [
+            [
+                gold_tags(tokens, answers, tag, label_to_id, label_strategy)
+                for tag in QUERIES
+            ]
+            for tokens, answers in zip(
+                plain_dataset["passage_tokens"], plain_dataset["answers"]
+            )
+        ]
+        settings = dict(
+            tokenizer=tokenizer,
+            label_to_id=label_to_id,
+            max_seq_length=args.max_seq_length,
+            doc_stride=args.doc_stride,
+            padding_strategy="do_not_pad",
+            label_strategy=label_strategy.value,
+        )
+        id_to_label = {v: k for k, v in label_to_id.items()}
+        runs = [
+            (
+                "one query per example",
+                mrc_dataset,
+                GoldTagPredictor(
+                    [tags for passage_tags in per_type for tags in passage_tags],
+                    featurizer=Featurizer(**settings),
+                    id_to_label=id_to_label,
+                    device="cpu",
+                    queries=QUERIES,
+                ),
+            ),
+            (
+                "packed queries",
+                plain_dataset,
+                GoldTagPredictor(
+                    [np.stack(passage_tags, axis=1) for passage_tags in per_type],
+                    featurizer=Featurizer(queries=QUERIES, **settings),
+                    id_to_label=id_to_label,
+                    device="cpu",
+                ),
+            ),
+        ]
+        for name, dataset, predictor in runs:
+            results, elapsed = evaluate(predictor, dataset)
+            n_windows = predictor.n_features - len(dataset)
+            f1s = {key: value for key, value in results.items() if key.endswith("_f1")}
+            assert all(f1 == 1.0 for f1 in f1s.values()), (label_strategy, name, f1s)
+            print(
+                f"{label_strategy.value} {name}: overall F1 {results['overall_f1']:.4f}, "
+                f"{len(f1s) - 1} type/layer F1s all 1.0, {n_windows} extra windows stitched, "
+                f"{len(plain_dataset) / elapsed:.0f} passages/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
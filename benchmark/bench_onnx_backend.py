@@ -0,0 +1,86 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Benchmark of PyTorch v.s. ONNX Runtime on CPU at several batch sizes and sequence lengths
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+import numpy as np
+import torch
+from transformers import AutoModelForTokenClassification, AutoTokenizer
+from utils.model.onnx_model import OnnxModelForTokenClassification, dummy_inputs
+from utils.model.packed_query_model import (
+    PACKED_CONFIG_NAME,
+    PackedQueryModelForTokenClassification,
+)
+
+
+def measure(model, inputs, n_iters, n_warmup=2):
+    """
+    Latencies (seconds) of running the model on the same inputs.
+    """
+
+    with torch.no_grad():
+        for _ in range(n_warmup):
+            model(**inputs)
+        latencies = list()
+        for _ in range(n_iters):
+            start = time.perf_counter()
+            model(**inputs)
+            latencies.append(time.perf_counter() - start)
+    return np.asarray(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model_dir",
+        required=True,
+        help="The output dir of run_ner, with model.onnx from run/export_onnx.py.",
+    )
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--seq_lens", type=int, nargs="+", default=[64, 128, 256, 512])
+    parser.add_argument("--n_iters", type=int, default=10)
+    parser.add_argument("--num_threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    tokenizer = AutoTokenizer.from_pretrained(args.model_dir, use_fast=True)
+    model_input_names = ["input_ids", "attention_mask"]
+    if "token_type_ids" in tokenizer.model_input_names:
+        model_input_names.append("token_type_ids")
+    if os.path.isfile(os.path.join(args.model_dir, PACKED_CONFIG_NAME)):
+        torch_model = PackedQueryModelForTokenClassification.from_pretrained(
+            args.model_dir
+        )
+        model_input_names.append("query_ids")
+    else:
+        torch_model = AutoModelForTokenClassification.from_pretrained(args.model_dir)
+    torch_model.eval()
+    onnx_model = OnnxModelForTokenClassification.from_pretrained(
+        args.model_dir, num_threads=args.num_threads
+    )
+
+    print(
+        f"{'batch_size':>10} {'seq_len':>7} | {'torch p50 ms':>12} {'onnx p50 ms':>11} | "
+        f"{'torch seq/s':>11} {'onnx seq/s':>10} | {'speedup':>7}"
+    )
+    for seq_len in args.seq_lens:
+        for batch_size in args.batch_sizes:
+            inputs = dummy_inputs(tokenizer, model_input_names, batch_size, seq_len)
+            torch_latency = np.median(measure(torch_model, inputs, args.n_iters))
+            onnx_latency = np.median(measure(onnx_model, inputs, args.n_iters))
+            print(
+                f"{batch_size:>10} {seq_len:>7} | "
+                f"{torch_latency * 1000:>12.2f} {onnx_latency * 1000:>11.2f} | "
+                f"{batch_size / torch_latency:>11.1f} {batch_size / onnx_latency:>10.1f} | "
+                f"{torch_latency / onnx_latency:>6.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
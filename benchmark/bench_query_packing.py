@@ -0,0 +1,192 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Benchmark of packing all queries into one sequence v.s. one query per example
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+import numpy as np
+import torch
+from datasets import Dataset
+from transformers import (
+    AutoConfig,
+    AutoModel,
+    AutoModelForTokenClassification,
+    AutoTokenizer,
+)
+from utils.feature_generation.feature_generation import Featurizer
+from utils.feature_generation.collator import DataCollatorWithDynamicPadding
+from utils.model.packed_query_model import PackedQueryModelForTokenClassification
+from benchmark.bench_featurizer_workers import QUERIES
+
+LABEL_TO_ID = {"O": 0, "B": 1, "I": 2}
+
+
+def make_plain_dataset(tokenizer, n_passages, n_words, seed=0):
+    """
+    Synthesize a GENIA-like plain dataset: each passage has one random answer per type,
+    of 1 to 4 words, with an exclusive `end_pos` as the loading scripts produce.
+    Words are sampled from the vocab of the tokenizer.
+    """
+
+    rng = np.random.RandomState(seed)
+    vocab = [w for w in tokenizer.get_vocab() if w.isalpha()]
+    examples = {"passage_tokens": [], "answers": []}
+    for _ in range(n_passages):
+        passage_tokens = rng.choice(vocab, size=rng.randint(5, n_words * 2)).tolist()
+        starts = rng.randint(0, len(passage_tokens), size=len(QUERIES))
+        ends = np.minimum(
+            starts + rng.randint(1, 5, size=len(QUERIES)), len(passage_tokens)
+        )
+        examples["passage_tokens"].append(passage_tokens)
+        examples["answers"].append(
+            {
+                "type": list(QUERIES),
+                "text": [" ".join(passage_tokens[s:e]) for s, e in zip(starts, ends)],
+                "start_pos": starts.tolist(),
+                "end_pos": ends.tolist(),
+            }
+        )
+    return Dataset.from_dict(examples)
+
+
+def to_mrc_dataset(plain_dataset):
+    """
+    Expand a plain dataset into an MRC dataset in the same way as the `genia_mrc` config does.
+    """
+
+    examples = {"question": [], "passage_tokens": [], "answers": []}
+    for passage_tokens, answers in zip(
+        plain_dataset["passage_tokens"], plain_dataset["answers"]
+    ):
+        for tag, question in QUERIES.items():
+            idx = [i for i, t in enumerate(answers["type"]) if t == tag]
+            examples["question"].append(question)
+            examples["passage_tokens"].append(passage_tokens)
+            examples["answers"].append(
+                {key: [answers[key][i] for i in idx] for key in answers}
+                if idx
+                else {"type": [tag], "text": [None], "start_pos": [-1], "end_pos": [-1]}
+            )
+    return Dataset.from_dict(examples)
+
+
+def forward_throughput(model, features, collator, batch_size, device):
+    """
+    Seconds of running the model over all features (sorted by length, as evaluation does).
+    """
+
+    order = np.argsort(-np.asarray(features["length"]), kind="stable")
+    model.to(device).eval()
+    start = time.perf_counter()
+    with torch.no_grad():
+        for i in range(0, len(order), batch_size):
+            batch = collator([features[int(idx)] for idx in order[i : i + batch_size]])
+            batch.pop("labels")
+            model(**{key: value.to(device) for key, value in batch.items()})
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return time.perf_counter() - start
+
+
+def read_f1(output_dir):
+    with open(
+        os.path.join(output_dir, "eval_results.json"), "r", encoding="utf-8"
+    ) as f:
+        return json.load(f).get("eval_overall_f1")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="bert-base-uncased")
+    parser.add_argument("--n_passages", type=int, default=2000)
+    parser.add_argument("--n_words", type=int, default=27)
+    parser.add_argument("--max_seq_length", type=int, default=512)
+    parser.add_argument("--doc_stride", type=int, default=128)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument(
+        "--device", default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    parser.add_argument(
+        "--random_init",
+        action="store_true",
+        help="Build the encoder from its config only, since throughput does not depend on weights.",
+    )
+    parser.add_argument(
+        "--mrc_output_dir",
+        default=None,
+        help="Output dir of run_ner with genia_mrc_config.json, to read its eval F1.",
+    )
+    parser.add_argument(
+        "--packed_output_dir",
+        default=None,
+        help="Output dir of run_ner with genia_packed_config.json, to read its eval F1.",
+    )
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model, use_fast=True)
+    config = AutoConfig.from_pretrained(args.model, num_labels=len(LABEL_TO_ID))
+    if args.random_init:
+        encoder = AutoModel.from_config(config)
+        per_query_model = AutoModelForTokenClassification.from_config(config)
+    else:
+        encoder = AutoModel.from_pretrained(args.model, config=config)
+        per_query_model = AutoModelForTokenClassification.from_pretrained(
+            args.model, config=config
+        )
+    packed_model = PackedQueryModelForTokenClassification(
+        encoder, QUERIES, len(LABEL_TO_ID)
+    )
+    collator = DataCollatorWithDynamicPadding.from_tokenizer(tokenizer)
+
+    plain_dataset = make_plain_dataset(tokenizer, args.n_passages, args.n_words)
+    mrc_dataset = to_mrc_dataset(plain_dataset)
+    settings = dict(
+        tokenizer=tokenizer,
+        label_to_id=LABEL_TO_ID,
+        max_seq_length=args.max_seq_length,
+        doc_stride=args.doc_stride,
+        padding_strategy="do_not_pad",
+    )
+    runs = [
+        ("one query per example", mrc_dataset, Featurizer(**settings), per_query_model),
+        (
+            "packed queries",
+            plain_dataset,
+            Featurizer(queries=QUERIES, **settings),
+            packed_model,
+        ),
+    ]
+
+    print(f"{args.n_passages} passages, {len(QUERIES)} queries, device={args.device}")
+    baseline = None
+    for name, dataset, featurizer, model in runs:
+        features = dataset.map(
+            featurizer,
+            batched=True,
+            load_from_cache_file=False,
+            remove_columns=dataset.column_names,
+        )
+        elapsed = forward_throughput(
+            model, features, collator, args.batch_size, args.device
+        )
+        baseline = baseline or elapsed
+        print(
+            f"{name}: {len(features)} features, {sum(features['length'])} tokens, "
+            f"{elapsed:.2f} s, {args.n_passages / elapsed:.1f} passages/s, "
+            f"speedup {baseline / elapsed:.2f}x"
+        )
+
+    if args.mrc_output_dir and args.packed_output_dir:
+        print(
+            f"eval F1: one query per example {read_f1(args.mrc_output_dir)}, "
+            f"packed queries {read_f1(args.packed_output_dir)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
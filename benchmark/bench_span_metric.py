@@ -0,0 +1,189 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Parity and speed of the built-in span metric v.s. seqeval, on random tags or tags of a dev set
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+import numpy as np
+from seqeval.metrics import accuracy_score, classification_report
+from utils.data_structure.tag_scheme import IOB2, IOBES
+from utils.evaluation.span_metric import SpanMetric
+
+LABEL_LISTS = {"iob2": ["O", "B", "I"], "iobes": ["O", "B", "I", "E", "S"]}
+
+
+def seqeval_compute(predictions, references):
+    """
+    `load_metric("seqeval").compute` (default mode), built on the seqeval package so that it runs offline.
+    """
+
+    report = classification_report(
+        y_true=references, y_pred=predictions, output_dict=True
+    )
+    report.pop("macro avg")
+    report.pop("weighted avg")
+    overall_score = report.pop("micro avg")
+    scores = {
+        type_name: {
+            "precision": score["precision"],
+            "recall": score["recall"],
+            "f1": score["f1-score"],
+            "number": score["support"],
+        }
+        for type_name, score in report.items()
+    }
+    scores["overall_precision"] = overall_score["precision"]
+    scores["overall_recall"] = overall_score["recall"]
+    scores["overall_f1"] = overall_score["f1-score"]
+    scores["overall_accuracy"] = accuracy_score(y_true=references, y_pred=predictions)
+    return scores
+
+
+def paint(n_words, spans, label_strategy):
+    """
+    Tags of a sentence with spans of (start, end) words, end exclusive.
+    """
+
+    tags = ["O"] * n_words
+    for start, end in spans:
+        end = min(max(end, start + 1), n_words)
+        if label_strategy == "iobes" and end - start == 1:
+            tags[start] = "S"
+            continue
+        tags[start] = "B"
+        for i in range(start + 1, end):
+            tags[i] = "I"
+        if label_strategy == "iobes":
+            tags[end - 1] = "E"
+    return tags
+
+
+def perturb(tags, label_list, rng, noise):
+    """
+    Predictions of a model that errs on a fraction `noise` of tokens, which also yields invalid sequences, e.g. O I.
+    """
+
+    tags = list(tags)
+    for i in np.flatnonzero(rng.rand(len(tags)) < noise):
+        tags[i] = label_list[rng.randint(len(label_list))]
+    return tags
+
+
+def random_sentences(n_sentences, label_list, rng):
+    lengths = rng.randint(1, 60, size=n_sentences)
+    return [
+        [label_list[i] for i in rng.randint(len(label_list), size=n)] for n in lengths
+    ]
+
+
+def dev_sentences(config_file, label_strategy):
+    """
+    Gold tags of each (passage, type) of the validation split of a run_ner config.
+    """
+
+    from datasets import load_dataset
+    from utils.prediction.query_filter import group_passages
+
+    with open(config_file, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    dataset = load_dataset(
+        path=config["dataset_script_file"],
+        name=config["dataset_config_name"],
+        cache_dir=config.get("data_dir"),
+    )["validation"]
+    sentences = list()
+    for passage in group_passages(dataset):
+        n_words = len(passage["passage_tokens"])
+        types = sorted(set(ans["type"] for ans in passage["answers"])) or [None]
+        for type in types:
+            spans = [
+                (ans["start_pos"], ans["end_pos"])
+                for ans in passage["answers"]
+                if ans["type"] == type
+            ]
+            sentences.append(paint(n_words, spans, label_strategy))
+    return sentences
+
+
+def assert_same(actual, expected):
+    assert actual.keys() == expected.keys(), (actual.keys(), expected.keys())
+    for key, value in expected.items():
+        if isinstance(value, dict):
+            for n, v in value.items():
+                assert actual[key][n] == v, (key, n, actual[key][n], v)
+        else:
+            assert actual[key] == value, (key, actual[key], value)
+
+
+def compare(name, references, predictions, label_list, scheme):
+    metric = SpanMetric(label_list, scheme=scheme)
+    lengths = [len(tags) for tags in references]
+    label_to_id = {tag: i for i, tag in enumerate(label_list)}
+    pred_ids = np.asarray([label_to_id[t] for tags in predictions for t in tags])
+    true_ids = np.asarray([label_to_id[t] for tags in references for t in tags])
+
+    start = time.perf_counter()
+    expected = seqeval_compute(predictions, references)
+    seqeval_elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = metric.compute_ids(pred_ids, true_ids, lengths)
+    elapsed = time.perf_counter() - start
+    assert_same(actual, expected)
+    assert_same(metric.compute(predictions, references), expected)
+    print(
+        f"{name}: {len(references)} sentences, {len(true_ids)} tokens, overall_f1 {actual['overall_f1']:.4f} (identical), "
+        f"seqeval {seqeval_elapsed:.2f} s, span metric {elapsed:.3f} s, speedup {seqeval_elapsed / elapsed:.0f}x"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_sentences", type=int, default=20000)
+    parser.add_argument("--noise", type=float, default=0.1)
+    parser.add_argument(
+        "--config",
+        nargs="*",
+        default=list(),
+        help="run_ner configs whose validation split is also compared, e.g. run/configs/genia_mrc_config.json",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    for label_strategy, scheme in [("iob2", IOB2), ("iobes", IOBES)]:
+        label_list = LABEL_LISTS[label_strategy]
+        references = random_sentences(args.n_sentences, label_list, rng)
+        predictions = [perturb(tags, label_list, rng, 0.5) for tags in references]
+        compare(f"random {label_strategy}", references, predictions, label_list, scheme)
+
+        # Typed tags, as seqeval is used elsewhere, e.g. B-DNA and I-protein.
+        typed_list = ["O"] + [
+            f"{prefix}-{type}"
+            for type in ["DNA", "RNA", "protein"]
+            for prefix in label_list[1:]
+        ]
+        references = random_sentences(args.n_sentences, typed_list, rng)
+        predictions = [perturb(tags, typed_list, rng, 0.5) for tags in references]
+        compare(f"typed {label_strategy}", references, predictions, typed_list, scheme)
+
+        for config_file in args.config:
+            references = dev_sentences(config_file, label_strategy)
+            predictions = [
+                perturb(tags, label_list, rng, args.noise) for tags in references
+            ]
+            compare(
+                f"{config_file} {label_strategy}",
+                references,
+                predictions,
+                label_list,
+                scheme,
+            )
+
+
+if __name__ == "__main__":
+    main()
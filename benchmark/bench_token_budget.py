@@ -0,0 +1,136 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Benchmark of training with a fixed batch size v.s. a token budget per batch
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, RandomSampler
+from transformers import AutoConfig, AutoModelForTokenClassification, AutoTokenizer
+from utils.feature_generation.feature_generation import Featurizer
+from utils.feature_generation.collator import DataCollatorWithDynamicPadding
+from utils.feature_generation.sampler import (
+    LengthGroupedSampler,
+    TokenBudgetBatchSampler,
+)
+from benchmark.bench_featurizer_workers import make_mrc_dataset
+
+LABEL_TO_ID = {"O": 0, "B": 1, "I": 2}
+
+
+def batches_of(sampler, batch_size):
+    order = list(sampler)
+    return [order[i : i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def train_throughput(model, features, batches, collator, device):
+    """
+    Seconds of one epoch of forward, backward and optimizer steps over batches of feature indices.
+    """
+
+    model.to(device).train()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=5e-5)
+    dataloader = DataLoader(features, batch_sampler=batches, collate_fn=collator)
+    start = time.perf_counter()
+    for batch in dataloader:
+        loss = model(**{key: value.to(device) for key, value in batch.items()})[0]
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+    if device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="bert-base-uncased")
+    parser.add_argument("--n_passages", type=int, default=1000)
+    parser.add_argument("--n_words", type=int, default=27)
+    parser.add_argument("--max_seq_length", type=int, default=512)
+    parser.add_argument("--doc_stride", type=int, default=128)
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument(
+        "--max_tokens_per_batch",
+        type=int,
+        nargs="+",
+        default=[512, 1024, 2048],
+    )
+    parser.add_argument(
+        "--device", default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    parser.add_argument(
+        "--random_init",
+        action="store_true",
+        help="Build the model from its config only, since throughput does not depend on weights.",
+    )
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model, use_fast=True)
+    config = AutoConfig.from_pretrained(args.model, num_labels=len(LABEL_TO_ID))
+    featurizer = Featurizer(
+        tokenizer=tokenizer,
+        label_to_id=LABEL_TO_ID,
+        max_seq_length=args.max_seq_length,
+        doc_stride=args.doc_stride,
+        padding_strategy="do_not_pad",
+    )
+    dataset = make_mrc_dataset(tokenizer, args.n_passages, args.n_words)
+    features = dataset.map(
+        featurizer,
+        batched=True,
+        load_from_cache_file=False,
+        remove_columns=dataset.column_names,
+    )
+    lengths = np.asarray(features["length"])
+    features = features.remove_columns(["length"])
+    collator = DataCollatorWithDynamicPadding.from_tokenizer(tokenizer)
+
+    runs = [
+        (
+            f"batch_size={args.batch_size}, random",
+            batches_of(RandomSampler(range(len(lengths))), args.batch_size),
+        ),
+        (
+            f"batch_size={args.batch_size}, group_by_length",
+            batches_of(LengthGroupedSampler(lengths, args.batch_size), args.batch_size),
+        ),
+    ] + [
+        (
+            f"max_tokens_per_batch={max_tokens}",
+            list(TokenBudgetBatchSampler(lengths, max_tokens)),
+        )
+        for max_tokens in args.max_tokens_per_batch
+    ]
+
+    print(
+        f"{len(lengths)} features, {lengths.sum()} tokens, "
+        f"length mean {lengths.mean():.1f} / max {lengths.max()}, device={args.device}"
+    )
+    baseline = None
+    for name, batches in runs:
+        padded = sum(len(b) * lengths[b].max() for b in batches)
+        torch.manual_seed(0)
+        model = (
+            AutoModelForTokenClassification.from_config(config)
+            if args.random_init
+            else AutoModelForTokenClassification.from_pretrained(
+                args.model, config=config
+            )
+        )
+        elapsed = train_throughput(model, features, batches, collator, args.device)
+        baseline = baseline or elapsed
+        print(
+            f"{name}: {len(batches)} steps, pad fraction {1 - lengths.sum() / padded:.3f}, "
+            f"{elapsed:.2f} s, {lengths.sum() / elapsed:.0f} tokens/s, "
+            f"{len(lengths) / elapsed:.1f} features/s, speedup {baseline / elapsed:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@
 # Author: Yu-Lun Chiang
 # Description: Definition of Custom Arguments
 
-from typing import List, Optional
+from typing import Dict, List, Optional
 from dataclasses import dataclass, field
 
 
@@ -28,24 +28,33 @@ class DataTrainingArguments:
     )
     train_file: Optional[str] = field(
         default=None,
-        metadata={"help": "The input training data file (a csv or JSON file)."},
+        metadata={
+            "help": "The input training data file (a json, jsonl or parquet file), in place of the default of the loading script."
+        },
     )
     validation_file: Optional[str] = field(
         default=None,
         metadata={
-            "help": "An optional input evaluation data file to evaluate on (a csv or JSON file)."
+            "help": "An optional input evaluation data file to evaluate on (a json, jsonl or parquet file)."
         },
     )
     test_file: Optional[str] = field(
         default=None,
         metadata={
-            "help": "An optional input test data file to predict on (a csv or JSON file)."
+            "help": "An optional input test data file to predict on (a json, jsonl or parquet file)."
         },
     )
     overwrite_cache: bool = field(
         default=False,
         metadata={"help": "Overwrite the cached training and evaluation sets"},
     )
+    feature_cache_dir: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "A directory to store features as memory-mapped Arrow shards, keyed by tokenizer, source files and featurization args. "
+            "Shards are reopened on repeat runs and only stale ones are rebuilt. `overwrite_cache` forces a rebuild."
+        },
+    )
     additional_tokens_file: Optional[str] = field(
         default=None,
         metadata={
@@ -75,12 +84,86 @@ class DataTrainingArguments:
             "help": "Two kinds of padding strategies are supported: `max_length` and `longest`. "
             "`max_length`: Pad to a maximum length specified with the argument of `max_length` in Tokenizer or to the maximum acceptable input length for the model if that argument is not provided in Tokenizer."
             "`longest`: Pad to the longest sequence in the batch (or nor padding if only a single sequence if provided). It may accelerate with GPU, but not with TPU."
-            "`do_not_pad`: Do not pad. It does not supported here, but you can test data in custom tokenizer."
+            "`do_not_pad`: Do not pad. Features are stored unpadded and each batch is padded to its longest feature by the data collator."
         },
     )
     label_strategy: str = field(
         default="iob2", metadata={"help": "" "`iob2`:" "`iobes`:"}
     )
+    encode_passage_once: bool = field(
+        default=False,
+        metadata={
+            "help": "Tokenize each unique passage of a batch once and reuse it for every query of MRC configs."
+        },
+    )
+    stitch_strategy: str = field(
+        default="mean",
+        metadata={
+            "help": "How to combine predictions of overlapping windows of a long passage. "
+            "`mean`: Average probabilities of all windows. "
+            "`max`: Keep the most confident window. "
+            "`centre`: Keep the window in which the word is the farthest from the edges."
+        },
+    )
+    pack_queries: bool = field(
+        default=False,
+        metadata={
+            "help": "Pack all questions of `query_file` into one sequence, so one forward pass tags every entity type. "
+            "It works with plain (non-MRC) configs, e.g. `genia`."
+        },
+    )
+    query_file: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "A json file that maps an entity type to its question, e.g. query.json of GENIA. Required by `pack_queries` and `mrc_view`."
+        },
+    )
+    mrc_view: bool = field(
+        default=False,
+        metadata={
+            "help": "Ask every question of `query_file` of each passage on the fly, over a plain (non-MRC) config, e.g. `genia`, "
+            "instead of caching one row per (passage, question) of a MRC config. Features are the same as those of the MRC config."
+        },
+    )
+    max_tokens_per_batch: Optional[int] = field(
+        default=None,
+        metadata={
+            "help": "Fill each batch of training, evaluation and prediction up to this number of tokens "
+            "(features times the longest of them) instead of a fixed batch size. "
+            "Batch sizes of `TrainingArguments` then only bound prediction batches."
+        },
+    )
+    argmax_eval_logits: bool = field(
+        default=True,
+        metadata={
+            "help": "Reduce logits of each evaluation batch to int8 label ids before they are gathered, "
+            "which cuts the memory of evaluation by about num_labels x 4 times."
+        },
+    )
+    streaming_eval_metrics: bool = field(
+        default=False,
+        metadata={
+            "help": "Gather span counts of each evaluation batch instead of label ids, "
+            "so the memory of evaluation does not grow with the size of the dev set."
+        },
+    )
+
+    @property
+    def data_files(self) -> Optional[Dict[str, str]]:
+        """
+        Files of splits that override those of the loading script, keyed by the split names of the loading scripts.
+        """
+
+        data_files = {
+            split: file
+            for split, file in [
+                ("train", self.train_file),
+                ("dev", self.validation_file),
+                ("test", self.test_file),
+            ]
+            if file
+        }
+        return data_files or None
 
 
 @dataclass
@@ -111,4 +194,73 @@ class ModelArguments:
         metadata={
             "help": "Path to directory to store the pretrained models downloaded from huggingface.co"
         },
-    )
\ No newline at end of file
+    )
+
+
+@dataclass
+class QuantizationArguments:
+    """
+    Arguments pertaining to dynamic int8 quantization of a trained model (see `run/quantize.py`).
+    """
+
+    quantize_model_dir: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "The dir of the trained model to quantize. Default to `output_dir`, where run_ner saves the model."
+        },
+    )
+    quantized_output_dir: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "The dir to publish the quantized model into. Default to `int8` under the model dir."
+        },
+    )
+    f1_tolerance: float = field(
+        default=0.01,
+        metadata={
+            "help": "The largest drop of overall F1 on the validation split (in absolute, e.g. 0.01 for 1 point) "
+            "that is allowed; beyond it, the quantized model is not published."
+        },
+    )
+    latency_batches: int = field(
+        default=20,
+        metadata={
+            "help": "The number of validation batches to time on CPU for fp32 and int8 models."
+        },
+    )
+
+
+@dataclass
+class QueryFilterArguments:
+    """
+    Arguments pertaining to the lexicon pre-filter of entity-type queries (see `run/query_filter.py`).
+    """
+
+    query_filter_dir: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "The dir to save query_filter.json and its report into. Default to `output_dir`. "
+            "If a trained model is there, F1 and speed of prediction are measured for each threshold."
+        },
+    )
+    query_filter_thresholds: List[float] = field(
+        default_factory=lambda: [0.0, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1],
+        metadata={"help": "Thresholds to report recall v.s. speed of."},
+    )
+    query_filter_f1_tolerance: float = field(
+        default=0.01,
+        metadata={
+            "help": "The largest drop of F1 (or of answer recall, if no model is measured) "
+            "allowed when choosing the threshold to save."
+        },
+    )
+    query_filter_smoothing: float = field(
+        default=1.0,
+        metadata={"help": "Added to the passage count of a word in its score."},
+    )
+    query_filter_min_count: int = field(
+        default=1,
+        metadata={
+            "help": "The fewest training passages in which a word is inside an answer of a type to keep it."
+        },
+    )
@@ -0,0 +1,84 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Export the model saved by run_ner to ONNX and check its parity with PyTorch
+
+import argparse
+import logging
+import logging.config
+import os
+import sys
+
+sys.path.append(os.getcwd())
+from transformers import AutoModelForTokenClassification, AutoTokenizer
+from utils.model.onnx_model import (
+    ONNX_WEIGHTS_NAME,
+    OnnxModelForTokenClassification,
+    check_parity,
+    dummy_inputs,
+    export_onnx,
+)
+from utils.model.packed_query_model import (
+    PACKED_CONFIG_NAME,
+    PackedQueryModelForTokenClassification,
+)
+
+logging.config.fileConfig("logging.conf")
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model_dir",
+        required=True,
+        help="The output dir of run_ner, i.e. where `trainer.save_model()` writes.",
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        help=f"A path of the onnx file. Default to {ONNX_WEIGHTS_NAME} in model_dir, where the ONNX backend looks for it.",
+    )
+    parser.add_argument("--opset_version", type=int, default=12)
+    parser.add_argument(
+        "--atol",
+        type=float,
+        default=1e-4,
+        help="The max absolute difference of logits allowed between ONNX and PyTorch.",
+    )
+    args = parser.parse_args()
+    output_file_path = args.output or os.path.join(args.model_dir, ONNX_WEIGHTS_NAME)
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model_dir, use_fast=True)
+    model_input_names = ["input_ids", "attention_mask"]
+    if "token_type_ids" in tokenizer.model_input_names:
+        model_input_names.append("token_type_ids")
+    if os.path.isfile(os.path.join(args.model_dir, PACKED_CONFIG_NAME)):
+        model = PackedQueryModelForTokenClassification.from_pretrained(args.model_dir)
+        model_input_names.append("query_ids")
+    else:
+        model = AutoModelForTokenClassification.from_pretrained(args.model_dir)
+
+    export_onnx(
+        model,
+        tokenizer,
+        output_file_path,
+        model_input_names,
+        opset_version=args.opset_version,
+    )
+
+    # Parity with PyTorch over several batch sizes and sequence lengths, which exercises the dynamic axes.
+    onnx_model = OnnxModelForTokenClassification(output_file_path, model.config)
+    for batch_size, seq_len in [(1, 8), (2, 16), (4, 64), (8, 128)]:
+        diff = check_parity(
+            model,
+            onnx_model,
+            dummy_inputs(tokenizer, model_input_names, batch_size, seq_len),
+            atol=args.atol,
+        )
+        logger.info(
+            f"Parity of batch_size={batch_size}, seq_len={seq_len}: max abs diff {diff:.2e}"
+        )
+
+
+if __name__ == "__main__":
+    main()
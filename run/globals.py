@@ -8,6 +8,8 @@ global max_seq_length
 global doc_stride
 global padding_strategy
 global label_strategy
+global encode_passage_once
+global queries
 global pad_on_right
 global label_to_id
 global id_to_label
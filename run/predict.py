@@ -0,0 +1,174 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Stream JSONL passages through a trained tagger and print JSONL spans
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+from utils.feature_generation.strategy import StitchStrategy
+from utils.prediction.predictor import Predictor
+from utils.prediction.query_filter import LexiconQueryFilter
+
+# Logs go to stderr, since stdout carries predictions.
+logging.basicConfig(
+    stream=sys.stderr,
+    level=logging.INFO,
+    format="%(asctime)s - [%(filename)s:%(lineno)d] - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%m/%d/%Y-%H:%M:%S",
+)
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Read JSONL passages, e.g. {"pid": "1", "passage": "..."}, '
+        "and write one JSONL line of answers per passage in the same order."
+    )
+    parser.add_argument(
+        "--model_dir",
+        required=True,
+        help="The output dir of run_ner, with model, tokenizer and featurizer_config.json.",
+    )
+    parser.add_argument(
+        "--input", default="-", help="A JSONL file of passages, or `-` for stdin."
+    )
+    parser.add_argument(
+        "--output", default="-", help="A JSONL file of answers, or `-` for stdout."
+    )
+    parser.add_argument(
+        "--query_file",
+        default=None,
+        help="A json file that maps an entity type to its question. Required by MRC models.",
+    )
+    parser.add_argument(
+        "--max_tokens_per_batch",
+        type=int,
+        default=8192,
+        help="Token budget of a micro-batch, counted with paddings.",
+    )
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=256,
+        help="The number of passages to featurize at a time.",
+    )
+    parser.add_argument(
+        "--stitch_strategy",
+        default=StitchStrategy.MEAN.value,
+        choices=[s.value for s in StitchStrategy],
+    )
+    parser.add_argument(
+        "--backend",
+        default="torch",
+        choices=["torch", "onnx", "int8"],
+        help="`onnx` runs model.onnx of model_dir (see run/export_onnx.py) with onnxruntime on CPU. "
+        "`int8` runs the quantized model dir published by run/quantize.py on CPU.",
+    )
+    parser.add_argument(
+        "--query_filter_dir",
+        default=None,
+        help="A dir with query_filter.json of run/query_filter.py, to skip entity types that a passage is unlikely to have.",
+    )
+    parser.add_argument(
+        "--query_filter_threshold",
+        type=float,
+        default=None,
+        help="Override the threshold saved in query_filter.json.",
+    )
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=0,
+        help="The number of (passage, question) results to keep in an LRU cache. 0 disables the cache.",
+    )
+    parser.add_argument(
+        "--cache_path",
+        default=None,
+        help="A sqlite file that persists cached results across runs. Used only if cache_size > 0.",
+    )
+    parser.add_argument("--device", default=None)
+    return parser.parse_args()
+
+
+def read_passages(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def main():
+    args = parse_args()
+
+    queries = None
+    if args.query_file:
+        with open(args.query_file, "r", encoding="utf-8") as f:
+            queries = json.load(f)
+    query_filter = None
+    if args.query_filter_dir:
+        query_filter = LexiconQueryFilter.from_pretrained(args.query_filter_dir)
+        if args.query_filter_threshold is not None:
+            query_filter.threshold = args.query_filter_threshold
+        logger.info(query_filter)
+    predictor = Predictor.from_pretrained(
+        args.model_dir,
+        backend=args.backend,
+        batch_size=args.batch_size,
+        device=args.device,
+        queries=queries,
+        stitch_strategy=args.stitch_strategy,
+        max_tokens_per_batch=args.max_tokens_per_batch,
+        query_filter=query_filter,
+        cache_size=args.cache_size,
+        cache_path=args.cache_path,
+    )
+    logger.info(f"{predictor.featurizer}, device={predictor.device}")
+
+    fin = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    fout = (
+        sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    )
+    n_passages = 0
+    start = time.perf_counter()
+    try:
+        for data in predictor.predict_passages(
+            read_passages(fin), chunk_size=args.chunk_size
+        ):
+            fout.write(
+                json.dumps(
+                    {
+                        "pid": data.pid,
+                        "passage": data.passage,
+                        "answers": [dict(ans._asdict()) for ans in data.answers],
+                    },
+                    ensure_ascii=False,
+                )
+                + "\n"
+            )
+            n_passages += 1
+    finally:
+        fout.flush()
+        if fin is not sys.stdin:
+            fin.close()
+        if fout is not sys.stdout:
+            fout.close()
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        logger.info(
+            f"{n_passages} passages, {predictor.n_features} features, {predictor.n_tokens} tokens, "
+            f"{predictor.n_pruned} pruned (passage, type) pairs "
+            f"in {elapsed:.2f} s: {n_passages / elapsed:.1f} passages/s, "
+            f"{predictor.n_tokens / elapsed:.0f} tokens/s"
+        )
+        if predictor.result_cache is not None:
+            predictor.result_cache.close()
+            logger.info(f"Result cache: {predictor.result_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Quantize the model saved by run_ner to dynamic int8, guarded by F1 on the validation split
+
+import json
+import logging
+import logging.config
+import os
+import sys
+from itertools import islice
+
+sys.path.append(os.getcwd())
+import run.globals as globals
+from run.args import DataTrainingArguments, ModelArguments, QuantizationArguments
+from run.run_ner import create_features
+from transformers import (
+    HfArgumentParser,
+    TrainingArguments,
+    set_seed,
+    AutoTokenizer,
+    AutoModelForTokenClassification,
+)
+from datasets import load_dataset
+from utils.feature_generation.feature_generation import Featurizer
+from utils.feature_generation.feature_store import FeatureStore
+from utils.feature_generation.collator import DataCollatorWithDynamicPadding
+from utils.feature_generation.mrc_view import mrc_views
+from utils.trainer.trainer import QASLTrainer
+from utils.model.packed_query_model import (
+    PACKED_CONFIG_NAME,
+    PackedQueryModelForTokenClassification,
+)
+from utils.model.quantized_model import (
+    measure_latency,
+    model_size,
+    quantize_dynamic,
+    save_quantized,
+)
+from utils.evaluation.evaluation import compute_metrics
+from utils.evaluation.span_metric import SpanMetric
+
+logging.config.fileConfig("logging.conf")
+logger = logging.getLogger(__name__)
+
+
+def main():
+
+    logger.info("============ Parse Args ============")
+
+    parser = HfArgumentParser(
+        (
+            ModelArguments,
+            DataTrainingArguments,
+            TrainingArguments,
+            QuantizationArguments,
+        )
+    )
+    if len(sys.argv) == 2 and sys.argv[1].endswith(".json"):
+        model_args, data_args, training_args, quant_args = parser.parse_json_file(
+            json_file=os.path.abspath(sys.argv[1])
+        )
+    else:
+        raise ValueError(
+            "The second argv of sys must be a config.json, e.g. python run/quantize.py configs/config.json."
+        )
+    model_dir = quant_args.quantize_model_dir or training_args.output_dir
+    output_dir = quant_args.quantized_output_dir or os.path.join(model_dir, "int8")
+    # Dynamic quantization runs on CPU only, so both models are evaluated and timed on CPU.
+    # Metrics are saved next to eval_results.json of the model.
+    training_args.no_cuda = True
+    training_args.output_dir = model_dir
+    logger.debug(f"quant_args: {quant_args}")
+    set_seed(training_args.seed)
+
+    logger.info("============ Load Tokenizer, Featurizer, Model ============")
+
+    globals.tokenizer = AutoTokenizer.from_pretrained(model_dir, use_fast=True)
+    featurizer = Featurizer.from_pretrained(globals.tokenizer, model_dir)
+    logger.debug(featurizer)
+    if os.path.isfile(os.path.join(model_dir, PACKED_CONFIG_NAME)):
+        model = PackedQueryModelForTokenClassification.from_pretrained(model_dir)
+    else:
+        model = AutoModelForTokenClassification.from_pretrained(model_dir)
+    globals.id_to_label = {int(k): v for k, v in model.config.id2label.items()}
+    globals.label_to_id = {v: k for k, v in globals.id_to_label.items()}
+    globals.label_list = [
+        globals.id_to_label[i] for i in range(len(globals.id_to_label))
+    ]
+    globals.metric = SpanMetric(globals.label_list)
+
+    logger.info("============ Create Features ============")
+
+    dataset = load_dataset(
+        path=data_args.dataset_script_file,
+        name=data_args.dataset_config_name,
+        data_files=data_args.data_files,
+        cache_dir=data_args.data_dir,
+    )
+    if data_args.mrc_view:
+        if not data_args.query_file:
+            raise ValueError("--mrc_view requires a query_file")
+        with open(data_args.query_file, "r", encoding="utf-8") as f:
+            dataset = mrc_views(dataset, json.load(f))
+    if "validation" not in dataset:
+        raise ValueError("Quantization requires a validation dataset")
+    feature_store = (
+        FeatureStore(data_args.feature_cache_dir)
+        if data_args.feature_cache_dir
+        else None
+    )
+    eval_dataset = create_features(
+        dataset["validation"], "validation", featurizer, data_args, feature_store
+    )
+
+    def evaluate(model):
+        trainer = QASLTrainer(
+            model=model,
+            args=training_args,
+            tokenizer=globals.tokenizer,
+            data_collator=DataCollatorWithDynamicPadding.from_tokenizer(
+                globals.tokenizer
+            ),
+            eval_dataset=eval_dataset,
+            compute_metrics=compute_metrics,
+            max_tokens_per_batch=data_args.max_tokens_per_batch,
+            argmax_logits=data_args.argmax_eval_logits,
+            streaming_metric=(
+                globals.metric if data_args.streaming_eval_metrics else None
+            ),
+        )
+        return trainer, trainer.evaluate()
+
+    logger.info("============ Evaluate fp32 ============")
+    trainer, fp32_metrics = evaluate(model)
+    logger.debug(fp32_metrics)
+    batches = list(islice(trainer.get_eval_dataloader(), quant_args.latency_batches))
+    fp32_latency = measure_latency(model, batches)
+    fp32_size = model_size(model)
+
+    logger.info("============ Quantize and Evaluate int8 ============")
+    int8_model = quantize_dynamic(model)
+    trainer, int8_metrics = evaluate(int8_model)
+    logger.debug(int8_metrics)
+    int8_latency = measure_latency(int8_model, batches)
+    int8_size = model_size(int8_model)
+
+    f1_drop = fp32_metrics["eval_overall_f1"] - int8_metrics["eval_overall_f1"]
+    published = f1_drop <= quant_args.f1_tolerance
+    metrics = {
+        "fp32_overall_f1": fp32_metrics["eval_overall_f1"],
+        "int8_overall_f1": int8_metrics["eval_overall_f1"],
+        "f1_drop": f1_drop,
+        "f1_tolerance": quant_args.f1_tolerance,
+        "published": published,
+        "fp32_latency_p50_ms": fp32_latency["p50_ms"],
+        "int8_latency_p50_ms": int8_latency["p50_ms"],
+        "latency_delta_ms": round(int8_latency["p50_ms"] - fp32_latency["p50_ms"], 3),
+        "latency_speedup": round(fp32_latency["p50_ms"] / int8_latency["p50_ms"], 3),
+        "latency_batches": fp32_latency["n_batches"],
+        "fp32_size_mb": round(fp32_size / 2**20, 3),
+        "int8_size_mb": round(int8_size / 2**20, 3),
+        "size_delta_mb": round((int8_size - fp32_size) / 2**20, 3),
+        "size_ratio": round(int8_size / fp32_size, 3),
+    }
+    metrics.update({f"int8_{k}": v for k, v in int8_metrics.items()})
+    trainer.log_metrics("quantize", metrics)
+    trainer.save_metrics("quantize", metrics)
+
+    logger.info("============ Publish ============")
+    if not published:
+        sys.exit(
+            f"Overall F1 drops by {f1_drop:.4f} after quantization, beyond the tolerance {quant_args.f1_tolerance}. "
+            f"The quantized model is not published."
+        )
+    save_quantized(int8_model, output_dir)
+    globals.tokenizer.save_pretrained(output_dir)
+    featurizer.save_pretrained(output_dir)
+
+
+if __name__ == "__main__":
+    main()
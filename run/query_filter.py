@@ -0,0 +1,225 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Build the lexicon query filter from train answers and report its recall v.s. speed on the validation split
+
+import json
+import logging
+import logging.config
+import os
+import sys
+import time
+from typing import Dict, List, Set, Tuple
+
+sys.path.append(os.getcwd())
+from run.args import DataTrainingArguments, ModelArguments, QueryFilterArguments
+from transformers import HfArgumentParser, TrainingArguments
+from datasets import load_dataset
+from utils.feature_generation.feature_generation import Featurizer
+from utils.prediction.predictor import Predictor
+from utils.prediction.query_filter import (
+    QUERY_FILTER_NAME,
+    LexiconQueryFilter,
+    group_passages,
+)
+
+logging.config.fileConfig("logging.conf")
+logger = logging.getLogger(__name__)
+
+
+def span_f1(
+    gold: List[Set[Tuple[str, int, int]]], pred: List[Set[Tuple[str, int, int]]]
+) -> Dict[str, float]:
+    """
+    Micro precision, recall and F1 of exact (type, start_pos, end_pos) spans over passages.
+    """
+
+    n_correct = sum(len(g & p) for g, p in zip(gold, pred))
+    n_gold = sum(map(len, gold))
+    n_pred = sum(map(len, pred))
+    precision = n_correct / n_pred if n_pred else 0.0
+    recall = n_correct / n_gold if n_gold else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1}
+
+
+def lexicon_report(
+    query_filter: LexiconQueryFilter,
+    passages: List[Dict],
+    types: List[str],
+    threshold: float,
+) -> Dict[str, float]:
+    """
+    Recall of (passage, type) pairs with answers, and of answers, that the filter keeps,
+    and the fraction of pairs (forward passes of MRC) and of passages (of packed queries) that are kept.
+    """
+
+    n_pairs = n_kept = n_positive = n_positive_kept = 0
+    n_answers = n_answers_kept = n_passages_kept = 0
+    for passage in passages:
+        selected = set(query_filter.select(passage["passage_tokens"], threshold))
+        kept = [t for t in types if t in selected or t not in query_filter.lexicon]
+        answer_types = [ans["type"] for ans in passage["answers"]]
+        n_pairs += len(types)
+        n_kept += len(kept)
+        n_positive += len(set(answer_types))
+        n_positive_kept += len(set(answer_types) & set(kept))
+        n_answers += len(answer_types)
+        n_answers_kept += sum(t in kept for t in answer_types)
+        n_passages_kept += bool(kept)
+    return {
+        "threshold": threshold,
+        "pair_recall": n_positive_kept / max(n_positive, 1),
+        "answer_recall": n_answers_kept / max(n_answers, 1),
+        "kept_pairs": n_kept / max(n_pairs, 1),
+        "kept_passages": n_passages_kept / max(len(passages), 1),
+    }
+
+
+def prediction_report(
+    predictor: Predictor, passages: List[Dict], threshold: float
+) -> Dict[str, float]:
+    """
+    Span F1 and speed of predicting passages with the filter at the threshold.
+    """
+
+    predictor.query_filter.threshold = threshold
+    predictor.n_features = predictor.n_tokens = predictor.n_pruned = 0
+    start = time.perf_counter()
+    data = list(
+        predictor.predict_passages(
+            {key: passage[key] for key in ("pid", "passage", "passage_tokens")}
+            for passage in passages
+        )
+    )
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    scores = span_f1(
+        [
+            set((a["type"], a["start_pos"], a["end_pos"]) for a in passage["answers"])
+            for passage in passages
+        ],
+        [set((a.type, a.start_pos, a.end_pos) for a in d.answers) for d in data],
+    )
+    scores.update(
+        {
+            "features": predictor.n_features,
+            "pruned_pairs": predictor.n_pruned,
+            "passages_per_second": len(passages) / elapsed,
+        }
+    )
+    return scores
+
+
+def main():
+
+    logger.info("============ Parse Args ============")
+
+    parser = HfArgumentParser(
+        (ModelArguments, DataTrainingArguments, TrainingArguments, QueryFilterArguments)
+    )
+    if len(sys.argv) == 2 and sys.argv[1].endswith(".json"):
+        model_args, data_args, training_args, filter_args = parser.parse_json_file(
+            json_file=os.path.abspath(sys.argv[1])
+        )
+    else:
+        raise ValueError(
+            "The second argv of sys must be a config.json, e.g. python run/query_filter.py configs/config.json."
+        )
+    if not data_args.query_file:
+        raise ValueError("The query filter requires a query_file")
+    with open(data_args.query_file, "r", encoding="utf-8") as f:
+        queries = json.load(f)
+    types = list(queries)
+    output_dir = filter_args.query_filter_dir or training_args.output_dir
+    logger.debug(f"filter_args: {filter_args}")
+
+    logger.info("============ Load Dataset ============")
+
+    dataset = load_dataset(
+        path=data_args.dataset_script_file,
+        name=data_args.dataset_config_name,
+        data_files=data_args.data_files,
+        cache_dir=data_args.data_dir,
+    )
+    if "train" not in dataset or "validation" not in dataset:
+        raise ValueError("The query filter requires train and validation datasets")
+
+    logger.info("============ Fit Lexicon ============")
+
+    query_filter = LexiconQueryFilter.fit(
+        group_passages(dataset["train"]),
+        types=types,
+        smoothing=filter_args.query_filter_smoothing,
+        min_count=filter_args.query_filter_min_count,
+    )
+    logger.info(query_filter)
+    passages = list(group_passages(dataset["validation"]))
+
+    logger.info("============ Report Recall v.s. Speed ============")
+
+    predictor = None
+    if os.path.isfile(os.path.join(output_dir, Featurizer.CONFIG_NAME)):
+        predictor = Predictor.from_pretrained(
+            output_dir,
+            batch_size=training_args.eval_batch_size,
+            device=training_args.device,
+            queries=queries,
+            stitch_strategy=data_args.stitch_strategy,
+            query_filter=query_filter,
+        )
+    else:
+        logger.info(
+            f"No trained model in {output_dir}, so only the lexicon is reported."
+        )
+
+    if predictor is not None:
+        # Warm up, so the first threshold is not charged for it.
+        prediction_report(predictor, passages[:8], 0.0)
+    thresholds = sorted(set([0.0] + filter_args.query_filter_thresholds))
+    report = list()
+    for threshold in thresholds:
+        row = lexicon_report(query_filter, passages, types, threshold)
+        if predictor is not None:
+            row.update(prediction_report(predictor, passages, threshold))
+        report.append(row)
+    # Threshold 0 asks every type, which is the baseline.
+    baseline = report[0]
+    for row in report:
+        if predictor is not None:
+            row["f1_drop"] = baseline["f1"] - row["f1"]
+            row["speedup"] = (
+                row["passages_per_second"] / baseline["passages_per_second"]
+            )
+        logger.info(
+            ", ".join(
+                f"{k}={v:.4f}" if isinstance(v, float) else f"{k}={v}"
+                for k, v in row.items()
+            )
+        )
+
+    # The largest threshold that keeps F1 (or answer recall) within tolerance.
+    tolerance = filter_args.query_filter_f1_tolerance
+    if predictor is not None:
+        within = [row for row in report if row["f1_drop"] <= tolerance]
+    else:
+        within = [row for row in report if 1 - row["answer_recall"] <= tolerance]
+    query_filter.threshold = max(row["threshold"] for row in within)
+    logger.info(f"Choose threshold {query_filter.threshold}")
+
+    query_filter.save_pretrained(output_dir)
+    output_file_path = os.path.join(output_dir, "query_filter_report.json")
+    with open(output_file_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "threshold": query_filter.threshold,
+                "tolerance": tolerance,
+                "measured": predictor is not None,
+                "report": report,
+            },
+            f,
+            indent=4,
+        )
+    logger.info(f"ALREADY SAVE {QUERY_FILTER_NAME} AND ITS REPORT INTO {output_dir}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,12 @@
 # Author: Yu-Lun Chiang
 # Description: run train, evaluate, or predict
 
+import json
 import logging
 import logging.config
 import os
 import sys
+from datetime import datetime
 
 sys.path.append(os.getcwd())
 import run.globals as globals
@@ -17,16 +19,59 @@ from transformers import (
     AutoConfig,
     AutoTokenizer,
     AutoModelForTokenClassification,
-    Trainer,
 )
-from datasets import load_dataset, load_metric
-from utils.feature_generation.feature_generation import tokenize_and_align_labels
+from datasets import load_dataset
+from utils.feature_generation.feature_generation import Featurizer
+from utils.feature_generation.question_cache import question_token_cache
+from utils.feature_generation.feature_store import FeatureStore
+from utils.feature_generation.collator import DataCollatorWithDynamicPadding
+from utils.feature_generation.sampler import pad_fraction_report
+from utils.feature_generation.mrc_view import MRCView, mrc_views
+from utils.trainer.trainer import QASLTrainer, get_lengths
+from utils.model.packed_query_model import PackedQueryModelForTokenClassification
+from utils.prediction.predictor import Predictor
+from utils.prediction.writer import MRCStructWriter
+from utils.prediction.query_filter import group_passages
 from utils.evaluation.evaluation import compute_metrics
+from utils.evaluation.span_metric import SpanMetric
+from utils.evaluation.nested_evaluation import NestedSpanEvaluator
+from utils.data_structure.tag_scheme import IOB2, IOBES
 
 logging.config.fileConfig("logging.conf")
 logger = logging.getLogger(__name__)
 
 
+def create_features(split_dataset, split, featurizer, data_args, feature_store=None):
+    """
+    Featurize a split, through the feature store if there is one.
+    """
+
+    if feature_store is not None:
+        extra = {
+            "dataset_name": data_args.dataset_name,
+            "dataset_config_name": data_args.dataset_config_name,
+        }
+        # A view shares the source files with its plain config, so its queries tell the shards apart.
+        if isinstance(split_dataset, MRCView):
+            extra["mrc_view_queries"] = split_dataset.queries
+        return feature_store.load_or_build(
+            split,
+            split_dataset,
+            featurizer,
+            num_proc=data_args.preprocessing_num_workers,
+            overwrite=data_args.overwrite_cache,
+            extra=extra,
+        )
+    return split_dataset.map(
+        featurizer,
+        batched=True,
+        num_proc=data_args.preprocessing_num_workers,
+        load_from_cache_file=not data_args.overwrite_cache,
+        remove_columns=split_dataset.column_names,
+        features=featurizer.features,
+    )
+
+
 def main():
 
     logger.info("============ Parse Args ============")
@@ -66,13 +111,26 @@ def main():
     globals.doc_stride = data_args.doc_stride
     globals.padding_strategy = data_args.padding_strategy
     globals.label_strategy = data_args.label_strategy
+    globals.encode_passage_once = data_args.encode_passage_once
+    queries = None
+    if data_args.query_file:
+        with open(data_args.query_file, "r", encoding="utf-8") as f:
+            queries = json.load(f)
+        logger.debug(f"queries: {queries}")
+    if data_args.pack_queries and not queries:
+        raise ValueError("--pack_queries requires a query_file")
+    if data_args.mrc_view and not queries:
+        raise ValueError("--mrc_view requires a query_file")
+    if data_args.mrc_view and data_args.pack_queries:
+        raise ValueError("--mrc_view and --pack_queries can not be used together")
+    globals.queries = queries if data_args.pack_queries else None
     if data_args.label_strategy == "iob2":
         globals.label_to_id = {"O": 0, "B": 1, "I": 2}
         globals.id_to_label = {0: "O", 1: "B", 2: "I"}
         globals.label_list = ["O", "B", "I"]
     elif data_args.label_strategy == "iobes":
         globals.label_to_id = {"O": 0, "B": 1, "I": 2, "E": 3, "S": 4}
-        globals.label_to_id = {0: "O", 1: "B", 2: "I", 3: "E", 4: "S"}
+        globals.id_to_label = {0: "O", 1: "B", 2: "I", 3: "E", 4: "S"}
         globals.label_list = ["O", "B", "I", "E", "S"]
 
     logger.info("============ Set Config, Tokenizer, Pretrained Model ============")
@@ -97,11 +155,19 @@ def main():
     )
     globals.pad_on_right = globals.tokenizer.padding_side == "right"
 
-    model = AutoModelForTokenClassification.from_pretrained(
-        model_args.model_name_or_path,
-        config=config,
-        cache_dir=model_args.cache_dir,
-    )
+    if data_args.pack_queries:
+        model = PackedQueryModelForTokenClassification.from_pretrained(
+            model_args.model_name_or_path,
+            queries=globals.queries,
+            config=config,
+            cache_dir=model_args.cache_dir,
+        )
+    else:
+        model = AutoModelForTokenClassification.from_pretrained(
+            model_args.model_name_or_path,
+            config=config,
+            cache_dir=model_args.cache_dir,
+        )
 
     logger.info("============ Add tokens that are might not in vocab.txt ============")
     if not data_args.additional_tokens_file:
@@ -117,76 +183,99 @@ def main():
 
     logger.info("============ Load Metirc ============")
 
-    globals.metric = load_metric("seqeval")
+    globals.metric = SpanMetric(
+        globals.label_list,
+        scheme=IOBES if data_args.label_strategy == "iobes" else IOB2,
+    )
 
     logger.info("============ Load Dataset ============")
 
     dataset = load_dataset(
         path=data_args.dataset_script_file,
         name=data_args.dataset_config_name,
+        data_files=data_args.data_files,
         cache_dir=data_args.data_dir,
     )
+    if data_args.mrc_view:
+        dataset = mrc_views(dataset, queries)
     logger.debug(dataset)
 
     logger.info("============ Create Features ============")
 
+    featurizer = Featurizer(
+        tokenizer=globals.tokenizer,
+        label_to_id=globals.label_to_id,
+        max_seq_length=data_args.max_seq_length,
+        doc_stride=data_args.doc_stride,
+        padding_strategy=data_args.padding_strategy,
+        label_strategy=data_args.label_strategy,
+        encode_passage_once=data_args.encode_passage_once,
+        queries=globals.queries,
+    )
+    logger.debug(featurizer)
+    feature_store = (
+        FeatureStore(data_args.feature_cache_dir)
+        if data_args.feature_cache_dir
+        else None
+    )
+
     if training_args.do_train:
         if "train" not in dataset:
             raise ValueError("--do_train requires a train dataset")
-        train_dataset = dataset["train"]
-        column_names = train_dataset.column_names
-        train_dataset = train_dataset.map(
-            tokenize_and_align_labels,
-            batched=True,
-            load_from_cache_file=not data_args.overwrite_cache,
-            remove_columns=column_names,
+        train_dataset = create_features(
+            dataset["train"], "train", featurizer, data_args, feature_store
         )
 
     if training_args.do_eval:
         if "validation" not in dataset:
             raise ValueError("--do_eval requires a validation dataset")
-        eval_dataset = dataset["validation"]
-        column_names = eval_dataset.column_names
-        eval_dataset = eval_dataset.map(
-            tokenize_and_align_labels,
-            batched=True,
-            load_from_cache_file=not data_args.overwrite_cache,
-            remove_columns=column_names,
+        eval_dataset = create_features(
+            dataset["validation"], "validation", featurizer, data_args, feature_store
         )
 
     if training_args.do_predict:
         if "test" not in dataset:
             raise ValueError("--do_predict requires a test dataset")
-        test_dataset = dataset["test"]
-        column_names = test_dataset.column_names
-        test_dataset = test_dataset.map(
-            tokenize_and_align_labels,
-            batched=True,
-            load_from_cache_file=not data_args.overwrite_cache,
-            remove_columns=column_names,
-        )
 
-    logger.debug(train_dataset)
-    for i in range(5):
-        logger.debug(
-            globals.tokenizer.convert_ids_to_tokens(train_dataset[i]["input_ids"])
+    # Counters of worker processes are not gathered back when preprocessing_num_workers > 1.
+    logger.debug(question_token_cache)
+    if training_args.do_train:
+        logger.debug(train_dataset)
+        for i in range(5):
+            logger.debug(
+                globals.tokenizer.convert_ids_to_tokens(train_dataset[i]["input_ids"])
+            )
+            logger.debug(train_dataset[i])
+            logger.debug("")
+
+    if training_args.do_train:
+        report = pad_fraction_report(
+            get_lengths(train_dataset),
+            training_args.train_batch_size,
+            data_args.max_seq_length,
+            seed=training_args.seed,
         )
-        logger.debug(train_dataset[i])
-        logger.debug("")
+        logger.info(f"Pad-token fraction of train batches: {report}")
 
     logger.info("============ Set Trainer ============")
-    trainer = Trainer(
+    trainer = QASLTrainer(
         model=model,
         args=training_args,
+        tokenizer=globals.tokenizer,
+        data_collator=DataCollatorWithDynamicPadding.from_tokenizer(globals.tokenizer),
         train_dataset=train_dataset if training_args.do_train else None,
         eval_dataset=eval_dataset if training_args.do_eval else None,
         compute_metrics=compute_metrics,
+        max_tokens_per_batch=data_args.max_tokens_per_batch,
+        argmax_logits=data_args.argmax_eval_logits,
+        streaming_metric=globals.metric if data_args.streaming_eval_metrics else None,
     )
 
     logger.info("============ Training ============")
     if training_args.do_train:
         train_result = trainer.train()
         trainer.save_model()
+        featurizer.save_pretrained(training_args.output_dir)
         metrics = train_result.metrics
         trainer.log_metrics("train", metrics)
         trainer.save_metrics("train", metrics)
@@ -204,6 +293,42 @@ def main():
         logger.debug("No Evaluation")
 
     logger.info("============ Prediction ============")
+    if training_args.do_predict:
+        # Features of test are built in order and decoded batch by batch, so logits are not gathered.
+        predictor = Predictor(
+            model=trainer.model,
+            featurizer=featurizer,
+            id_to_label=globals.id_to_label,
+            batch_size=training_args.eval_batch_size,
+            device=training_args.device,
+            queries=queries,
+            stitch_strategy=data_args.stitch_strategy,
+            max_tokens_per_batch=data_args.max_tokens_per_batch,
+        )
+        predictions = predictor.predict(
+            dataset["test"], num_proc=data_args.preprocessing_num_workers
+        )
+        # Gold passages are read along with predictions, so the nested evaluation takes no extra pass.
+        evaluator = None
+        if "answers" in dataset["test"].column_names:
+            evaluator = NestedSpanEvaluator()
+            predictions = evaluator.evaluate(
+                group_passages(dataset["test"]), predictions
+            )
+        output_file_path = os.path.join(training_args.output_dir, "predictions.json")
+        with MRCStructWriter(
+            output_file_path,
+            built_time=datetime.today().strftime("%Y/%m/%d-%H:%M:%S"),
+            version=data_args.dataset_name,
+        ) as writer:
+            for data in predictions:
+                writer.write(data)
+        if evaluator is not None:
+            metrics = evaluator.results()
+            trainer.log_metrics("nested", metrics)
+            trainer.save_metrics("nested", metrics)
+    else:
+        logger.debug("No Prediction")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,140 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Serve a trained tagger over HTTP with dynamic request batching
+
+import argparse
+import asyncio
+import json
+import logging
+import logging.config
+import os
+import sys
+
+sys.path.append(os.getcwd())
+from utils.feature_generation.strategy import StitchStrategy
+from utils.prediction.predictor import Predictor
+from utils.prediction.query_filter import LexiconQueryFilter
+from utils.prediction.server import DynamicBatcher, InferenceServer, ServerMetrics
+
+logging.config.fileConfig("logging.conf")
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model_dir",
+        required=True,
+        help="The output dir of run_ner, with model, tokenizer and featurizer_config.json.",
+    )
+    parser.add_argument(
+        "--query_file",
+        default=None,
+        help="A json file that maps an entity type to its question. Required by MRC models.",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--max_body_bytes",
+        type=int,
+        default=1 << 20,
+        help="Requests with a larger body are rejected with 413 before the body is read.",
+    )
+    parser.add_argument(
+        "--max_batch_size",
+        type=int,
+        default=32,
+        help="The maximum number of passages that concurrent requests are coalesced into.",
+    )
+    parser.add_argument(
+        "--max_wait_ms",
+        type=float,
+        default=10.0,
+        help="How long the first request of a batch waits for other requests.",
+    )
+    parser.add_argument("--max_tokens_per_batch", type=int, default=8192)
+    parser.add_argument(
+        "--stitch_strategy",
+        default=StitchStrategy.MEAN.value,
+        choices=[s.value for s in StitchStrategy],
+    )
+    parser.add_argument(
+        "--backend",
+        default="torch",
+        choices=["torch", "onnx", "int8"],
+        help="`onnx` runs model.onnx of model_dir (see run/export_onnx.py) with onnxruntime on CPU. "
+        "`int8` runs the quantized model dir published by run/quantize.py on CPU.",
+    )
+    parser.add_argument(
+        "--query_filter_dir",
+        default=None,
+        help="A dir with query_filter.json of run/query_filter.py, to skip entity types that a passage is unlikely to have.",
+    )
+    parser.add_argument(
+        "--query_filter_threshold",
+        type=float,
+        default=None,
+        help="Override the threshold saved in query_filter.json.",
+    )
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        default=0,
+        help="The number of (passage, question) results to keep in an LRU cache. 0 disables the cache.",
+    )
+    parser.add_argument(
+        "--cache_path",
+        default=None,
+        help="A sqlite file that persists cached results across runs. Used only if cache_size > 0.",
+    )
+    parser.add_argument("--device", default="cpu")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    queries = None
+    if args.query_file:
+        with open(args.query_file, "r", encoding="utf-8") as f:
+            queries = json.load(f)
+    query_filter = None
+    if args.query_filter_dir:
+        query_filter = LexiconQueryFilter.from_pretrained(args.query_filter_dir)
+        if args.query_filter_threshold is not None:
+            query_filter.threshold = args.query_filter_threshold
+        logger.info(query_filter)
+    predictor = Predictor.from_pretrained(
+        args.model_dir,
+        backend=args.backend,
+        batch_size=args.max_batch_size * max(len(queries or dict()), 1),
+        device=args.device,
+        queries=queries,
+        stitch_strategy=args.stitch_strategy,
+        max_tokens_per_batch=args.max_tokens_per_batch,
+        query_filter=query_filter,
+        cache_size=args.cache_size,
+        cache_path=args.cache_path,
+    )
+    logger.info(f"{predictor.featurizer}, device={predictor.device}")
+
+    batcher = DynamicBatcher(
+        predictor,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        metrics=ServerMetrics(),
+    )
+    server = InferenceServer(
+        batcher, host=args.host, port=args.port, max_body_bytes=args.max_body_bytes
+    )
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        logger.info(f"Metrics: {batcher.metrics.report()}")
+    finally:
+        if predictor.result_cache is not None:
+            predictor.result_cache.close()
+
+
+if __name__ == "__main__":
+    main()
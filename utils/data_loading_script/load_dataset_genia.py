@@ -5,8 +5,11 @@
 from __future__ import absolute_import, division, print_function
 import json
 import os
+import re
 from typing import Optional
 import datasets
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 _CITATION = """\
 @article{kim2003genia,
@@ -40,6 +43,134 @@ _PATHs = {
 }
 
 
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def _to_pylist(array):
+    """
+    Python values of an arrow array. A list<struct> column (e.g. answers) is converted field by field
+    from its flat arrays, which is much faster than element by element.
+    """
+
+    if not (pa.types.is_list(array.type) and pa.types.is_struct(array.type.value_type)):
+        return array.to_pylist()
+    names = [field.name for field in array.type.value_type]
+    values = [
+        dict(zip(names, value))
+        for value in zip(*(child.to_pylist() for child in array.flatten().flatten()))
+    ]
+    offsets = array.offsets.to_pylist()
+    return [
+        values[start - offsets[0] : stop - offsets[0]]
+        for start, stop in zip(offsets[:-1], offsets[1:])
+    ]
+
+
+def _iter_records(filepath: str, key: str = "data", chunk_size: int = 1 << 20):
+    """
+    Yield records one at a time, from the `key` array of a json object (e.g. of `save2json`),
+    from every line of a jsonl file, or from every row of a parquet file (e.g. of `save2parquet`),
+    so a split is never loaded as a whole.
+    The json file is read `chunk_size` characters at a time, and each record is decoded once its text is complete.
+    The parquet file is read a record batch at a time, and needs no json parsing.
+    """
+
+    if filepath.endswith(".parquet"):
+        for batch in pq.ParquetFile(filepath).iter_batches():
+            names = batch.schema.names
+            columns = [_to_pylist(column) for column in batch.columns]
+            for values in zip(*columns):
+                yield dict(zip(names, values))
+        return
+
+    with open(filepath, encoding="utf-8") as f:
+        if filepath.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buf, pos, eof = "", 0, False
+
+        def fill():
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+            return not eof
+
+        def peek():
+            nonlocal pos
+            while True:
+                pos = _WHITESPACE.match(buf, pos).end()
+                if pos < len(buf) or not fill():
+                    return buf[pos : pos + 1]
+
+        def expect(chars):
+            nonlocal pos
+            char = peek()
+            if not char or char not in chars:
+                raise ValueError(
+                    f"Expect one of {chars} at {pos} of {filepath}, got {char!r}"
+                )
+            pos += 1
+            return char
+
+        def value():
+            nonlocal pos
+            peek()
+            while True:
+                try:
+                    obj, end = decoder.raw_decode(buf, pos)
+                    # A number may go on in the next chunk.
+                    if end < len(buf) or eof:
+                        pos = end
+                        return obj
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                fill()
+
+        expect("{")
+        if peek() == "}":
+            return
+        while True:
+            name = value()
+            expect(":")
+            if name != key:
+                value()
+            else:
+                expect("[")
+                if peek() == "]":
+                    pos += 1
+                else:
+                    while True:
+                        yield value()
+                        if expect(",]") == "]":
+                            break
+            if expect(",}") == "}":
+                return
+
+
+def _answers_by_type(answers):
+    """
+    Bucket answers by their type in one pass, keeping their order within a type.
+    """
+
+    answers_by_type = dict()
+    for ans in answers:
+        answers_by_type.setdefault(ans["type"], list()).append(
+            {
+                "type": ans["type"],
+                "text": ans["text"],
+                "start_pos": ans["start_pos"],
+                "end_pos": ans["end_pos"],
+            }
+        )
+    return answers_by_type
+
+
 class GENIA_Config(datasets.BuilderConfig):
     """
     BuilderConfig for GENIA.
@@ -111,8 +242,9 @@ class GENIA(datasets.GeneratorBasedBuilder):
         Returns SplitGenerators.
         """
 
+        # Files of `data_files` (e.g. parquet files of `save2parquet`) override the default ones split by split.
         loaded_files = dl_manager.download_and_extract(
-            self.config.data_files if self.config.data_files else _PATHs
+            dict(_PATHs, **self.config.data_files) if self.config.data_files else _PATHs
         )
         return [
             datasets.SplitGenerator(
@@ -134,11 +266,9 @@ class GENIA(datasets.GeneratorBasedBuilder):
         Yields examples.
         """
 
-        with open(filepath, encoding="utf-8") as f:
-            genia = json.load(f)
-
+        # Records are streamed, so memory is bounded by a record rather than the split file.
         if self.config.name == "genia":
-            for id_, d in enumerate(genia["data"]):
+            for id_, d in enumerate(_iter_records(filepath)):
                 yield id_, {
                     "pid": d["pid"],
                     "passage": d["passage"],
@@ -155,33 +285,26 @@ class GENIA(datasets.GeneratorBasedBuilder):
                 }
         elif self.config.name == "genia_mrc":
             id_ = 0
-            for d in genia["data"]:
-                example = {
+            for d in _iter_records(filepath):
+                # Fields of the passage are shared by the examples of all queries.
+                passage = {
                     "pid": d["pid"],
                     "passage": d["passage"],
                     "passage_tokens": d["passage"].split(),
                 }
+                answers_by_type = _answers_by_type(d["answers"])
                 for tag, q_text in self.config.QUERIES.items():
-                    example["question"] = q_text
-                    example["answers"] = list()
-                    for ans in d["answers"]:
-                        if tag == ans["type"]:
-                            example["answers"].append(
-                                {
-                                    "type": ans["type"],
-                                    "text": ans["text"],
-                                    "start_pos": ans["start_pos"],
-                                    "end_pos": ans["end_pos"],
-                                }
-                            )
-                    if not example["answers"]:
-                        example["answers"] = [
+                    yield id_, {
+                        **passage,
+                        "question": q_text,
+                        "answers": answers_by_type.get(tag)
+                        or [
                             {
                                 "type": tag,
                                 "text": None,
                                 "start_pos": -1,
                                 "end_pos": -1,
                             }
-                        ]
-                    yield id_, example
+                        ],
+                    }
                     id_ += 1
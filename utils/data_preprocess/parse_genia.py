@@ -27,9 +27,16 @@ import copy
 from typing import List, Dict, Union
 from datetime import datetime
 import xml.etree.ElementTree as ET
+import pyarrow.parquet as pq
 from utils.data_preprocess.base import MRC_Preprocessing
-from utils.data_structure.mrc import AnswerStruct, DataStruct, MRCStruct, trans2dict
-from utils.data_structure.stat import StatStruct
+from utils.data_structure.mrc import (
+    AnswerStruct,
+    DataStruct,
+    MRCStruct,
+    trans2dict,
+    trans2table,
+)
+from utils.data_structure.stat import StatStruct, nesting_layers
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG)
@@ -202,6 +209,39 @@ class GENIA(MRC_Preprocessing):
             fout.write(out)
         logger.info(f"ALREADY SAVE PARSED DATA INTO {output_file_path}.")
 
+    @staticmethod
+    def save2parquet(
+        built_time: str,
+        version: str,
+        output_file_path: str,
+        data: List[DataStruct],
+    ):
+        """
+        Output parquet file, which loading scripts read without parsing json.
+        Answers are a list<struct> column (see `mrc.trans2table`).
+
+        Args:
+            `built_time`: A time when data set is built.
+            `version`: A version of data set.
+            `output_file_path`: A path of output file.
+            `data`: Data to be outputed.
+        Type:
+            `built_time`: string
+            `version`: string
+            `output_file_path`: string
+            `data`: list of `mrc.DataStruct`
+        Return:
+            A output parquet file
+        """
+
+        dir = os.path.abspath(os.path.dirname(output_file_path))
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+        mrc = MRCStruct(built_time=built_time, version=version, data=data)
+        logger.info(mrc)
+        pq.write_table(trans2table(mrc), output_file_path)
+        logger.info(f"ALREADY SAVE PARSED DATA INTO {output_file_path}.")
+
     @staticmethod
     def __init__load_and_get_root(file_path: str):
         """
@@ -509,22 +549,11 @@ class GENIA(MRC_Preprocessing):
         each_type_stat = copy.deepcopy(stat_helper.each_type_stat)
 
         answers = sorted(answers, key=lambda k: (k.start_pos, -k.end_pos, k.type))
-        seq = [0] * len(passage_tokens)
-        for ans in answers:
+        n_layers = 0
+        for ans, depth in zip(answers, nesting_layers(answers)):
             each_type_stat[ans.type].n_entity += 1
-
-            seq = [
-                k + 1 if i >= ans.start_pos and i < ans.end_pos else k
-                for i, k in enumerate(seq)
-            ]
-            depth_now = len(each_type_stat[ans.type].layer)
-            distance = max(seq) - depth_now
-            if distance > 0:
-                each_type_stat[ans.type].layer = (
-                    each_type_stat[ans.type].layer.copy() + [0] * distance
-                )
-            depth = seq[ans.start_pos]
-            each_type_stat[ans.type].layer[depth - 1] += 1
+            n_layers = max(n_layers, depth)
+            each_type_stat[ans.type].count_layer(depth, n_layers)
 
         stat_helper.each_type_stat = each_type_stat
         return stat_helper
@@ -590,3 +619,17 @@ if __name__ == "__main__":
     genia_mrc_preprocessing.save2json(
         built_time, version, test_output_file_path, test_data
     )
+    logger.info("-----\n")
+
+    logger.info("###### PIPELINE 5: SAVE SPLIT DATA AS PARQUET ######")
+    for output_file_path, split_data in [
+        (train_output_file_path, train_data),
+        (dev_output_file_path, dev_data),
+        (test_output_file_path, test_data),
+    ]:
+        genia_mrc_preprocessing.save2parquet(
+            built_time,
+            version,
+            os.path.splitext(output_file_path)[0] + ".parquet",
+            split_data,
+        )
@@ -4,6 +4,8 @@
 
 import logging
 from typing import List, NamedTuple
+import numpy as np
+import pyarrow as pa
 
 logger = logging.getLogger(__name__)
 
@@ -133,6 +135,83 @@ def dict2mrcStruct(mrc_dict: dict) -> MRCStruct:
     return mrc
 
 
+ANSWER_ARROW_TYPE = pa.struct(
+    [
+        ("type", pa.string()),
+        ("text", pa.string()),
+        ("start_pos", pa.int32()),
+        ("end_pos", pa.int32()),
+    ]
+)
+
+
+def trans2table(mrc: MRCStruct) -> pa.Table:
+    """
+    A columnar table of `MRCStruct`, one row per `DataStruct`, with answers as a list<struct> column.
+    `built_time` and `version` are kept in the metadata of its schema.
+    Columns are built from flat arrays of all answers and their offsets, without a dict per answer.
+    """
+
+    n_answers = [len(data.answers) for data in mrc.data]
+    answers = [ans for data in mrc.data for ans in data.answers]
+    answer_array = pa.StructArray.from_arrays(
+        [
+            pa.array([ans.type for ans in answers], type=pa.string()),
+            pa.array([ans.text for ans in answers], type=pa.string()),
+            pa.array([ans.start_pos for ans in answers], type=pa.int32()),
+            pa.array([ans.end_pos for ans in answers], type=pa.int32()),
+        ],
+        fields=list(ANSWER_ARROW_TYPE),
+    )
+    offsets = pa.array(np.concatenate(([0], np.cumsum(n_answers))), type=pa.int32())
+    table = pa.Table.from_arrays(
+        [
+            # pid is a string of GENIA, but an integer of some datasets, so its type is inferred.
+            pa.array(
+                [data.pid for data in mrc.data], type=None if mrc.data else pa.string()
+            ),
+            pa.array([data.passage for data in mrc.data], type=pa.string()),
+            pa.ListArray.from_arrays(offsets, answer_array),
+        ],
+        names=["pid", "passage", "answers"],
+    )
+    return table.replace_schema_metadata(
+        {"built_time": mrc.built_time, "version": mrc.version}
+    )
+
+
+def table2mrcStruct(table: pa.Table) -> MRCStruct:
+    metadata = table.schema.metadata or dict()
+    # Answers are converted field by field from their flat arrays, which is much faster than row by row.
+    answer_list = pa.concat_arrays(table.column("answers").chunks)
+    offsets = np.asarray(answer_list.offsets)
+    answers = list(
+        map(
+            AnswerStruct._make,
+            zip(*(field.to_pylist() for field in answer_list.flatten().flatten())),
+        )
+    )
+    data = [
+        DataStruct(
+            pid=pid,
+            passage=passage,
+            answers=answers[start - offsets[0] : stop - offsets[0]],
+        )
+        for pid, passage, start, stop in zip(
+            table.column("pid").to_pylist(),
+            table.column("passage").to_pylist(),
+            offsets[:-1].tolist(),
+            offsets[1:].tolist(),
+        )
+    ]
+    mrc = MRCStruct(
+        built_time=metadata.get(b"built_time", b"").decode("utf-8"),
+        version=metadata.get(b"version", b"").decode("utf-8"),
+        data=data,
+    )
+    return mrc
+
+
 if __name__ == "__main__":
 
     a_e = AnswerStruct(text="gg", type="ff", start_pos=2, end_pos=4)
@@ -152,3 +231,7 @@ if __name__ == "__main__":
     print(c)
     for i in c.data:
         print(i)
+
+    b_table = trans2table(b)
+    print(b_table)
+    print(table2mrcStruct(b_table) == c)
@@ -3,7 +3,7 @@
 # Discription: Data Structure of Statistics
 
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional, Sequence
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +19,17 @@ class TypeStatStruct:
     def type(self):
         return self._type
 
+    def count_layer(self, depth: int, n_layers: Optional[int] = None):
+        """
+        Count an entity in the layer of `depth` (1 for the outermost),
+        where `layer` is grown to `n_layers` (the deepest layer seen so far) with zeros.
+        """
+
+        n_layers = max(depth, n_layers or 0)
+        if len(self.layer) < n_layers:
+            self.layer = self.layer.copy() + [0] * (n_layers - len(self.layer))
+        self.layer[depth - 1] += 1
+
     def __repr__(self):
         return (
             f"--------- {self.type} ---------\n"
@@ -27,6 +38,37 @@ class TypeStatStruct:
         )
 
 
+def nesting_layers(answers: Sequence) -> List[int]:
+    """
+    The nesting layer of each answer of a passage, 1 for an outermost entity.
+    Answers are visited from the outer to the inner, i.e. by (start_pos, -end_pos, type),
+    and the layer of an answer is the number of answers visited so far (itself included) that cover its first token,
+    regardless of their types.
+
+    Args:
+        `answers`: Answers of a passage, whose `end_pos` is exclusive.
+    Type:
+        `answers`: list of `mrc.AnswerStruct`
+    Return:
+        Layers in the order of `answers`.
+        rtype: list of integer
+    """
+
+    order = sorted(
+        range(len(answers)),
+        key=lambda i: (answers[i].start_pos, -answers[i].end_pos, answers[i].type),
+    )
+    layers = [0] * len(answers)
+    visited_ends = list()
+    for i in order:
+        ans = answers[i]
+        # Answers visited before start at or before this one, so they cover it if they end after its start.
+        n_outer = sum(end > ans.start_pos for end in visited_ends)
+        layers[i] = n_outer + 1
+        visited_ends.append(ans.end_pos)
+    return layers
+
+
 class StatStruct:
     n_passage: int = 0
     n_token: int = 0
@@ -10,36 +10,95 @@ sys.path.append(os.getcwd())
 import numpy as np
 import run.globals as globals
 from torch.nn import CrossEntropyLoss as CE
+from utils.evaluation.span_metric import SpanMetric
 
 logger = logging.getLogger(__name__)
 
 
-def compute_metrics(p):
-    predictions, labels = p
-    predictions = np.argmax(predictions, axis=2)
+def select_label_ids(predictions: np.ndarray, labels: np.ndarray):
+    """
+    Predicted and gold label ids on positions whose label is not ignored (special tokens, subwords, paddings),
+    computed with array operations: the mask is built once, valid positions are picked by boolean indexing,
+    and argmax runs on valid positions only.
+
+    Args:
+        `predictions`: Logits of shape (n_features, seq_len, num_labels),
+                       or (n_features, seq_len, K, num_labels) for packed queries,
+                       or label ids of the shape of `labels` if logits are reduced to them during evaluation.
+        `labels`: Label ids of shape (n_features, seq_len), or (n_features, seq_len, K) for packed queries.
+    Type:
+        `predictions`: np.ndarray
+        `labels`: np.ndarray
+    Return:
+        Predicted ids and gold ids of all features (of all features and queries for packed queries), concatenated,
+        and the number of valid positions of each.
+        rtype: tuple of np.ndarray
+    """
+
+    is_ids = predictions.ndim == labels.ndim
+    if labels.ndim == 3:
+        # Packed queries: (n_features, seq_len, K, ...) -> (n_features * K, seq_len, ...)
+        _, seq_len, _ = labels.shape
+        axes = (0, 2, 1) if is_ids else (0, 2, 1, 3)
+        predictions = predictions.transpose(axes).reshape(
+            (-1, seq_len) + predictions.shape[3:]
+        )
+        labels = labels.transpose(0, 2, 1).reshape(-1, seq_len)
 
     # Remove ignored index (special tokens)
     pad_token_label_id = CE().ignore_index  # -100
-    true_predictions = [
-        [
-            globals.label_list[p]
-            for (p, l) in zip(prediction, label)
-            if l != pad_token_label_id
-        ]
-        for prediction, label in zip(predictions, labels)
-    ]
-    true_labels = [
-        [
-            globals.label_list[l]
-            for (p, l) in zip(prediction, label)
-            if l != pad_token_label_id
-        ]
-        for prediction, label in zip(predictions, labels)
-    ]
-
-    results = globals.metric.compute(
-        predictions=true_predictions, references=true_labels
-    )
+    mask = labels != pad_token_label_id
+    pred_ids = predictions[mask] if is_ids else predictions[mask].argmax(axis=-1)
+    return pred_ids.astype(np.int64), labels[mask].astype(np.int64), mask.sum(axis=1)
+
+
+def align_predictions(predictions: np.ndarray, labels: np.ndarray):
+    """
+    Tags of predictions and labels on positions whose label is not ignored (see `select_label_ids`),
+    where ids are mapped to tags by indexing an array of tags.
+
+    Args:
+        `predictions`: Logits of shape (n_features, seq_len, num_labels),
+                       or (n_features, seq_len, K, num_labels) for packed queries.
+        `labels`: Label ids of shape (n_features, seq_len), or (n_features, seq_len, K) for packed queries.
+    Type:
+        `predictions`: np.ndarray
+        `labels`: np.ndarray
+    Return:
+        Tags of predictions and tags of labels, one list per feature (per feature and query for packed queries).
+        rtype: tuple of list of list of string
+    """
+
+    pred_ids, true_ids, lengths = select_label_ids(predictions, labels)
+    tags = np.asarray(globals.label_list)
+    pred_tags = tags[pred_ids].tolist()
+    true_tags = tags[true_ids].tolist()
+
+    ends = np.cumsum(lengths).tolist()
+    starts = [0] + ends[:-1]
+    true_predictions = [pred_tags[s:e] for s, e in zip(starts, ends)]
+    true_labels = [true_tags[s:e] for s, e in zip(starts, ends)]
+    return true_predictions, true_labels
+
+
+def compute_metrics(p):
+    predictions, labels = p
+    if isinstance(globals.metric, SpanMetric):
+        # Score label ids directly, without building lists of tags.
+        results = globals.metric.compute_ids(*select_label_ids(predictions, labels))
+    else:
+        true_predictions, true_labels = align_predictions(predictions, labels)
+        results = globals.metric.compute(
+            predictions=true_predictions, references=true_labels
+        )
+
+    return unpack_results(results)
+
+
+def unpack_results(results):
+    """
+    Flatten scores of each type, e.g. {"_": {"f1": 0.9}} -> {"__f1": 0.9}, and keep overall scores.
+    """
 
     # Unpack nested dictionaries
     final_results = {}
@@ -54,4 +113,4 @@ def compute_metrics(p):
     final_results["overall_recall"] = results["overall_recall"]
     final_results["overall_f1"] = results["overall_f1"]
     final_results["overall_accuracy"] = results["overall_accuracy"]
-    return final_results
\ No newline at end of file
+    return final_results
@@ -0,0 +1,163 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Passage-level evaluation of nested entities, per type and per nesting layer
+
+import logging
+import os
+import sys
+
+sys.path.append(os.getcwd())
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+from utils.data_structure.mrc import AnswerStruct, DataStruct
+from utils.data_structure.stat import nesting_layers
+
+logger = logging.getLogger(__name__)
+
+
+def as_answers(answers: Iterable[Union[AnswerStruct, Dict]]) -> List[AnswerStruct]:
+    return [
+        (
+            ans
+            if isinstance(ans, AnswerStruct)
+            else AnswerStruct(
+                type=ans["type"],
+                text=ans.get("text", ""),
+                start_pos=ans["start_pos"],
+                end_pos=ans["end_pos"],
+            )
+        )
+        for ans in answers
+    ]
+
+
+def prf(n_correct_pred: int, n_pred: int, n_correct_gold: int, n_gold: int):
+    precision = n_correct_pred / n_pred if n_pred else 0.0
+    recall = n_correct_gold / n_gold if n_gold else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+class NestedSpanEvaluator:
+    """
+    Exact-match span scores of passages, where the answers of all entity-type queries of a passage
+    are unioned into one nested set, as GENIA results are reported.
+    Besides micro and per-type scores, spans are scored per nesting layer (see `stat.nesting_layers`):
+    recall of a layer counts gold spans in that layer, and precision counts predicted spans in that layer
+    of the predicted nesting.
+    Passages are added one at a time and only counts are kept, so memory does not grow with the dataset.
+    Spans match if their (type, start_pos, end_pos) are equal.
+    """
+
+    def __init__(self):
+        self.n_passage = 0
+        # Counters of (kind, key) -> count, where kind is "type" or "layer".
+        self.n_gold = Counter()
+        self.n_pred = Counter()
+        self.n_correct_gold = Counter()
+        self.n_correct_pred = Counter()
+
+    @staticmethod
+    def _span(ans: AnswerStruct) -> Tuple[str, int, int]:
+        return (ans.type, ans.start_pos, ans.end_pos)
+
+    def add(
+        self,
+        gold_answers: Iterable[Union[AnswerStruct, Dict]],
+        pred_answers: Iterable[Union[AnswerStruct, Dict]],
+    ):
+        """
+        Count the answers of a passage. Duplicated spans (e.g. from overlapping windows) count once.
+        """
+
+        self.n_passage += 1
+        gold = self._unique(as_answers(gold_answers))
+        pred = self._unique(as_answers(pred_answers))
+        gold_spans = set(self._span(ans) for ans in gold)
+        pred_spans = set(self._span(ans) for ans in pred)
+
+        for answers, layers, n, n_correct, other in [
+            (gold, nesting_layers(gold), self.n_gold, self.n_correct_gold, pred_spans),
+            (pred, nesting_layers(pred), self.n_pred, self.n_correct_pred, gold_spans),
+        ]:
+            for ans, layer in zip(answers, layers):
+                keys = [("type", ans.type), ("layer", layer)]
+                n.update(keys)
+                if self._span(ans) in other:
+                    n_correct.update(keys)
+
+    def _unique(self, answers: List[AnswerStruct]) -> List[AnswerStruct]:
+        seen = set()
+        unique = list()
+        for ans in answers:
+            span = self._span(ans)
+            if span not in seen:
+                seen.add(span)
+                unique.append(ans)
+        return unique
+
+    def evaluate(
+        self,
+        passages: Iterable[Dict],
+        predictions: Iterable[DataStruct],
+    ) -> Iterator[DataStruct]:
+        """
+        Add gold passages and their predictions, which come in the same order, in a single pass.
+        Predictions are passed through, so they can be written out in the same pass.
+
+        Args:
+            `passages`: Gold passages with `pid` and `answers`, e.g. of `group_passages`.
+            `predictions`: Predicted passages, e.g. of `Predictor.predict`.
+        Type:
+            `passages`: iterable of dict
+            `predictions`: iterable of `mrc.DataStruct`
+        Return:
+            rtype: iterator of `mrc.DataStruct`
+        """
+
+        passages = iter(passages)
+        for data in predictions:
+            passage = next(passages, None)
+            if passage is None or passage["pid"] != data.pid:
+                raise ValueError(
+                    f"Prediction of {data.pid} does not match the gold passage "
+                    f"{None if passage is None else passage['pid']}"
+                )
+            self.add(passage["answers"], data.answers)
+            yield data
+
+    def results(self) -> Dict[str, float]:
+        """
+        Flat scores, e.g. `overall_f1`, `G#DNA_f1` and `layer_2_f1`, with the number of gold spans of each.
+        """
+
+        results = dict()
+        for kind, key in sorted(set(self.n_gold) | set(self.n_pred)):
+            name = key if kind == "type" else f"layer_{key}"
+            precision, recall, f1 = prf(
+                self.n_correct_pred[(kind, key)],
+                self.n_pred[(kind, key)],
+                self.n_correct_gold[(kind, key)],
+                self.n_gold[(kind, key)],
+            )
+            results[f"{name}_precision"] = precision
+            results[f"{name}_recall"] = recall
+            results[f"{name}_f1"] = f1
+            results[f"{name}_number"] = self.n_gold[(kind, key)]
+
+        # Every span has a layer, so the totals over layers are the overall counts.
+        def total(counter: Counter) -> int:
+            return sum(v for (kind, _), v in counter.items() if kind == "layer")
+
+        precision, recall, f1 = prf(
+            total(self.n_correct_pred),
+            total(self.n_pred),
+            total(self.n_correct_gold),
+            total(self.n_gold),
+        )
+        results["overall_precision"] = precision
+        results["overall_recall"] = recall
+        results["overall_f1"] = f1
+        results["overall_number"] = total(self.n_gold)
+        results["n_passage"] = self.n_passage
+        return results
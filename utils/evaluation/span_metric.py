@@ -0,0 +1,282 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Span F1 of sequence labeling computed on label id arrays, a drop-in replacement of the seqeval metric
+
+import logging
+import os
+import sys
+
+sys.path.append(os.getcwd())
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from utils.data_structure.tag_scheme import IOB2, IOBES
+
+logger = logging.getLogger(__name__)
+
+# Prefixes are coded by their IOBES members, so IOB2 tags share codes with IOBES ones.
+OUTSIDE, BEGINNING, INSIDE, END, SINGLETON = range(5)
+PREFIX_CODES = {
+    IOBES.OUTSIDE.value: OUTSIDE,
+    IOBES.BEGINNING.value: BEGINNING,
+    IOBES.INSIDE.value: INSIDE,
+    IOBES.END.value: END,
+    IOBES.SINGLETON.value: SINGLETON,
+}
+
+
+def parse_tag(tag: str, scheme=IOBES) -> Tuple[str, str]:
+    """
+    Split a tag into its prefix and type as seqeval does, e.g. "B-PER" -> ("B", "PER").
+    Tags without a type (e.g. "B", which are used in this repo) have the type "_".
+
+    Args:
+        `tag`: A tag of the label list.
+        `scheme`: The tag scheme that the prefix must belong to.
+    Type:
+        `tag`: string
+        `scheme`: `IOB2` or `IOBES` of `utils.data_structure.tag_scheme`
+    Return:
+        The prefix and the type.
+        rtype: tuple of string
+    """
+
+    prefix = tag[0]
+    if prefix not in set(member.value for member in scheme):
+        raise ValueError(f"{tag} is not a tag of {scheme.__name__}")
+    return prefix, tag[1:].split("-", maxsplit=1)[-1] or "_"
+
+
+def extract_chunks(
+    prefixes: np.ndarray, types: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Chunks of a flat sequence of prefix codes under the conlleval rules of seqeval (its default mode),
+    vectorized over all positions: a chunk ends where the previous tag is E or S, where B or I is followed by B, S or O,
+    or where the type changes, and starts where the tag is B or S, where E or I follows O, E or S, or where the type changes.
+    Sentences must be separated by (and end with) an `OUTSIDE` position, which closes their last chunks.
+
+    Args:
+        `prefixes`: Prefix codes of positions.
+        `types`: Type ids of positions, which are ignored on `OUTSIDE` positions.
+    Type:
+        `prefixes`: np.ndarray of shape (n,)
+        `types`: np.ndarray of shape (n,)
+    Return:
+        Type ids, begins and ends (inclusive) of chunks.
+        rtype: tuple of np.ndarray
+    """
+
+    if len(prefixes) == 0:
+        return types[:0], types[:0], types[:0]
+    prev_prefixes = np.concatenate(([OUTSIDE], prefixes[:-1]))
+    prev_types = np.concatenate(([-1], types[:-1]))
+    type_changed = prev_types != types
+
+    prev_is_open = (prev_prefixes == BEGINNING) | (prev_prefixes == INSIDE)
+    prev_is_closed = (prev_prefixes == END) | (prev_prefixes == SINGLETON)
+    is_begin = (prefixes == BEGINNING) | (prefixes == SINGLETON)
+    is_continue = (prefixes == INSIDE) | (prefixes == END)
+
+    chunk_end = (
+        prev_is_closed
+        | (prev_is_open & (is_begin | (prefixes == OUTSIDE)))
+        | ((prev_prefixes != OUTSIDE) & type_changed)
+    )
+    chunk_start = (
+        is_begin
+        | (is_continue & (prev_is_closed | (prev_prefixes == OUTSIDE)))
+        | ((prefixes != OUTSIDE) & type_changed)
+    )
+
+    ends = np.flatnonzero(chunk_end)
+    starts = np.flatnonzero(chunk_start)
+    # A chunk ending before position i begins at the last start before i.
+    begins = starts[np.searchsorted(starts, ends) - 1]
+    return prev_types[ends], begins, ends - 1
+
+
+class SpanMetric:
+    """
+    Micro and per-type precision, recall and F1 of exact chunks, and token accuracy,
+    with the same numbers and output as `load_metric("seqeval")` (default mode), but offline and on label id arrays.
+    Tag ids are mapped to prefix codes and type ids by table lookup, chunks are extracted by `extract_chunks`,
+    and chunks of predictions and references are matched by `np.intersect1d` on encoded (begin, end, type) keys.
+
+    Args:
+        `label_list`: Tags of label ids, e.g. ["O", "B", "I"].
+        `scheme`: The tag scheme of the tags.
+    Type:
+        `label_list`: list of string
+        `scheme`: `IOB2` or `IOBES` of `utils.data_structure.tag_scheme`
+    """
+
+    def __init__(self, label_list: List[str], scheme=IOBES):
+        if scheme not in (IOB2, IOBES):
+            raise ValueError(f"Only IOB2 and IOBES are supported, but got {scheme}")
+        self.label_list = list(label_list)
+        self.scheme = scheme
+        self.label_to_id = {tag: i for i, tag in enumerate(self.label_list)}
+        parsed = [parse_tag(tag, scheme) for tag in self.label_list]
+        self.type_names = sorted(
+            set(type for prefix, type in parsed if prefix != IOBES.OUTSIDE.value)
+        )
+        type_to_id = {type: i for i, type in enumerate(self.type_names)}
+        self.prefix_of_id = np.asarray(
+            [PREFIX_CODES[prefix] for prefix, _ in parsed], dtype=np.int8
+        )
+        self.type_of_id = np.asarray(
+            [
+                type_to_id[type] if prefix != IOBES.OUTSIDE.value else -1
+                for prefix, type in parsed
+            ],
+            dtype=np.int64,
+        )
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(label_list={self.label_list}, scheme={self.scheme.__name__})"
+
+    def _chunk_keys(self, ids: np.ndarray, positions: np.ndarray, n: int):
+        prefixes = np.full(n, OUTSIDE, dtype=np.int8)
+        types = np.full(n, -1, dtype=np.int64)
+        prefixes[positions] = self.prefix_of_id[ids]
+        types[positions] = self.type_of_id[ids]
+        chunk_types, begins, ends = extract_chunks(prefixes, types)
+        n_types = max(len(self.type_names), 1)
+        return (begins * n + ends) * n_types + chunk_types, chunk_types
+
+    def count(
+        self,
+        predictions: np.ndarray,
+        references: np.ndarray,
+        lengths: Optional[Sequence[int]] = None,
+    ) -> np.ndarray:
+        """
+        Counts of flat label ids of sentences, which add up over batches since chunks never cross sentences.
+
+        Args:
+            `predictions`: Predicted label ids of all sentences, concatenated.
+            `references`: Gold label ids of all sentences, concatenated.
+            `lengths`: Lengths of sentences. Default to one sentence.
+        Type:
+            `predictions`: np.ndarray of shape (n_tokens,)
+            `references`: np.ndarray of shape (n_tokens,)
+            `lengths`: list of integer or np.ndarray
+        Return:
+            Correct, predicted and gold chunks of each type, then correct tokens and tokens.
+            rtype: np.ndarray of shape (3 * n_types + 2,)
+        """
+
+        predictions = np.asarray(predictions, dtype=np.int64).reshape(-1)
+        references = np.asarray(references, dtype=np.int64).reshape(-1)
+        if predictions.shape != references.shape:
+            raise ValueError(
+                f"Predictions of {predictions.shape} and references of {references.shape} do not match"
+            )
+        n_tokens = len(references)
+        lengths = np.asarray([n_tokens] if lengths is None else lengths, dtype=np.int64)
+        if lengths.sum() != n_tokens:
+            raise ValueError(
+                f"Lengths sum to {lengths.sum()}, but got {n_tokens} tokens"
+            )
+
+        # Like seqeval, every sentence is followed by an "O", so chunks never cross sentences.
+        n = n_tokens + len(lengths)
+        positions = np.arange(n_tokens) + np.repeat(np.arange(len(lengths)), lengths)
+        true_keys, true_types = self._chunk_keys(references, positions, n)
+        pred_keys, pred_types = self._chunk_keys(predictions, positions, n)
+        n_types = max(len(self.type_names), 1)
+        correct_types = (
+            np.intersect1d(true_keys, pred_keys, assume_unique=True) % n_types
+        )
+        return np.concatenate(
+            (
+                np.bincount(correct_types, minlength=n_types),
+                np.bincount(pred_types, minlength=n_types),
+                np.bincount(true_types, minlength=n_types),
+                [np.count_nonzero(predictions == references), n_tokens],
+            )
+        ).astype(np.int64)
+
+    def score(self, counts: np.ndarray) -> Dict:
+        """
+        Scores of counts of `count`, summed over batches.
+
+        Return:
+            Like the seqeval metric, {type: {"precision", "recall", "f1", "number"}} for each type
+            in references or predictions, and "overall_precision", "overall_recall", "overall_f1", "overall_accuracy".
+            rtype: dict
+        """
+
+        n_types = max(len(self.type_names), 1)
+        tp_sum, pred_sum, true_sum = np.asarray(counts[:-2]).reshape(3, n_types)
+        n_correct_tokens, n_tokens = int(counts[-2]), int(counts[-1])
+        precision, recall, f1 = self._prf(tp_sum, pred_sum, true_sum)
+
+        results = dict()
+        for i in np.flatnonzero(true_sum + pred_sum):
+            results[self.type_names[i]] = {
+                "precision": float(precision[i]),
+                "recall": float(recall[i]),
+                "f1": float(f1[i]),
+                "number": int(true_sum[i]),
+            }
+        precision, recall, f1 = self._prf(
+            tp_sum.sum(keepdims=True),
+            pred_sum.sum(keepdims=True),
+            true_sum.sum(keepdims=True),
+        )
+        results["overall_precision"] = float(precision[0])
+        results["overall_recall"] = float(recall[0])
+        results["overall_f1"] = float(f1[0])
+        results["overall_accuracy"] = n_correct_tokens / n_tokens if n_tokens else 0.0
+        return results
+
+    def compute_ids(
+        self,
+        predictions: np.ndarray,
+        references: np.ndarray,
+        lengths: Optional[Sequence[int]] = None,
+    ) -> Dict:
+        """
+        Scores of flat label ids of sentences (see `count` and `score`).
+        """
+
+        return self.score(self.count(predictions, references, lengths))
+
+    def compute(
+        self, predictions: List[List[str]], references: List[List[str]]
+    ) -> Dict:
+        """
+        Scores of tags of sentences, with the same signature as the seqeval metric.
+        """
+
+        if len(predictions) != len(references):
+            raise ValueError(
+                f"Got {len(predictions)} predictions but {len(references)} references"
+            )
+        lengths = [len(tags) for tags in references]
+        if lengths != [len(tags) for tags in predictions]:
+            raise ValueError(
+                "Predictions and references of a sentence differ in length"
+            )
+        return self.compute_ids(
+            np.asarray(
+                [self.label_to_id[tag] for tags in predictions for tag in tags],
+                dtype=np.int64,
+            ),
+            np.asarray(
+                [self.label_to_id[tag] for tags in references for tag in tags],
+                dtype=np.int64,
+            ),
+            lengths,
+        )
+
+    @staticmethod
+    def _prf(tp_sum: np.ndarray, pred_sum: np.ndarray, true_sum: np.ndarray):
+        # The same arithmetic as seqeval, where a zero denominator gives 0, so the floats are identical.
+        precision = tp_sum / np.where(pred_sum == 0, 1, pred_sum)
+        recall = tp_sum / np.where(true_sum == 0, 1, true_sum)
+        denom = precision + recall
+        denom[denom == 0.0] = 1
+        f1 = 2.0 * precision * recall / denom
+        return precision, recall, f1
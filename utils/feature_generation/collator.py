@@ -0,0 +1,74 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Data Collator that pads each batch to its longest feature
+
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+import numpy as np
+import torch
+from torch.nn import CrossEntropyLoss as CE
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DataCollatorWithDynamicPadding:
+    """
+    Pad a batch of unpadded features to the longest feature of the batch (on the right).
+    Features that are already padded to the same length are simply stacked.
+    Labels of packed features, which have shape (seq_len, K), are padded along the sequence only.
+
+    Args:
+        `pad_token_id`: The id of [PAD] token.
+        `pad_token_type_id`: The token type id of [PAD] token.
+        `pad_to_multiple_of`: Round the padded length up to a multiple of it, e.g. 8 for tensor cores.
+    Type:
+        `pad_token_id`: integer
+        `pad_token_type_id`: integer
+        `pad_to_multiple_of`: integer
+    """
+
+    pad_token_id: int = 0
+    pad_token_type_id: int = 0
+    pad_to_multiple_of: Optional[int] = None
+
+    @classmethod
+    def from_tokenizer(cls, tokenizer, pad_to_multiple_of: Optional[int] = None):
+        return cls(
+            pad_token_id=tokenizer.pad_token_id,
+            pad_token_type_id=tokenizer.pad_token_type_id,
+            pad_to_multiple_of=pad_to_multiple_of,
+        )
+
+    @property
+    def pad_values(self) -> Dict[str, int]:
+        return {
+            "input_ids": self.pad_token_id,
+            "token_type_ids": self.pad_token_type_id,
+            "attention_mask": 0,
+            "labels": CE().ignore_index,  # -100
+            "query_ids": 0,
+        }
+
+    def __call__(self, features: List[Dict]) -> Dict[str, torch.Tensor]:
+        max_length = max(len(feature["input_ids"]) for feature in features)
+        if self.pad_to_multiple_of:
+            max_length = (
+                -(-max_length // self.pad_to_multiple_of) * self.pad_to_multiple_of
+            )
+
+        batch = dict()
+        for key, pad_value in self.pad_values.items():
+            if key not in features[0]:
+                continue
+            # Compact dtypes of stored features are widened to int64 here only.
+            trailing_shape = np.shape(features[0][key])[1:]
+            padded = np.full(
+                (len(features), max_length) + trailing_shape, pad_value, dtype=np.int64
+            )
+            for idx, feature in enumerate(features):
+                values = feature[key]
+                padded[idx, : len(values)] = values
+            batch[key] = torch.from_numpy(padded)
+        return batch
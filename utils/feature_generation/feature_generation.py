@@ -2,98 +2,706 @@
 # Author: Yu-Lun Chiang
 # Description: Get the input tensor of data
 
+import json
 import logging
 import os
 import sys
 
 sys.path.append(os.getcwd())  ## add current directory to import package of utils
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import datasets
 from torch.nn import CrossEntropyLoss as CE
 import run.globals as globals
-from utils.feature_generation.strategy import LabelStrategy
+from utils.feature_generation.strategy import LabelStrategy, PaddingStrategy
+from utils.feature_generation.question_cache import question_token_cache
 from utils.data_structure.tag_scheme import IOB2, IOBES
 
 logger = logging.getLogger(__name__)
 
 
+class Featurizer:
+    """
+    Turn a batch of MRC examples into features (input_ids, token_type_ids, attention_mask, labels).
+    With `queries`, it turns a batch of plain (non-MRC) examples into packed features instead:
+    all questions are packed in front of the passage, i.e. [CLS] q1 [SEP] q2 [SEP] ... qK [SEP] Passage [SEP],
+    and each feature gets `query_ids` (k+1 on tokens of the k-th question) and labels of shape (seq_len, K),
+    so one forward pass tags every entity type.
+    It carries its own tokenizer and settings instead of reading `run.globals`,
+    so it can be pickled into worker processes of `datasets.map(num_proc=...)`.
+
+    Args:
+        `tokenizer`: A fast tokenizer of transformers.
+        `label_to_id`: A map from a tag to a label id.
+        `max_seq_length`: The maximum length of a feature.
+        `doc_stride`: The number of overlapping tokens between two windows of a passage.
+        `padding_strategy`: `max_length`, `longest` or `do_not_pad`.
+        `label_strategy`: `iob2` or `iobes`.
+        `encode_passage_once`: Whether to tokenize each unique passage of a batch only once.
+        `queries`: A map from an entity type to its question, which turns on packing mode.
+    Type:
+        `tokenizer`: `transformers.PreTrainedTokenizerFast`
+        `label_to_id`: dict
+        `max_seq_length`: integer
+        `doc_stride`: integer
+        `padding_strategy`: string
+        `label_strategy`: string
+        `encode_passage_once`: bool
+        `queries`: dict
+    """
+
+    CONFIG_NAME = "featurizer_config.json"
+
+    def __init__(
+        self,
+        tokenizer,
+        label_to_id: Dict[str, int],
+        max_seq_length: int = 128,
+        doc_stride: int = 128,
+        padding_strategy: str = PaddingStrategy.MAX_LENGTH.value,
+        label_strategy: str = LabelStrategy.IOB2.value,
+        encode_passage_once: bool = False,
+        queries: Optional[Dict[str, str]] = None,
+    ):
+        self.tokenizer = tokenizer
+        self.label_to_id = dict(label_to_id)
+        self.max_seq_length = max_seq_length
+        self.doc_stride = doc_stride
+        self.padding_strategy = padding_strategy
+        self.label_strategy = LabelStrategy(label_strategy.lower())
+        self.encode_passage_once = encode_passage_once
+        self.pad_on_right = tokenizer.padding_side == "right"
+        self.queries = dict(queries) if queries else None
+        if self.queries and not self.pad_on_right:
+            raise ValueError(
+                "Packing queries needs a tokenizer that pads on the right."
+            )
+
+    @classmethod
+    def from_globals(cls):
+        return cls(
+            tokenizer=globals.tokenizer,
+            label_to_id=globals.label_to_id,
+            max_seq_length=globals.max_seq_length,
+            doc_stride=globals.doc_stride,
+            padding_strategy=globals.padding_strategy,
+            label_strategy=globals.label_strategy,
+            encode_passage_once=getattr(globals, "encode_passage_once", False),
+            queries=getattr(globals, "queries", None),
+        )
+
+    @classmethod
+    def from_pretrained(cls, tokenizer, pretrained_dir: str, **kwargs):
+        """
+        Load a featurizer saved by `save_pretrained` with a tokenizer. `kwargs` override the saved settings.
+        """
+
+        with open(
+            os.path.join(pretrained_dir, cls.CONFIG_NAME), "r", encoding="utf-8"
+        ) as f:
+            config = json.load(f)
+        config.pop("pad_on_right", None)
+        config.update(kwargs)
+        return cls(tokenizer=tokenizer, **config)
+
+    def save_pretrained(self, save_directory: str):
+        os.makedirs(save_directory, exist_ok=True)
+        with open(
+            os.path.join(save_directory, self.CONFIG_NAME), "w", encoding="utf-8"
+        ) as f:
+            json.dump(self.config, f, indent=4, ensure_ascii=False)
+
+    @property
+    def config(self) -> Dict:
+        """
+        Settings that determine the features, except the tokenizer itself.
+        `encode_passage_once` is left out since it gives the same features.
+        """
+
+        return {
+            "label_to_id": self.label_to_id,
+            "max_seq_length": self.max_seq_length,
+            "doc_stride": self.doc_stride,
+            "padding_strategy": self.padding_strategy,
+            "label_strategy": self.label_strategy.value,
+            "pad_on_right": self.pad_on_right,
+            "queries": self.queries,
+        }
+
+    @property
+    def features(self) -> datasets.Features:
+        """
+        Compact schema of features: labels fit in int8 (-100 ~ 4), masks and token type ids in uint8,
+        and input ids in int32. They are widened to int64 only by the data collator.
+        """
+
+        features = {
+            "input_ids": datasets.Sequence(datasets.Value("int32")),
+            "attention_mask": datasets.Sequence(datasets.Value("uint8")),
+            "labels": datasets.Sequence(datasets.Value("int8")),
+            "length": datasets.Value("int32"),
+        }
+        if "token_type_ids" in self.tokenizer.model_input_names:
+            features["token_type_ids"] = datasets.Sequence(datasets.Value("uint8"))
+        if self.queries:
+            features["labels"] = datasets.Sequence(
+                datasets.Sequence(datasets.Value("int8"))
+            )
+            features["query_ids"] = datasets.Sequence(datasets.Value("uint8"))
+        return datasets.Features(features)
+
+    @property
+    def prediction_features(self) -> datasets.Features:
+        """
+        Schema of features for prediction: no labels, but the index of example that each feature comes from
+        and the word id of each token (-1 except on the first subword of each passage word).
+        """
+
+        features = self.features
+        del features["labels"]
+        features["example_id"] = datasets.Value("int64")
+        features["word_ids"] = datasets.Sequence(datasets.Value("int32"))
+        return features
+
+    def __call__(self, batched_examples):
+        if self.queries:
+            return self.pack(batched_examples)
+        batched_tokenized_inputs, sample_mapping, batched_word_ids = self.tokenize(
+            batched_examples["question"], batched_examples["passage_tokens"]
+        )
+        # Align label_ids to each example and stack back to the batch.
+        batched_tokenized_inputs["labels"] = align_labels(
+            batched_word_ids,
+            sample_mapping,
+            batched_examples["answers"],
+            self.label_to_id,
+            self.label_strategy,
+        )
+        # The number of tokens without padding, which is used to batch features of similar lengths.
+        batched_tokenized_inputs["length"] = [
+            sum(mask) for mask in batched_tokenized_inputs["attention_mask"]
+        ]
+        return batched_tokenized_inputs
+
+    def pack(self, batched_examples):
+        """
+        Featurize a batch of plain examples with all queries packed into each feature.
+        Labels of the k-th query only come from answers of its type; a type without answers is tagged all `O`.
+        """
+
+        tags = list(self.queries)
+        question_block = pack_questions(self.tokenizer, list(self.queries.values()))
+        batched_tokenized_inputs, sample_mapping, batched_word_ids = (
+            _splice_passage_windows(
+                self.tokenizer,
+                [question_block] * len(batched_examples["passage_tokens"]),
+                batched_examples["passage_tokens"],
+                max_seq_length=self.max_seq_length,
+                doc_stride=self.doc_stride,
+                padding_strategy=self.padding_strategy,
+            )
+        )
+
+        # Split answers of each example by type: one pseudo example per (example, query).
+        batched_type_answers = list()
+        for answers in batched_examples["answers"]:
+            for tag in tags:
+                spans = [
+                    (s, e)
+                    for t, s, e in zip(
+                        answers["type"], answers["start_pos"], answers["end_pos"]
+                    )
+                    if t == tag
+                ] or [(-1, -1)]
+                batched_type_answers.append(
+                    {
+                        "start_pos": [s for s, _ in spans],
+                        "end_pos": [e for _, e in spans],
+                    }
+                )
+        K = len(tags)
+        label_ids = align_labels(
+            [word_ids for word_ids in batched_word_ids for _ in range(K)],
+            [example_id * K + k for example_id in sample_mapping for k in range(K)],
+            batched_type_answers,
+            self.label_to_id,
+            self.label_strategy,
+        )
+        # Stack back to (seq_len, K) per feature.
+        batched_tokenized_inputs["labels"] = [
+            np.stack(label_ids[idx * K : (idx + 1) * K], axis=1)
+            for idx in range(len(sample_mapping))
+        ]
+        batched_tokenized_inputs["length"] = [
+            sum(mask) for mask in batched_tokenized_inputs["attention_mask"]
+        ]
+        return batched_tokenized_inputs
+
+    def featurize_for_prediction(self, batched_examples, indices: List[int]):
+        """
+        Featurize a batch of examples for prediction, i.e. `datasets.map(..., with_indices=True)`.
+        Examples need no answers. Features keep `example_id` and `word_ids` to map predictions back to words.
+        """
+
+        if self.queries:
+            question_block = pack_questions(self.tokenizer, list(self.queries.values()))
+            batched_tokenized_inputs, sample_mapping, batched_word_ids = (
+                _splice_passage_windows(
+                    self.tokenizer,
+                    [question_block] * len(batched_examples["passage_tokens"]),
+                    batched_examples["passage_tokens"],
+                    max_seq_length=self.max_seq_length,
+                    doc_stride=self.doc_stride,
+                    padding_strategy=self.padding_strategy,
+                )
+            )
+        else:
+            batched_tokenized_inputs, sample_mapping, batched_word_ids = self.tokenize(
+                batched_examples["question"], batched_examples["passage_tokens"]
+            )
+        batched_tokenized_inputs["example_id"] = [
+            indices[example_id] for example_id in sample_mapping
+        ]
+        batched_tokenized_inputs["word_ids"] = [
+            first_subword_word_ids(word_ids) for word_ids in batched_word_ids
+        ]
+        batched_tokenized_inputs["length"] = [
+            sum(mask) for mask in batched_tokenized_inputs["attention_mask"]
+        ]
+        return batched_tokenized_inputs
+
+    def tokenize(
+        self, batched_questions: List[str], batched_passage_tokens: List[List[str]]
+    ) -> Tuple[Dict[str, List[List[int]]], List[int], List[List[Optional[int]]]]:
+        """
+        Tokenize questions and passages into features without labels.
+
+        Args:
+            `batched_questions`: Question text of each example.
+            `batched_passage_tokens`: Passage tokens of each example.
+        Type:
+            `batched_questions`: list of string
+            `batched_passage_tokens`: list of list of string
+        Return:
+            Features of the batch, the index of example that each feature comes from, and word ids of each feature.
+            rtype: dict of list, list of integer, list of list of integer or None
+        """
+
+        if self.encode_passage_once and self.pad_on_right:
+            return encode_passage_once(
+                self.tokenizer,
+                batched_questions,
+                batched_passage_tokens,
+                max_seq_length=self.max_seq_length,
+                doc_stride=self.doc_stride,
+                padding_strategy=self.padding_strategy,
+            )
+
+        # Prepare question_tokens
+        batched_question_tokens = list()
+        for question in batched_questions:
+            batched_question_tokens.append(
+                question_token_cache.tokenize(self.tokenizer, question)
+            )
+
+        # Prepare Features (input_ids, token_type_ids, attention_masks)
+        batched_tokenized_inputs = self.tokenizer(
+            batched_question_tokens if self.pad_on_right else batched_passage_tokens,
+            batched_passage_tokens if self.pad_on_right else batched_question_tokens,
+            is_split_into_words=True,
+            truncation="only_second" if self.pad_on_right else "only_first",
+            padding=self.padding_strategy,
+            max_length=self.max_seq_length,
+            stride=self.doc_stride,
+            return_overflowing_tokens=True,
+        )
+        # Since one example might give us several features if it has a long context, we need a map from a feature to
+        # its corresponding example. This key gives us just that.
+        sample_mapping = batched_tokenized_inputs.pop("overflow_to_sample_mapping")
+        # [CLS, ......     , SEP, ......                             SEP ]
+        # [None, 0, 1, 2, 3, None, 0, 0, 1, 2, 3, 3, 4, 5, 6, 7, ... None]
+        batched_word_ids = [
+            batched_tokenized_inputs.word_ids(batch_index=idx)
+            for idx in range(len(sample_mapping))
+        ]
+        return dict(batched_tokenized_inputs), sample_mapping, batched_word_ids
+
+    def __repr__(self):
+        return (
+            f"Featurizer(tokenizer={self.tokenizer.name_or_path}, "
+            f"max_seq_length={self.max_seq_length}, doc_stride={self.doc_stride}, "
+            f"padding_strategy={self.padding_strategy}, "
+            f"label_strategy={self.label_strategy.value}, "
+            f"encode_passage_once={self.encode_passage_once}, "
+            f"queries={list(self.queries) if self.queries else None})"
+        )
+
+
 def tokenize_and_align_labels(batched_examples):
+    """
+    Featurize with the settings in `run.globals`.
+    It only works in the main process; use `Featurizer` for `datasets.map(num_proc=...)`.
+    """
+
+    return Featurizer.from_globals()(batched_examples)
+
+
+def first_subword_word_ids(word_ids: List[Optional[int]]) -> List[int]:
+    """
+    Word ids of the first subword of each passage word, and -1 on the other tokens,
+    following the same rule as `align_labels` (passage tokens have two special tokens in front of them).
+    """
 
-    # Prepare question_tokens and passage_tokens
-    batched_question_tokens = list()
-    for question in batched_examples["question"]:
-        batched_question_tokens.append(globals.tokenizer.tokenize(question))
-    batched_passage_tokens = batched_examples["passage_tokens"]
-
-    # Prepare Features (input_ids, token_type_ids, attention_masks)
-    batched_tokenized_inputs = globals.tokenizer(
-        batched_question_tokens if globals.pad_on_right else batched_passage_tokens,
-        batched_passage_tokens if globals.pad_on_right else batched_question_tokens,
-        is_split_into_words=True,
-        truncation="only_second" if globals.pad_on_right else "only_first",
-        padding=globals.padding_strategy,
-        max_length=globals.max_seq_length,
-        stride=globals.doc_stride,
-        return_overflowing_tokens=True,
+    output = list()
+    n_special, prev_word_id = 0, None
+    for word_id in word_ids:
+        if word_id is None:
+            n_special += 1
+            output.append(-1)
+        elif n_special >= 2 and word_id != prev_word_id:
+            output.append(word_id)
+        else:
+            output.append(-1)
+        prev_word_id = word_id
+    return output
+
+
+def _pair_layout(tokenizer) -> Tuple[Dict, Dict, Dict]:
+    """
+    Special tokens in front of the question, between the question and the passage, and behind the passage.
+    They are read off from encoding a pair of one-word sequences.
+    Besides, `question_type_id` and `passage_type_id` are put into the first dict.
+    """
+
+    encoding = tokenizer(["a"], ["a"], is_split_into_words=True)
+    word_ids = encoding.word_ids()
+    q_start = word_ids.index(0)
+    q_stop = word_ids.index(None, q_start)
+    p_start = word_ids.index(0, q_stop)
+    p_stop = word_ids.index(None, p_start)
+    parts = tuple(
+        {key: values[start:stop] for key, values in encoding.items()}
+        for start, stop in [(0, q_start), (q_stop, p_start), (p_stop, len(word_ids))]
     )
-    # Since one example might give us several features if it has a long context, we need a map from a feature to
-    # its corresponding example. This key gives us just that.
-    sample_mapping = batched_tokenized_inputs.pop("overflow_to_sample_mapping")
+    if "token_type_ids" in encoding:
+        parts[0]["question_type_id"] = encoding["token_type_ids"][q_start]
+        parts[0]["passage_type_id"] = encoding["token_type_ids"][p_start]
+    return parts
+
 
-    # Align label_ids to each example and stack back to the batch.
-    labels = list()
+def encode_passage_once(
+    tokenizer,
+    batched_questions: List[str],
+    batched_passage_tokens: List[List[str]],
+    max_seq_length: int,
+    doc_stride: int,
+    padding_strategy: str,
+) -> Tuple[Dict[str, List[List[int]]], List[int], List[List[Optional[int]]]]:
+    """
+    Build features by tokenizing each unique passage of the batch only once.
+    In MRC configs, a passage is repeated once per query, so the subword ids and word ids of the passage
+    are reused and spliced behind the (cached) question ids of each query.
+    Windows of long passages follow the same rule as the tokenizer with `truncation="only_second"`,
+    `stride=doc_stride` and `return_overflowing_tokens=True`, so features are same as the default path.
+    Only tokenizers that pad on the right are supported.
+
+    Args:
+        `tokenizer`: A fast tokenizer of transformers.
+        `batched_questions`: Question text of each example.
+        `batched_passage_tokens`: Passage tokens of each example.
+        `max_seq_length`: The maximum length of a feature.
+        `doc_stride`: The number of overlapping tokens between two windows of a passage.
+        `padding_strategy`: `max_length`, `longest` or `do_not_pad`.
+    Type:
+        `tokenizer`: `transformers.PreTrainedTokenizerFast`
+        `batched_questions`: list of string
+        `batched_passage_tokens`: list of list of string
+        `max_seq_length`: integer
+        `doc_stride`: integer
+        `padding_strategy`: string
+    Return:
+        Features of the batch, the index of example that each feature comes from, and word ids of each feature.
+        rtype: dict of list, list of integer, list of list of integer or None
+    """
+
+    question_blocks = list()
+    for question in batched_questions:
+        q_ids, q_word_ids = question_token_cache.encode(tokenizer, question)
+        question_blocks.append((q_ids, q_word_ids, None))
+    return _splice_passage_windows(
+        tokenizer,
+        question_blocks,
+        batched_passage_tokens,
+        max_seq_length,
+        doc_stride,
+        padding_strategy,
+    )
+
+
+def pack_questions(
+    tokenizer, questions: List[str]
+) -> Tuple[List[int], List[Optional[int]], List[int]]:
+    """
+    Pack several questions into one question block, e.g. q1 [SEP] q2 [SEP] q3 for BERT.
+    Questions are separated by the same special tokens that separate a question from a passage.
+
+    Args:
+        `tokenizer`: A fast tokenizer of transformers.
+        `questions`: Question text of each query.
+    Type:
+        `tokenizer`: `transformers.PreTrainedTokenizerFast`
+        `questions`: list of string
+    Return:
+        Ids of the block, word ids of the block (all None, so no question token gets a label),
+        and query ids of the block (k+1 on tokens of the k-th question and 0 on separators).
+        rtype: list of integer, list of None, list of integer
+    """
+
+    _, middle, _ = _pair_layout(tokenizer)
+    ids, query_ids = list(), list()
+    for k, question in enumerate(questions):
+        if k > 0:
+            ids += middle["input_ids"]
+            query_ids += [0] * len(middle["input_ids"])
+        q_ids, _ = question_token_cache.encode(tokenizer, question)
+        ids += q_ids
+        query_ids += [k + 1] * len(q_ids)
+    return ids, [None] * len(ids), query_ids
+
+
+def _splice_passage_windows(
+    tokenizer,
+    question_blocks: List[Tuple[List[int], List[Optional[int]], Optional[List[int]]]],
+    batched_passage_tokens: List[List[str]],
+    max_seq_length: int,
+    doc_stride: int,
+    padding_strategy: str,
+) -> Tuple[Dict[str, List[List[int]]], List[int], List[List[Optional[int]]]]:
+    """
+    Splice windows of each passage behind the question block of its example.
+    A question block is a tuple of (ids, word ids, query ids). Query ids are None except in packing mode,
+    where they are written into a `query_ids` feature (0 on special tokens, passage tokens and paddings).
+    """
+
+    # Tokenize each unique passage once.
+    passage_index = dict()
+    for passage_tokens in batched_passage_tokens:
+        passage_index.setdefault(tuple(passage_tokens), len(passage_index))
+    unique_passages = [list(passage_tokens) for passage_tokens in passage_index]
+    passage_encodings = tokenizer(
+        unique_passages, is_split_into_words=True, add_special_tokens=False
+    )
+
+    # Layout of special tokens of a pair, e.g. [CLS] Question [SEP] Passage [SEP] for BERT.
+    prefix, middle, suffix = _pair_layout(tokenizer)
+    n_special = (
+        len(prefix["input_ids"]) + len(middle["input_ids"]) + len(suffix["input_ids"])
+    )
+    with_token_type_ids = "token_type_ids" in prefix
+
+    features = {"input_ids": list(), "attention_mask": list()}
+    if with_token_type_ids:
+        features["token_type_ids"] = list()
+    sample_mapping = list()
+    batched_word_ids = list()
+    with_query_ids = any(block[2] is not None for block in question_blocks)
+    if with_query_ids:
+        features["query_ids"] = list()
+    for example_id, ((q_ids, q_word_ids, q_query_ids), passage_tokens) in enumerate(
+        zip(question_blocks, batched_passage_tokens)
+    ):
+        p_idx = passage_index[tuple(passage_tokens)]
+        p_ids = passage_encodings["input_ids"][p_idx]
+        p_word_ids = passage_encodings.word_ids(p_idx)
+
+        window_size = max_seq_length - len(q_ids) - n_special
+        if window_size <= doc_stride:
+            raise ValueError(
+                f"The question of example {example_id} leaves {window_size} tokens for passage, "
+                f"which must be more than doc_stride ({doc_stride})."
+            )
+        for start in range(0, max(len(p_ids), 1), window_size - doc_stride):
+            stop = min(start + window_size, len(p_ids))
+            window = p_ids[start:stop]
+            features["input_ids"].append(
+                prefix["input_ids"]
+                + q_ids
+                + middle["input_ids"]
+                + window
+                + suffix["input_ids"]
+            )
+            features["attention_mask"].append(
+                [1] * (n_special + len(q_ids) + len(window))
+            )
+            if with_token_type_ids:
+                features["token_type_ids"].append(
+                    prefix["token_type_ids"]
+                    + [prefix["question_type_id"]] * len(q_ids)
+                    + middle["token_type_ids"]
+                    + [prefix["passage_type_id"]] * len(window)
+                    + suffix["token_type_ids"]
+                )
+            if with_query_ids:
+                features["query_ids"].append(
+                    [0] * len(prefix["input_ids"])
+                    + q_query_ids
+                    + [0] * (len(middle["input_ids"]) + len(window))
+                    + [0] * len(suffix["input_ids"])
+                )
+            batched_word_ids.append(
+                [None] * len(prefix["input_ids"])
+                + q_word_ids
+                + [None] * len(middle["input_ids"])
+                + p_word_ids[start:stop]
+                + [None] * len(suffix["input_ids"])
+            )
+            sample_mapping.append(example_id)
+            if stop == len(p_ids):
+                break
+
+    # Pad on the right.
+    if padding_strategy == PaddingStrategy.MAX_LENGTH.value:
+        pad_to = max_seq_length
+    elif padding_strategy == PaddingStrategy.LONGEST.value:
+        pad_to = max(map(len, features["input_ids"]), default=0)
+    else:
+        pad_to = 0
+    pad_values = {
+        "input_ids": tokenizer.pad_token_id,
+        "attention_mask": 0,
+        "token_type_ids": tokenizer.pad_token_type_id,
+        "query_ids": 0,
+    }
+    for idx, word_ids in enumerate(batched_word_ids):
+        n_pad = pad_to - len(word_ids)
+        if n_pad > 0:
+            for key, values in features.items():
+                values[idx].extend([pad_values[key]] * n_pad)
+            word_ids.extend([None] * n_pad)
+    return features, sample_mapping, batched_word_ids
+
+
+def align_labels(
+    batched_word_ids: List[List[Optional[int]]],
+    sample_mapping: List[int],
+    batched_answers: List[Dict[str, List]],
+    label_to_id: Dict[str, int],
+    label_strategy: LabelStrategy,
+) -> List[np.ndarray]:
+    """
+    Paint label ids of all answer spans onto a batch of features in one vectorized pass.
+    Only the first subword of each passage word gets a tag; special tokens, question tokens
+    and the remaining subwords get the ignore index (-100).
+    An answer covers words from `start_pos` to `end_pos` (exclusive), as the data builders write it.
+    When answers overlap (nested entities of the same type), the later answer wins on its span.
+
+    Args:
+        `batched_word_ids`: Word index of each token of each feature. None for special tokens.
+        `sample_mapping`: The index of example that each feature comes from.
+        `batched_answers`: Answers of each example, with keys of `start_pos` and `end_pos`.
+        `label_to_id`: A map from a tag to a label id.
+        `label_strategy`: A label strategy, either IOB2 or IOBES.
+    Type:
+        `batched_word_ids`: list of list of integer or None
+        `sample_mapping`: list of integer
+        `batched_answers`: list of dict of list
+        `label_to_id`: dict
+        `label_strategy`: `strategy.LabelStrategy`
+    Return:
+        Label ids of each feature.
+        rtype: list of np.ndarray of int8
+    """
+
+    if label_strategy == LabelStrategy.IOB2:
+        outside_id = label_to_id[IOB2.OUTSIDE.value]
+    elif label_strategy == LabelStrategy.IOBES:
+        outside_id = label_to_id[IOBES.OUTSIDE.value]
+    else:
+        raise ValueError(f"Label strategy {label_strategy} is not supported.")
     pad_token_label_id = CE().ignore_index  # -100
-    batched_answers = batched_examples["answers"]
-    for idx, example_id in enumerate(sample_mapping):
-        label_ids = list()
 
-        # [CLS, ......     , SEP, ......                             SEP ]
-        # [None, 0, 1, 2, 3, None, 0, 0, 1, 2, 3, 3, 4, 5, 6, 7, ... None]
-        word_ids = batched_tokenized_inputs.word_ids(batch_index=idx)
-
-        # The position of first [SEP] token
-        first_sep_token_in_word_ids = word_ids.index(None, 1)
-
-        # The first passage tokens is behind [SEP] tokens
-        first_passage_token_in_word_ids = first_sep_token_in_word_ids + 1
-        after_first_sep = word_ids[first_passage_token_in_word_ids:]
-        after_first_sep_len = len(after_first_sep)
-
-        # [CLS] Question [SEP] Passage [SEP] [PAD] ..
-        #  -100, -100... -100
-        label_ids.extend([pad_token_label_id] * first_passage_token_in_word_ids)
-
-        # [CLS] Question [SEP] Passage [SEP] [PAD] ...
-        #                      ........ -100 -100 ...
-        answers = batched_answers[example_id]
-
-        passage_label_ids = [pad_token_label_id] * after_first_sep_len
-        for type, text, start, end in zip(
-            answers["type"], answers["text"], answers["start_pos"], answers["end_pos"]
-        ):
-            prev_word_id = None
-            for idx, word_id in enumerate(after_first_sep):
-                if word_id is None:
-                    pass
-                elif word_id != prev_word_id:
-                    if (
-                        globals.label_strategy.lower()
-                        == LabelStrategy.IOB2._name_.lower()
-                    ):
-                        if word_id == start:
-                            passage_label_ids[idx] = globals.label_to_id[
-                                IOB2.BEGINNING.value
-                            ]
-                        elif start < word_id <= end:
-                            passage_label_ids[idx] = globals.label_to_id[
-                                IOB2.INSIDE.value
-                            ]
-                        else:
-                            passage_label_ids[idx] = globals.label_to_id[
-                                IOB2.OUTSIDE.value
-                            ]
-                else:
-                    pass
-                prev_word_id = word_id
-        label_ids.extend(passage_label_ids)
-        labels.append(label_ids)
-    batched_tokenized_inputs["labels"] = labels
-    return batched_tokenized_inputs
\ No newline at end of file
+    # Flatten the batch: one entry per token, with its feature and example index.
+    lengths = np.fromiter(map(len, batched_word_ids), dtype=np.int64)
+    n_tokens = int(lengths.sum())
+    word_ids = np.fromiter(
+        (-1 if w is None else w for ids in batched_word_ids for w in ids),
+        dtype=np.int64,
+        count=n_tokens,
+    )
+    feature_index = np.repeat(np.arange(len(lengths)), lengths)
+    example_index = np.asarray(sample_mapping, dtype=np.int64)[feature_index]
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+    # [CLS] Question [SEP] Passage [SEP] [PAD] ..
+    #  -100, -100... -100
+    # Passage tokens are those behind the first [SEP], i.e. two special tokens are in front of them.
+    is_special = word_ids == -1
+    n_special_before = np.cumsum(is_special) - is_special
+    n_special_before -= np.repeat(n_special_before[offsets[:-1]], lengths)
+    in_passage = n_special_before >= 2
+
+    # Only the first subword of each word carries a tag.
+    prev_word_ids = np.concatenate(([-1], word_ids[:-1]))
+    first_subword = in_passage & ~is_special & (word_ids != prev_word_ids)
+
+    # Flatten answers: one entry per answer, with its example index.
+    n_answers = np.fromiter(
+        (len(answers["start_pos"]) for answers in batched_answers), dtype=np.int64
+    )
+    starts = np.fromiter(
+        (s for answers in batched_answers for s in answers["start_pos"]),
+        dtype=np.int64,
+    )
+    ends = np.fromiter(
+        (e for answers in batched_answers for e in answers["end_pos"]),
+        dtype=np.int64,
+    )
+    answer_example_index = np.repeat(np.arange(len(batched_answers)), n_answers)
+
+    # Examples without any answer keep -100 on every token.
+    first_subword &= n_answers[example_index] > 0
+
+    # Paint the index of the last answer covering each (example, word) cell of a grid.
+    span_lengths = np.maximum(ends - starts, 0)
+    cell_answer = np.repeat(np.arange(len(starts)), span_lengths)
+    cell_word = (
+        np.arange(len(cell_answer))
+        - np.repeat(np.cumsum(span_lengths) - span_lengths, span_lengths)
+        + starts[cell_answer]
+    )
+    valid = cell_word >= 0
+    cell_answer, cell_word = cell_answer[valid], cell_word[valid]
+    n_words = max(int(word_ids.max(initial=-1)), int(cell_word.max(initial=-1))) + 1
+    last_answer = np.full((len(batched_answers), n_words), -1, dtype=np.int64)
+    np.maximum.at(
+        last_answer, (answer_example_index[cell_answer], cell_word), cell_answer
+    )
+
+    # Look up the tag of each first subword from the grid.
+    w = word_ids[first_subword]
+    answer = last_answer[example_index[first_subword], w]
+    covered = answer >= 0
+    span_start = starts[answer]
+    span_end = ends[answer]
+    if label_strategy == LabelStrategy.IOB2:
+        tags = np.where(
+            w == span_start,
+            label_to_id[IOB2.BEGINNING.value],
+            label_to_id[IOB2.INSIDE.value],
+        )
+    else:
+        tags = np.select(
+            [span_end - span_start == 1, w == span_start, w == span_end - 1],
+            [
+                label_to_id[IOBES.SINGLETON.value],
+                label_to_id[IOBES.BEGINNING.value],
+                label_to_id[IOBES.END.value],
+            ],
+            default=label_to_id[IOBES.INSIDE.value],
+        )
+
+    # [CLS] Question [SEP] Passage [SEP] [PAD] ...
+    #                      ........ -100 -100 ...
+    label_ids = np.full(n_tokens, pad_token_label_id, dtype=np.int8)
+    label_ids[first_subword] = np.where(covered, tags, outside_id)
+    return np.split(label_ids, offsets[1:-1])
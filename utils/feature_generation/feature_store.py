@@ -0,0 +1,175 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Persistent on-disk store of features keyed by tokenizer and featurization config
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+from typing import Dict, List, Optional
+from datasets import Dataset
+
+logger = logging.getLogger(__name__)
+
+# Bump it whenever the featurizer changes the features it produces.
+FEATURE_VERSION = 2
+
+
+def tokenizer_digest(tokenizer) -> str:
+    """
+    A digest of a tokenizer, which covers its vocab, added tokens, normalizer and pre-tokenizer.
+
+    Args:
+        `tokenizer`: A tokenizer of transformers.
+    Type:
+        `tokenizer`: `transformers.PreTrainedTokenizerBase`
+    Return:
+        rtype: string
+    """
+
+    h = hashlib.sha256()
+    h.update(type(tokenizer).__name__.encode("utf-8"))
+    backend_tokenizer = getattr(tokenizer, "backend_tokenizer", None)
+    if backend_tokenizer is not None:
+        # Truncation and padding are runtime states set by each call of the tokenizer.
+        state = json.loads(backend_tokenizer.to_str())
+        state.pop("truncation", None)
+        state.pop("padding", None)
+        h.update(json.dumps(state, sort_keys=True).encode("utf-8"))
+    else:
+        h.update(json.dumps(sorted(tokenizer.get_vocab().items())).encode("utf-8"))
+    h.update(json.dumps(sorted(tokenizer.get_added_vocab().items())).encode("utf-8"))
+    return h.hexdigest()
+
+
+class FeatureStore:
+    """
+    A directory of features that are saved as memory-mapped Arrow shards, one shard per split.
+    A shard is keyed by a hash of the tokenizer, the digest of source files, and the featurization config,
+    so a repeat run opens it instantly, while only the shards whose key changed are rebuilt.
+
+    Layout:
+        `cache_dir`/`{split}-{key}`/   : A shard saved by `datasets.Dataset.save_to_disk`.
+        `cache_dir`/file_digests.json  : Digests of source files, memoized by (path, size, mtime).
+
+    Args:
+        `cache_dir`: A directory to store features.
+    Type:
+        `cache_dir`: string
+    """
+
+    DIGESTS_FILE = "file_digests.json"
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = os.path.abspath(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._digests_path = os.path.join(self.cache_dir, self.DIGESTS_FILE)
+        if os.path.exists(self._digests_path):
+            with open(self._digests_path, "r", encoding="utf-8") as f:
+                self._digests = json.load(f)
+        else:
+            self._digests = dict()
+
+    def source_digest(self, dataset: Dataset) -> str:
+        """
+        A digest of the Arrow files backing the source dataset.
+        Falls back to the fingerprint of datasets when the dataset lives in memory.
+        """
+
+        filenames = [f["filename"] for f in dataset.cache_files]
+        if not filenames:
+            return dataset._fingerprint
+        h = hashlib.sha256()
+        for filename in filenames:
+            h.update(self._file_digest(filename).encode("utf-8"))
+        return h.hexdigest()
+
+    def key(self, dataset: Dataset, featurizer, extra: Optional[Dict] = None) -> str:
+        payload = {
+            "feature_version": FEATURE_VERSION,
+            "tokenizer": tokenizer_digest(featurizer.tokenizer),
+            "source": self.source_digest(dataset),
+            "featurizer": featurizer.config,
+            "extra": extra or dict(),
+        }
+        return hashlib.sha256(
+            json.dumps(payload, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:16]
+
+    def load_or_build(
+        self,
+        split: str,
+        dataset: Dataset,
+        featurizer,
+        num_proc: Optional[int] = None,
+        overwrite: bool = False,
+        extra: Optional[Dict] = None,
+    ) -> Dataset:
+        """
+        Open the shard of a split if it is up to date; otherwise featurize the split and save a new shard.
+
+        Args:
+            `split`: The name of split, e.g. `train`.
+            `dataset`: The source dataset of the split.
+            `featurizer`: A `Featurizer` to build features.
+            `num_proc`: The number of worker processes of featurization.
+            `overwrite`: Rebuild the shard even if it is up to date.
+            `extra`: Other settings that should invalidate the shard, e.g. the dataset config name.
+        Type:
+            `split`: string
+            `dataset`: `datasets.Dataset`
+            `featurizer`: `feature_generation.Featurizer`
+            `num_proc`: integer
+            `overwrite`: bool
+            `extra`: dict
+        Return:
+            Features of the split.
+            rtype: `datasets.Dataset`
+        """
+
+        key = self.key(dataset, featurizer, extra)
+        shard_path = os.path.join(self.cache_dir, f"{split}-{key}")
+        if os.path.isdir(shard_path) and not overwrite:
+            logger.info(f"Open features of {split} from {shard_path}")
+            return Dataset.load_from_disk(shard_path)
+
+        logger.info(f"Build features of {split} into {shard_path}")
+        features = dataset.map(
+            featurizer,
+            batched=True,
+            num_proc=num_proc,
+            load_from_cache_file=False,
+            features=featurizer.features,
+            remove_columns=dataset.column_names,
+        )
+        tmp_path = f"{shard_path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        features.save_to_disk(tmp_path)
+        shutil.rmtree(shard_path, ignore_errors=True)
+        os.replace(tmp_path, shard_path)
+        for stale_path in self._shards(split):
+            if stale_path != shard_path:
+                logger.info(f"Remove stale features of {split} at {stale_path}")
+                shutil.rmtree(stale_path, ignore_errors=True)
+        return Dataset.load_from_disk(shard_path)
+
+    def _shards(self, split: str) -> List[str]:
+        return [
+            os.path.join(self.cache_dir, name)
+            for name in os.listdir(self.cache_dir)
+            if name.startswith(f"{split}-") and not name.endswith(".tmp")
+        ]
+
+    def _file_digest(self, filename: str) -> str:
+        stat = os.stat(filename)
+        memo_key = f"{filename}:{stat.st_size}:{stat.st_mtime_ns}"
+        if memo_key not in self._digests:
+            h = hashlib.sha256()
+            with open(filename, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+            self._digests[memo_key] = h.hexdigest()
+            with open(self._digests_path, "w", encoding="utf-8") as f:
+                json.dump(self._digests, f, indent=4)
+        return self._digests[memo_key]
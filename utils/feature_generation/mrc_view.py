@@ -0,0 +1,213 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: A lazy MRC view of a plain dataset, which asks every query of each passage on the fly
+
+import logging
+import os
+import sys
+
+sys.path.append(os.getcwd())
+from typing import Callable, Dict, Iterator, List, Optional, Union
+from datasets import Dataset
+
+logger = logging.getLogger(__name__)
+
+
+def expand_batch(
+    batched_passages: Dict[str, List], queries: Dict[str, str]
+) -> Dict[str, List]:
+    """
+    Expand a batch of plain examples into MRC examples, one per (passage, query) in the order of an MRC config,
+    i.e. all queries of the first passage, then all queries of the second one, and so on.
+    Answers of a passage are bucketed by type in one pass, and a type without answers gets the
+    `start_pos: -1` placeholder, same as `*_mrc` configs of the loading scripts.
+
+    Args:
+        `batched_passages`: A batch of plain examples, e.g. of the `genia` config.
+        `queries`: A map from an entity type to its question.
+    Type:
+        `batched_passages`: dict of list
+        `queries`: dict
+    Return:
+        A batch of MRC examples, with `question` besides the columns of passages.
+        rtype: dict of list
+    """
+
+    n_queries = len(queries)
+    batched_examples = {
+        key: [value for value in values for _ in range(n_queries)]
+        for key, values in batched_passages.items()
+        if key != "answers"
+    }
+    batched_examples["question"] = list(queries.values()) * len(
+        next(iter(batched_passages.values()), [])
+    )
+    if "answers" in batched_passages:
+        batched_examples["answers"] = list()
+        for answers in batched_passages["answers"]:
+            answers_by_type = dict()
+            for i, type in enumerate(answers["type"]):
+                answers_by_type.setdefault(type, list()).append(i)
+            for tag in queries:
+                indices = answers_by_type.get(tag)
+                batched_examples["answers"].append(
+                    {
+                        key: [values[i] for i in indices]
+                        for key, values in answers.items()
+                    }
+                    if indices
+                    else {
+                        "type": [tag],
+                        "text": [None],
+                        "start_pos": [-1],
+                        "end_pos": [-1],
+                    }
+                )
+    return batched_examples
+
+
+class _ExpandThen:
+    """
+    Expand a batch of passages before calling `function`, so `Dataset.map` over passages featurizes MRC examples.
+    Indices of passages are turned into indices of MRC examples. It is a class, so it can be pickled into workers.
+    """
+
+    def __init__(self, function: Callable, queries: Dict[str, str]):
+        self.function = function
+        self.queries = queries
+
+    def __call__(self, batched_passages, indices: Optional[List[int]] = None):
+        batched_examples = expand_batch(batched_passages, self.queries)
+        if indices is None:
+            return self.function(batched_examples)
+        n_queries = len(self.queries)
+        return self.function(
+            batched_examples,
+            [index * n_queries + k for index in indices for k in range(n_queries)],
+        )
+
+
+class MRCView:
+    """
+    A read-only MRC dataset over a plain dataset of passages and a query table.
+    The `*_mrc` configs cache one row per (passage, query), each with its own copy of the passage,
+    whereas a view keeps every passage once and makes the row of (passage_idx, query_idx) only when it is read,
+    with index = passage_idx * n_queries + query_idx. Rows, their order and features are the same as those of `*_mrc`.
+    It supports what featurization and prediction use of `datasets.Dataset`: `len`, indexing, iteration,
+    `column_names` and a batched `map`, which returns a real `datasets.Dataset` of features for `Trainer`.
+
+    Args:
+        `passages`: A split of a plain config, e.g. `genia`.
+        `queries`: A map from an entity type to its question.
+    Type:
+        `passages`: `datasets.Dataset`
+        `queries`: dict
+    """
+
+    def __init__(self, passages: Dataset, queries: Dict[str, str]):
+        if not queries:
+            raise ValueError("A MRC view requires queries")
+        if "question" in passages.column_names:
+            raise ValueError(
+                "A MRC view is built on a plain config, but the dataset already has questions"
+            )
+        self.passages = passages
+        self.queries = dict(queries)
+
+    @property
+    def num_rows(self) -> int:
+        return self.passages.num_rows * len(self.queries)
+
+    def __len__(self):
+        return self.num_rows
+
+    @property
+    def column_names(self) -> List[str]:
+        return self.passages.column_names + ["question"]
+
+    @property
+    def cache_files(self) -> List[Dict]:
+        return self.passages.cache_files
+
+    @property
+    def _fingerprint(self) -> str:
+        return self.passages._fingerprint
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(features: {self.column_names}, num_rows: {self.num_rows}, "
+            f"num_passages: {self.passages.num_rows}, num_queries: {len(self.queries)})"
+        )
+
+    def __getitem__(self, key: Union[int, slice, List[int]]) -> Dict:
+        """
+        A row of an integer index, or a batch (dict of list) of a slice or a list of indices, as `datasets.Dataset`.
+        """
+
+        n_queries = len(self.queries)
+        if not isinstance(key, (slice, list, range)):
+            key = int(key)
+            if key < 0:
+                key += self.num_rows
+            if not 0 <= key < self.num_rows:
+                raise IndexError(f"Index {key} is out of range of {self.num_rows}")
+            passage_idx, query_idx = divmod(key, n_queries)
+            batch = expand_batch(
+                self.passages[passage_idx : passage_idx + 1], self.queries
+            )
+            return {column: values[query_idx] for column, values in batch.items()}
+        indices = range(*key.indices(self.num_rows)) if isinstance(key, slice) else key
+        indices = [index + self.num_rows if index < 0 else index for index in indices]
+        # Read each passage once, then pick the rows out of its expansion.
+        passage_indices = sorted(set(index // n_queries for index in indices))
+        batch = expand_batch(self.passages[passage_indices], self.queries)
+        position = {p: i * n_queries for i, p in enumerate(passage_indices)}
+        rows = [position[index // n_queries] + index % n_queries for index in indices]
+        return {column: [values[i] for i in rows] for column, values in batch.items()}
+
+    def __iter__(self) -> Iterator[Dict]:
+        for passage in self.passages:
+            batch = expand_batch(
+                {key: [value] for key, value in passage.items()}, self.queries
+            )
+            for k in range(len(self.queries)):
+                yield {column: values[k] for column, values in batch.items()}
+
+    def map(
+        self,
+        function: Callable,
+        batched: bool = False,
+        with_indices: bool = False,
+        batch_size: int = 1000,
+        remove_columns: Optional[List[str]] = None,
+        **kwargs,
+    ) -> Dataset:
+        """
+        `datasets.Dataset.map` of a batched `function` that turns MRC examples into new rows, e.g. a `Featurizer`.
+        It maps over passages and expands each batch right before `function`, so no MRC row is ever cached.
+        All columns of the view must be removed, since one passage gives several rows.
+        `batch_size` counts MRC examples, and the other `kwargs` (e.g. `num_proc` and `features`) go to `map`.
+        """
+
+        if not batched:
+            raise ValueError("A MRC view only supports batched map")
+        if set(remove_columns or []) != set(self.column_names):
+            raise ValueError(
+                f"A MRC view must remove all of its columns {self.column_names}, but got {remove_columns}"
+            )
+        return self.passages.map(
+            _ExpandThen(function, self.queries),
+            batched=True,
+            with_indices=with_indices,
+            batch_size=max(1, batch_size // len(self.queries)),
+            remove_columns=self.passages.column_names,
+            **kwargs,
+        )
+
+
+def mrc_views(dataset, queries: Dict[str, str]) -> Dict[str, MRCView]:
+    """
+    MRC views of every split of a plain `datasets.DatasetDict`.
+    """
+
+    return {split: MRCView(passages, queries) for split, passages in dataset.items()}
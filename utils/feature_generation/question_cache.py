@@ -0,0 +1,115 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Per-process cache of tokenized questions
+
+import logging
+from collections import OrderedDict
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def tokenizer_fingerprint(tokenizer) -> Tuple:
+    """
+    A cheap fingerprint of a tokenizer.
+    It changes when another tokenizer is used or when tokens are added to the vocab.
+
+    Args:
+        `tokenizer`: A tokenizer of transformers.
+    Type:
+        `tokenizer`: `transformers.PreTrainedTokenizerBase`
+    Return:
+        rtype: tuple
+    """
+
+    return (
+        type(tokenizer).__name__,
+        tokenizer.name_or_path,
+        len(tokenizer),
+        getattr(tokenizer, "do_lower_case", None),
+    )
+
+
+class QuestionTokenCache:
+    """
+    A bounded LRU cache of question tokens keyed by (tokenizer fingerprint, question text).
+    In MRC configs, questions come from a small fixed `QUERIES` dict,
+    so almost every lookup should be a hit.
+
+    Args:
+        `maxsize`: The maximum number of questions to be kept.
+    Type:
+        `maxsize`: integer
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def tokenize(self, tokenizer, question: str) -> List[str]:
+        """
+        Tokens of a question, i.e. `tokenizer.tokenize(question)`.
+        """
+
+        tokens = self._lookup(
+            (tokenizer_fingerprint(tokenizer), "tokenize", question),
+            lambda: tuple(tokenizer.tokenize(question)),
+        )
+        return list(tokens)
+
+    def encode(self, tokenizer, question: str) -> Tuple[List[int], List[int]]:
+        """
+        Input ids and word ids of a question without special tokens.
+        The question tokens are encoded as pre-split words, same as `tokenize_and_align_labels` does.
+        """
+
+        def _encode():
+            encoding = tokenizer(
+                self.tokenize(tokenizer, question),
+                is_split_into_words=True,
+                add_special_tokens=False,
+            )
+            return tuple(encoding["input_ids"]), tuple(encoding.word_ids())
+
+        input_ids, word_ids = self._lookup(
+            (tokenizer_fingerprint(tokenizer), "encode", question), _encode
+        )
+        return list(input_ids), list(word_ids)
+
+    def _lookup(self, key, compute):
+        value = self._cache.get(key)
+        if value is None:
+            self.misses += 1
+            value = compute()
+            self._cache[key] = value
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        else:
+            self.hits += 1
+            self._cache.move_to_end(key)
+        return value
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def clear(self):
+        self.hits = 0
+        self.misses = 0
+        self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __repr__(self):
+        return (
+            f"QuestionTokenCache(hits={self.hits}, misses={self.misses}, "
+            f"hit_rate={self.hit_rate:.4f}, size={len(self)}, maxsize={self.maxsize})"
+        )
+
+
+# One cache per process; worker processes of `datasets.map` get their own.
+question_token_cache = QuestionTokenCache()
@@ -0,0 +1,231 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Samplers that batch features of similar lengths together
+
+import logging
+from typing import Dict, Iterator, List, Optional
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+logger = logging.getLogger(__name__)
+
+
+class LengthGroupedSampler(Sampler):
+    """
+    Yield indices so that features of similar lengths fall into the same batch,
+    which keeps dynamic padding short.
+    With `shuffle`, indices are randomly split into mega-batches of `batch_size * megabatch_mult` features
+    and each mega-batch is sorted by length, so batches are still random across epochs.
+    Without `shuffle`, all indices are sorted by length, which suits evaluation.
+
+    Args:
+        `lengths`: The number of tokens of each feature (without padding).
+        `batch_size`: The batch size.
+        `shuffle`: Whether to shuffle before grouping.
+        `megabatch_mult`: The number of batches in a mega-batch.
+        `generator`: The random generator of shuffling. The global one of torch if None.
+    Type:
+        `lengths`: list of integer
+        `batch_size`: integer
+        `shuffle`: bool
+        `megabatch_mult`: integer
+        `generator`: `torch.Generator`
+    """
+
+    def __init__(
+        self,
+        lengths: List[int],
+        batch_size: int,
+        shuffle: bool = True,
+        megabatch_mult: int = 50,
+        generator: Optional[torch.Generator] = None,
+    ):
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.megabatch_size = batch_size * megabatch_mult
+        self.generator = generator
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __iter__(self) -> Iterator[int]:
+        if not self.shuffle:
+            return iter(np.argsort(-self.lengths, kind="stable").tolist())
+
+        indices = torch.randperm(len(self.lengths), generator=self.generator).numpy()
+        megabatches = [
+            indices[i : i + self.megabatch_size]
+            for i in range(0, len(indices), self.megabatch_size)
+        ]
+        return iter(
+            np.concatenate(
+                [mb[np.argsort(-self.lengths[mb], kind="stable")] for mb in megabatches]
+                or [indices]
+            ).tolist()
+        )
+
+
+class TokenBudgetBatchSampler(Sampler):
+    """
+    Yield batches of indices whose padded size, i.e. the number of features times the longest of them,
+    stays within `max_tokens`, so a batch of short features holds more of them than a batch of long ones.
+    With `group_by_length`, features are ordered as `LengthGroupedSampler` does before they are cut into batches,
+    so each batch has features of similar lengths; otherwise they are cut in order (random order with `shuffle`).
+    With `shuffle`, the order of batches is shuffled too, so long batches do not always come first.
+    A feature longer than `max_tokens` makes a batch of its own.
+    Batches of an epoch are planned when its length is asked, so `len()` is exact for `Trainer`.
+
+    Args:
+        `lengths`: The number of tokens of each feature (without padding).
+        `max_tokens`: The maximum number of tokens (with paddings) of a batch.
+        `shuffle`: Whether to shuffle features and batches every epoch.
+        `group_by_length`: Whether to group features of similar lengths.
+        `max_batch_size`: The maximum number of features of a batch, if not None.
+        `megabatch_mult`: The number of batches in a mega-batch (see `LengthGroupedSampler`).
+    Type:
+        `lengths`: list of integer
+        `max_tokens`: integer
+        `shuffle`: bool
+        `group_by_length`: bool
+        `max_batch_size`: integer
+        `megabatch_mult`: integer
+    """
+
+    def __init__(
+        self,
+        lengths: List[int],
+        max_tokens: int,
+        shuffle: bool = True,
+        group_by_length: bool = True,
+        max_batch_size: Optional[int] = None,
+        megabatch_mult: int = 50,
+    ):
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.max_tokens = max_tokens
+        self.shuffle = shuffle
+        self.group_by_length = group_by_length
+        self.max_batch_size = max_batch_size
+        self.megabatch_mult = megabatch_mult
+        self._planned = None
+
+    def __len__(self):
+        if self._planned is None:
+            self._planned = self._plan()
+        return len(self._planned)
+
+    def __iter__(self) -> Iterator[List[int]]:
+        batches = self._planned if self._planned is not None else self._plan()
+        self._planned = None
+        return iter(batches)
+
+    def _plan(self) -> List[List[int]]:
+        if len(self.lengths) == 0:
+            return list()
+        if self.group_by_length:
+            # A typical batch size, so mega-batches span about `megabatch_mult` batches.
+            batch_size = max(1, self.max_tokens // max(int(np.median(self.lengths)), 1))
+            order = np.asarray(
+                list(
+                    LengthGroupedSampler(
+                        self.lengths, batch_size, self.shuffle, self.megabatch_mult
+                    )
+                ),
+                dtype=np.int64,
+            )
+        elif self.shuffle:
+            order = torch.randperm(len(self.lengths)).numpy()
+        else:
+            order = np.arange(len(self.lengths))
+
+        batches, batch, max_length = list(), list(), 0
+        for idx, length in zip(order.tolist(), self.lengths[order].tolist()):
+            if batch and (
+                (len(batch) + 1) * max(max_length, length) > self.max_tokens
+                or (self.max_batch_size and len(batch) == self.max_batch_size)
+            ):
+                batches.append(batch)
+                batch, max_length = list(), 0
+            batch.append(idx)
+            max_length = max(max_length, length)
+        batches.append(batch)
+
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches)).tolist()]
+        return batches
+
+
+def pad_fraction(
+    lengths: List[int],
+    batch_size: int,
+    order: Optional[List[int]] = None,
+    max_seq_length: Optional[int] = None,
+) -> float:
+    """
+    The fraction of pad tokens among all tokens that are fed into model.
+
+    Args:
+        `lengths`: The number of tokens of each feature (without padding).
+        `batch_size`: The batch size.
+        `order`: The order of features, e.g. indices from a sampler. Sequential if None.
+        `max_seq_length`: Pad every feature to it (padding strategy of `max_length`) if not None.
+    Type:
+        `lengths`: list of integer
+        `batch_size`: integer
+        `order`: list of integer
+        `max_seq_length`: integer
+    Return:
+        rtype: float
+    """
+
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if order is not None:
+        lengths = lengths[np.asarray(order, dtype=np.int64)]
+    if len(lengths) == 0:
+        return 0.0
+    if max_seq_length is not None:
+        padded = max_seq_length * len(lengths)
+    else:
+        n_batches = -(-len(lengths) // batch_size)
+        batch_max = np.maximum.reduceat(lengths, np.arange(n_batches) * batch_size)
+        batch_sizes = np.diff(
+            np.append(np.arange(n_batches) * batch_size, len(lengths))
+        )
+        padded = int((batch_max * batch_sizes).sum())
+    return float(1.0 - lengths.sum() / padded)
+
+
+def pad_fraction_report(
+    lengths: List[int], batch_size: int, max_seq_length: int, seed: int = 0
+) -> Dict[str, float]:
+    """
+    Pad-token fraction of features padded to `max_seq_length`,
+    padded per randomly sampled batch, and padded per length-grouped batch.
+    Batches are sampled by a generator of its own `seed`, so the report leaves the global RNG of training untouched.
+    """
+
+    generator = torch.Generator().manual_seed(seed)
+    return {
+        "max_length": round(
+            pad_fraction(lengths, batch_size, max_seq_length=max_seq_length), 4
+        ),
+        "random_batch": round(
+            pad_fraction(
+                lengths,
+                batch_size,
+                order=torch.randperm(len(lengths), generator=generator),
+            ),
+            4,
+        ),
+        "length_grouped_batch": round(
+            pad_fraction(
+                lengths,
+                batch_size,
+                order=list(
+                    LengthGroupedSampler(lengths, batch_size, generator=generator)
+                ),
+            ),
+            4,
+        ),
+    }
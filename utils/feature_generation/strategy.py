@@ -24,3 +24,9 @@ class LabelStrategy(Enum):
     IOB2 = "iob2"
     IOBES = "iobes"
     STARTEND = "startend"
+
+
+class StitchStrategy(Enum):
+    MEAN = "mean"
+    MAX = "max"
+    CENTRE = "centre"
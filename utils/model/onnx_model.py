@@ -0,0 +1,182 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Export a token classification model to ONNX and run it with onnxruntime on CPU
+
+import logging
+import os
+from typing import Dict, List, Optional
+import numpy as np
+import torch
+from torch import nn
+from transformers import AutoConfig
+
+logger = logging.getLogger(__name__)
+
+ONNX_WEIGHTS_NAME = "model.onnx"
+OUTPUT_NAMES = ["logits"]
+
+
+def _import_onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError:
+        raise ImportError(
+            "The ONNX backend needs onnxruntime, e.g. `pip install onnx onnxruntime`."
+        )
+    return onnxruntime
+
+
+class _LogitsOnly(nn.Module):
+    """
+    Take inputs by position and return logits only, which is what `torch.onnx.export` traces.
+    """
+
+    def __init__(self, model, input_names: List[str]):
+        super().__init__()
+        self.model = model
+        self.input_names = input_names
+
+    def forward(self, *inputs):
+        return self.model(**dict(zip(self.input_names, inputs)))[0]
+
+
+def dummy_inputs(
+    tokenizer, model_input_names: List[str], batch_size: int = 2, seq_len: int = 16
+) -> Dict[str, torch.Tensor]:
+    """
+    A batch of inputs with paddings, used for tracing and parity checks.
+    """
+
+    input_ids = torch.randint(
+        low=len(tokenizer.all_special_ids),
+        high=len(tokenizer),
+        size=(batch_size, seq_len),
+    )
+    attention_mask = torch.ones(batch_size, seq_len, dtype=torch.long)
+    # Pad the tail of the first row, so paddings are traced too.
+    attention_mask[0, seq_len // 2 :] = 0
+    input_ids[0, seq_len // 2 :] = tokenizer.pad_token_id
+    inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+    if "token_type_ids" in model_input_names:
+        inputs["token_type_ids"] = torch.zeros(batch_size, seq_len, dtype=torch.long)
+        inputs["token_type_ids"][:, seq_len // 4 :] = 1
+    if "query_ids" in model_input_names:
+        inputs["query_ids"] = torch.zeros(batch_size, seq_len, dtype=torch.long)
+        inputs["query_ids"][:, 1 : seq_len // 4] = 1
+    return inputs
+
+
+def export_onnx(
+    model,
+    tokenizer,
+    output_file_path: str,
+    model_input_names: List[str],
+    opset_version: int = 12,
+):
+    """
+    Export a model to ONNX with dynamic batch and sequence axes.
+
+    Args:
+        `model`: A model for token classification, or a packed-query model.
+        `tokenizer`: The tokenizer of the model.
+        `output_file_path`: A path of the onnx file.
+        `model_input_names`: Names of inputs, e.g. input_ids, attention_mask and token_type_ids.
+        `opset_version`: The ONNX opset version.
+    Type:
+        `model`: `torch.nn.Module`
+        `tokenizer`: `transformers.PreTrainedTokenizerFast`
+        `output_file_path`: string
+        `model_input_names`: list of string
+        `opset_version`: integer
+    """
+
+    model = model.cpu().eval()
+    inputs = dummy_inputs(tokenizer, model_input_names)
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in model_input_names}
+    dynamic_axes["logits"] = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            _LogitsOnly(model, model_input_names),
+            tuple(inputs[name] for name in model_input_names),
+            output_file_path,
+            input_names=model_input_names,
+            output_names=OUTPUT_NAMES,
+            dynamic_axes=dynamic_axes,
+            opset_version=opset_version,
+            do_constant_folding=True,
+        )
+    logger.info(f"Export onnx model into {output_file_path}")
+
+
+class OnnxModelForTokenClassification:
+    """
+    An onnxruntime session (CPU provider) that is called like a model of transformers,
+    i.e. `model(**inputs)[0]` gives logits as a torch tensor, so `Predictor` can run it as is.
+
+    Args:
+        `onnx_file_path`: A path of the onnx file.
+        `config`: The config of the model, which carries `id2label`.
+        `num_threads`: The number of intra-op threads, or None to let onnxruntime decide.
+    Type:
+        `onnx_file_path`: string
+        `config`: `transformers.PretrainedConfig`
+        `num_threads`: integer
+    """
+
+    def __init__(self, onnx_file_path: str, config, num_threads: Optional[int] = None):
+        onnxruntime = _import_onnxruntime()
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            onnx_file_path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.config = config
+
+    @classmethod
+    def from_pretrained(cls, model_dir: str, num_threads: Optional[int] = None):
+        return cls(
+            os.path.join(model_dir, ONNX_WEIGHTS_NAME),
+            AutoConfig.from_pretrained(model_dir),
+            num_threads=num_threads,
+        )
+
+    def to(self, device):
+        if torch.device(device).type != "cpu":
+            logger.warning(f"The ONNX backend runs on CPU only, not on {device}.")
+        return self
+
+    def eval(self):
+        return self
+
+    def __call__(self, **inputs):
+        feeds = {
+            name: inputs[name].cpu().numpy().astype(np.int64)
+            for name in self.input_names
+        }
+        (logits,) = self.session.run(OUTPUT_NAMES, feeds)
+        return (torch.from_numpy(logits),)
+
+
+def check_parity(
+    model, onnx_model, inputs: Dict[str, torch.Tensor], atol: float = 1e-4
+) -> float:
+    """
+    The max absolute difference between logits of PyTorch and ONNX on non-padding tokens.
+    Raise ValueError if it is beyond `atol`.
+    """
+
+    with torch.no_grad():
+        expected = model.cpu().eval()(**inputs)[0].numpy()
+    actual = onnx_model(**inputs)[0].numpy()
+    mask = inputs["attention_mask"].numpy().astype(bool)
+    diff = float(np.abs(expected - actual)[mask].max())
+    if diff > atol:
+        raise ValueError(
+            f"Logits of ONNX differ from PyTorch by {diff:.2e}, beyond atol {atol:.0e}."
+        )
+    return diff
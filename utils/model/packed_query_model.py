@@ -0,0 +1,159 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Token classification over packed queries, one label head per query
+
+import json
+import logging
+import os
+from typing import Dict, Optional
+import torch
+from torch import nn
+from torch.nn import CrossEntropyLoss as CE
+from transformers import AutoConfig, AutoModel
+from transformers.file_utils import WEIGHTS_NAME
+from transformers.modeling_outputs import TokenClassifierOutput
+
+logger = logging.getLogger(__name__)
+
+PACKED_CONFIG_NAME = "packed_queries.json"
+
+
+class PackedQueryModelForTokenClassification(nn.Module):
+    """
+    An encoder of transformers with a query-segment embedding and K label heads,
+    for features whose K questions are packed in front of the passage (see `Featurizer` with `queries`).
+    The query-segment embedding is added to word embeddings, so tokens of the k-th question are marked,
+    and the k-th head tags the passage for the entity type of the k-th question.
+
+    Args:
+        `encoder`: A base model of transformers, e.g. `BertModel`.
+        `queries`: A map from an entity type to its question, in the order of packing.
+        `num_labels`: The number of tags of a label strategy, e.g. 3 for IOB2.
+    Type:
+        `encoder`: `transformers.PreTrainedModel`
+        `queries`: dict
+        `num_labels`: integer
+    """
+
+    def __init__(self, encoder, queries: Dict[str, str], num_labels: int):
+        super().__init__()
+        self.encoder = encoder
+        self.config = encoder.config
+        self.queries = dict(queries)
+        self.num_queries = len(self.queries)
+        self.num_labels = num_labels
+
+        hidden_size = self.config.hidden_size
+        # Index 0 is for special tokens, passage tokens and paddings.
+        self.query_embeddings = nn.Embedding(
+            self.num_queries + 1, hidden_size, padding_idx=0
+        )
+        self.dropout = nn.Dropout(self.config.hidden_dropout_prob)
+        self.classifier = nn.Linear(hidden_size, self.num_queries * num_labels)
+
+        initializer_range = getattr(self.config, "initializer_range", 0.02)
+        self.query_embeddings.weight.data.normal_(mean=0.0, std=initializer_range)
+        self.query_embeddings.weight.data[0].zero_()
+        self.classifier.weight.data.normal_(mean=0.0, std=initializer_range)
+        self.classifier.bias.data.zero_()
+
+    @classmethod
+    def from_pretrained(
+        cls,
+        model_name_or_path: str,
+        queries: Optional[Dict[str, str]] = None,
+        config=None,
+        cache_dir: Optional[str] = None,
+    ):
+        """
+        Load a packed model saved by `save_pretrained`,
+        or start a new one from a pretrained encoder, e.g. `bert-base-uncased`.
+        """
+
+        packed_config_file = os.path.join(model_name_or_path, PACKED_CONFIG_NAME)
+        if os.path.isfile(packed_config_file):
+            with open(packed_config_file, "r", encoding="utf-8") as f:
+                packed_config = json.load(f)
+            encoder = AutoModel.from_config(
+                config or AutoConfig.from_pretrained(model_name_or_path)
+            )
+            model = cls(encoder, packed_config["queries"], packed_config["num_labels"])
+            state_dict = torch.load(
+                os.path.join(model_name_or_path, WEIGHTS_NAME), map_location="cpu"
+            )
+            model.load_state_dict(state_dict)
+            logger.info(f"Load packed model from {model_name_or_path}")
+            return model
+
+        if not queries:
+            raise ValueError(
+                f"{model_name_or_path} is not a packed model, so queries are required."
+            )
+        encoder = AutoModel.from_pretrained(
+            model_name_or_path, config=config, cache_dir=cache_dir
+        )
+        return cls(encoder, queries, encoder.config.num_labels)
+
+    def save_config(self, save_directory: str):
+        """
+        Save the config of encoder and packing next to the weights that `transformers.Trainer` saves.
+        """
+
+        os.makedirs(save_directory, exist_ok=True)
+        self.config.save_pretrained(save_directory)
+        with open(
+            os.path.join(save_directory, PACKED_CONFIG_NAME), "w", encoding="utf-8"
+        ) as f:
+            json.dump(
+                {"queries": self.queries, "num_labels": self.num_labels},
+                f,
+                indent=4,
+                ensure_ascii=False,
+            )
+
+    def save_pretrained(self, save_directory: str):
+        self.save_config(save_directory)
+        torch.save(self.state_dict(), os.path.join(save_directory, WEIGHTS_NAME))
+
+    def resize_token_embeddings(self, new_num_tokens: int):
+        return self.encoder.resize_token_embeddings(new_num_tokens)
+
+    def forward(
+        self,
+        input_ids=None,
+        attention_mask=None,
+        token_type_ids=None,
+        query_ids=None,
+        labels=None,
+    ):
+        """
+        Return:
+            Logits of shape (batch_size, seq_len, K, num_labels),
+            and the loss over labels of shape (batch_size, seq_len, K) if labels are given.
+            rtype: `transformers.modeling_outputs.TokenClassifierOutput`
+        """
+
+        inputs_embeds = self.encoder.get_input_embeddings()(input_ids)
+        if query_ids is not None:
+            inputs_embeds = inputs_embeds + self.query_embeddings(query_ids)
+        outputs = self.encoder(
+            inputs_embeds=inputs_embeds,
+            attention_mask=attention_mask,
+            token_type_ids=token_type_ids,
+        )
+        sequence_output = self.dropout(outputs[0])
+        batch_size, seq_len, _ = sequence_output.shape
+        logits = self.classifier(sequence_output).view(
+            batch_size, seq_len, self.num_queries, self.num_labels
+        )
+
+        loss = None
+        if labels is not None:
+            loss = CE()(logits.view(-1, self.num_labels), labels.view(-1))
+
+        return TokenClassifierOutput(
+            loss=loss,
+            logits=logits,
+            hidden_states=getattr(outputs, "hidden_states", None),
+            attentions=getattr(outputs, "attentions", None),
+        )
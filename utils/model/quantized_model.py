@@ -0,0 +1,125 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Dynamic int8 quantization of Linear layers, for CPU inference
+
+import io
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterable
+import numpy as np
+import torch
+from torch import nn
+from transformers import AutoConfig, AutoModel, AutoModelForTokenClassification
+from utils.model.packed_query_model import (
+    PACKED_CONFIG_NAME,
+    PackedQueryModelForTokenClassification,
+)
+
+logger = logging.getLogger(__name__)
+
+QUANTIZED_WEIGHTS_NAME = "pytorch_model_int8.bin"
+
+
+def quantize_dynamic(model: nn.Module) -> nn.Module:
+    """
+    A copy of the model whose Linear layers hold int8 weights and quantize activations on the fly.
+    Embeddings and LayerNorms stay in fp32. Dynamic quantization runs on CPU only.
+    """
+
+    return torch.quantization.quantize_dynamic(
+        model.cpu().eval(), {nn.Linear}, dtype=torch.qint8
+    )
+
+
+def model_size(model: nn.Module) -> int:
+    """
+    The number of bytes of the serialized state_dict, i.e. the size of the weights file.
+    """
+
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
+
+
+def measure_latency(
+    model: nn.Module, batches: Iterable[Dict[str, torch.Tensor]], n_warmup: int = 2
+) -> Dict[str, float]:
+    """
+    Latencies (ms) of forward passes over batches on CPU.
+
+    Args:
+        `model`: A model to time.
+        `batches`: Batches of the data collator. Labels are dropped.
+        `n_warmup`: The number of batches to run before timing.
+    Type:
+        `model`: `torch.nn.Module`
+        `batches`: iterable of dict
+        `n_warmup`: integer
+    Return:
+        The median, p90 and mean latency per batch, and the number of timed batches.
+        rtype: dict
+    """
+
+    model = model.cpu().eval()
+    batches = [
+        {k: v.cpu() for k, v in batch.items() if k != "labels"} for batch in batches
+    ]
+    latencies = list()
+    with torch.no_grad():
+        for batch in batches[:n_warmup]:
+            model(**batch)
+        for batch in batches:
+            start = time.perf_counter()
+            model(**batch)
+            latencies.append((time.perf_counter() - start) * 1000)
+    latencies = np.asarray(latencies)
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p90_ms": round(float(np.percentile(latencies, 90)), 3),
+        "mean_ms": round(float(latencies.mean()), 3),
+        "n_batches": len(latencies),
+    }
+
+
+def save_quantized(model: nn.Module, save_directory: str):
+    """
+    Save the weights of a quantized model with the configs to rebuild it by `load_quantized`.
+    A quantized state_dict only loads into a model that is quantized the same way,
+    so it is not saved as `pytorch_model.bin` for `from_pretrained`.
+    """
+
+    os.makedirs(save_directory, exist_ok=True)
+    if isinstance(model, PackedQueryModelForTokenClassification):
+        model.save_config(save_directory)
+    else:
+        model.config.save_pretrained(save_directory)
+    torch.save(model.state_dict(), os.path.join(save_directory, QUANTIZED_WEIGHTS_NAME))
+    logger.info(f"Save quantized model into {save_directory}")
+
+
+def load_quantized(model_dir: str) -> nn.Module:
+    """
+    Rebuild the fp32 architecture from configs, quantize it and load the int8 weights saved by `save_quantized`.
+    """
+
+    config = AutoConfig.from_pretrained(model_dir)
+    packed_config_file = os.path.join(model_dir, PACKED_CONFIG_NAME)
+    if os.path.isfile(packed_config_file):
+        with open(packed_config_file, "r", encoding="utf-8") as f:
+            packed_config = json.load(f)
+        model = PackedQueryModelForTokenClassification(
+            AutoModel.from_config(config),
+            packed_config["queries"],
+            packed_config["num_labels"],
+        )
+    else:
+        model = AutoModelForTokenClassification.from_config(config)
+    model = quantize_dynamic(model)
+    state_dict = torch.load(
+        os.path.join(model_dir, QUANTIZED_WEIGHTS_NAME), map_location="cpu"
+    )
+    model.load_state_dict(state_dict)
+    logger.info(f"Load quantized model from {model_dir}")
+    return model
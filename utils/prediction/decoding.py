@@ -0,0 +1,77 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Decode word-level tags back into answer spans
+
+import logging
+import os
+import sys
+
+sys.path.append(os.getcwd())
+from typing import Dict, List, Tuple
+from utils.data_structure.mrc import AnswerStruct
+
+logger = logging.getLogger(__name__)
+
+
+def _end_of_chunk(prev_tag: str, tag: str) -> bool:
+    return prev_tag in ("E", "S") or (prev_tag in ("B", "I") and tag in ("B", "S", "O"))
+
+
+def _start_of_chunk(prev_tag: str, tag: str) -> bool:
+    return tag in ("B", "S") or (prev_tag in ("E", "S", "O") and tag in ("I", "E"))
+
+
+def decode_spans(tag_ids, id_to_label: Dict[int, str]) -> List[Tuple[int, int]]:
+    """
+    Decode tags of words into chunks by the rules of conlleval (same as seqeval),
+    which work for both IOB2 and IOBES, e.g. a leading `I` also starts a chunk.
+
+    Args:
+        `tag_ids`: The tag id of each word of a passage.
+        `id_to_label`: A map from a label id to a tag.
+    Type:
+        `tag_ids`: list of integer or np.ndarray
+        `id_to_label`: dict
+    Return:
+        The first and the last word index of each chunk.
+        rtype: list of tuple of (integer, integer)
+    """
+
+    spans = list()
+    start = None
+    prev_tag = "O"
+    for idx, tag_id in enumerate(tag_ids):
+        tag = id_to_label[int(tag_id)]
+        if start is not None and _end_of_chunk(prev_tag, tag):
+            spans.append((start, idx - 1))
+            start = None
+        if _start_of_chunk(prev_tag, tag):
+            start = idx
+        prev_tag = tag
+    if start is not None:
+        spans.append((start, len(tag_ids) - 1))
+    return spans
+
+
+def spans_to_answers(
+    spans: List[Tuple[int, int]], passage_tokens: List[str], type: str
+) -> List[AnswerStruct]:
+    """
+    Turn chunks into answers.
+    Labels are painted on words from `start_pos` to `end_pos` (exclusive) of an answer,
+    so a chunk from `start` to `last` (inclusive) maps back to `end_pos = last + 1`,
+    and `text` is `passage_tokens[start_pos:end_pos]`.
+    """
+
+    answers = list()
+    for start, last in spans:
+        end = last + 1
+        answers.append(
+            AnswerStruct(
+                type=type,
+                text=" ".join(passage_tokens[start:end]),
+                start_pos=start,
+                end_pos=end,
+            )
+        )
+    return answers
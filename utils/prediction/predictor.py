@@ -0,0 +1,468 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Batched inference that decodes entity spans batch by batch
+
+import logging
+import os
+import sys
+
+sys.path.append(os.getcwd())
+from collections import deque
+from itertools import groupby
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+import torch
+from datasets import Dataset
+from transformers import AutoModelForTokenClassification, AutoTokenizer
+from utils.data_structure.mrc import AnswerStruct, DataStruct
+from utils.feature_generation.collator import DataCollatorWithDynamicPadding
+from utils.feature_generation.feature_generation import Featurizer
+from utils.feature_generation.strategy import PaddingStrategy, StitchStrategy
+from utils.model.onnx_model import OnnxModelForTokenClassification
+from utils.model.packed_query_model import (
+    PACKED_CONFIG_NAME,
+    PackedQueryModelForTokenClassification,
+)
+from utils.model.quantized_model import load_quantized
+from utils.prediction.decoding import decode_spans, spans_to_answers
+from utils.prediction.query_filter import LexiconQueryFilter
+from utils.prediction.result_cache import ResultCache, model_fingerprint
+from utils.prediction.stitching import stitch_windows
+
+logger = logging.getLogger(__name__)
+
+MODEL_INPUT_NAMES = ("input_ids", "attention_mask", "token_type_ids", "query_ids")
+
+
+class Predictor:
+    """
+    Run a token classification model over features in order and decode answers batch by batch,
+    so logits of the whole dataset are never kept in memory.
+    Windows (features) of the same example are consecutive, so an example is decoded
+    as soon as the feature of the next example shows up.
+    Logits of overlapping windows are stitched into word-level probabilities by `stitch_strategy`.
+
+    Args:
+        `model`: A model for token classification, or a packed-query model.
+        `featurizer`: The `Featurizer` that the model is trained with.
+        `id_to_label`: A map from a label id to a tag.
+        `batch_size`: The maximum number of features per forward pass.
+        `device`: The device to run the model on.
+        `queries`: A map from an entity type to its question, to know the type of MRC examples.
+        `stitch_strategy`: How to combine windows that overlap: `mean`, `max` or `centre`.
+        `max_tokens_per_batch`: The maximum number of tokens (with paddings) per forward pass, if not None.
+        `query_filter`: A pre-filter that picks the types to ask of a passage in `predict_passages`, if not None.
+        `result_cache`: A cache of answers of `predict_passages`, if not None.
+    Type:
+        `model`: `torch.nn.Module`
+        `featurizer`: `feature_generation.Featurizer`
+        `id_to_label`: dict
+        `batch_size`: integer
+        `device`: string
+        `queries`: dict
+        `stitch_strategy`: string
+        `max_tokens_per_batch`: integer
+        `query_filter`: `query_filter.LexiconQueryFilter`
+        `result_cache`: `result_cache.ResultCache`
+    """
+
+    def __init__(
+        self,
+        model,
+        featurizer,
+        id_to_label: Dict[int, str],
+        batch_size: int = 32,
+        device: Optional[str] = None,
+        queries: Optional[Dict[str, str]] = None,
+        stitch_strategy: str = StitchStrategy.MEAN.value,
+        max_tokens_per_batch: Optional[int] = None,
+        query_filter: Optional[LexiconQueryFilter] = None,
+        result_cache: Optional[ResultCache] = None,
+    ):
+        self.model = model
+        self.featurizer = featurizer
+        self.id_to_label = {int(k): v for k, v in id_to_label.items()}
+        self.batch_size = batch_size
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.collator = DataCollatorWithDynamicPadding.from_tokenizer(
+            featurizer.tokenizer
+        )
+        # Packed features tag every type of `featurizer.queries` at once.
+        self.packed_types = list(featurizer.queries) if featurizer.queries else None
+        self.question_to_type = {q: t for t, q in (queries or dict()).items()}
+        self.stitch_strategy = StitchStrategy(stitch_strategy)
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.query_filter = query_filter
+        self.result_cache = result_cache
+        self.model.to(self.device).eval()
+        # Counters of features and tokens (without paddings) that have been fed into model.
+        self.n_features = 0
+        self.n_tokens = 0
+        # Counter of (passage, type) pairs that `query_filter` has skipped.
+        self.n_pruned = 0
+
+    @classmethod
+    def from_pretrained(
+        cls,
+        model_dir: str,
+        backend: str = "torch",
+        cache_size: int = 0,
+        cache_path: Optional[str] = None,
+        **kwargs,
+    ):
+        """
+        Load the model, tokenizer and featurizer that `run_ner.py` saves into its output dir.
+        Features are kept unpadded, since each micro-batch is padded by the data collator.
+        With `backend="onnx"`, the model is the `model.onnx` written by `run/export_onnx.py`, run by onnxruntime on CPU.
+        With `backend="int8"`, the model is the dynamically quantized one published by `run/quantize.py`, run on CPU.
+        With `cache_size` > 0, answers are cached in memory by a `ResultCache` (and in the sqlite file of `cache_path` if set),
+        keyed by a fingerprint of the model files, the backend and the stitch strategy.
+        `kwargs` go to `Predictor`, e.g. `queries`, `device` and `max_tokens_per_batch`.
+        """
+
+        tokenizer = AutoTokenizer.from_pretrained(model_dir, use_fast=True)
+        featurizer = Featurizer.from_pretrained(
+            tokenizer,
+            model_dir,
+            padding_strategy=PaddingStrategy.DO_NOT_PAD.value,
+            encode_passage_once=True,
+        )
+        if backend == "onnx":
+            model = OnnxModelForTokenClassification.from_pretrained(model_dir)
+        elif backend == "int8":
+            model = load_quantized(model_dir)
+            if kwargs.get("device") not in (None, "cpu"):
+                logger.warning("The int8 backend runs on CPU only.")
+            kwargs["device"] = "cpu"
+        elif backend != "torch":
+            raise ValueError(f"Backend {backend} is not supported.")
+        elif os.path.isfile(os.path.join(model_dir, PACKED_CONFIG_NAME)):
+            model = PackedQueryModelForTokenClassification.from_pretrained(model_dir)
+        else:
+            model = AutoModelForTokenClassification.from_pretrained(model_dir)
+        predictor = cls(model, featurizer, model.config.id2label, **kwargs)
+        if cache_size > 0:
+            fingerprint = model_fingerprint(
+                model_dir,
+                tokenizer,
+                extra={
+                    "backend": backend,
+                    "featurizer": featurizer.config,
+                    "stitch_strategy": predictor.stitch_strategy.value,
+                },
+            )
+            predictor.result_cache = ResultCache(
+                fingerprint, max_size=cache_size, store_path=cache_path
+            )
+            logger.info(predictor.result_cache)
+        return predictor
+
+    def featurize(self, dataset: Dataset, num_proc: Optional[int] = None) -> Dataset:
+        return dataset.map(
+            self.featurizer.featurize_for_prediction,
+            batched=True,
+            with_indices=True,
+            num_proc=num_proc,
+            remove_columns=dataset.column_names,
+            features=self.featurizer.prediction_features,
+        )
+
+    def predict(
+        self, dataset: Dataset, num_proc: Optional[int] = None
+    ) -> Iterator[DataStruct]:
+        """
+        Predict answers of a dataset, one `DataStruct` per passage.
+        Consecutive examples with the same pid (queries of a passage in MRC configs) are merged.
+
+        Args:
+            `dataset`: Examples with `pid`, `passage`, `passage_tokens` (and `question` for MRC configs).
+            `num_proc`: The number of worker processes of featurization.
+        Type:
+            `dataset`: `datasets.Dataset`
+            `num_proc`: integer
+        Return:
+            rtype: iterator of `mrc.DataStruct`
+        """
+
+        features = self.featurize(dataset, num_proc=num_proc)
+        example_answers = self.predict_answers(
+            features, lambda example_id: dataset[example_id]
+        )
+        for pid, group in groupby(example_answers, key=lambda x: x[0]["pid"]):
+            group = list(group)
+            example = group[0][0]
+            yield DataStruct(
+                pid=pid,
+                passage=example["passage"],
+                answers=[ans for _, answers in group for ans in answers],
+            )
+
+    def predict_passages(
+        self, passages: Iterable[Dict], chunk_size: int = 256
+    ) -> Iterator[DataStruct]:
+        """
+        Predict answers of a stream of passages, one `DataStruct` per passage in the same order.
+        Passages are featurized `chunk_size` at a time without `datasets`,
+        so memory stays constant however long the stream is.
+        In MRC mode, each passage is asked every question of `queries`; packed features ask all of them at once.
+        The optional `types` of a passage limit the entity types to ask (MRC) or to return (packed).
+        Without `types`, `query_filter` picks them if it is set; a packed passage is skipped only if no type is picked.
+        If `result_cache` is set, a question asked of the same passage tokens before is answered from the cache;
+        a passage with `no_cache` set to true bypasses the lookup, and its answers refresh the cache.
+
+        Args:
+            `passages`: Passages with `passage` and optional `pid`, `passage_tokens`, `types` and `no_cache`.
+            `chunk_size`: The number of passages to featurize at a time.
+        Type:
+            `passages`: iterable of dict
+            `chunk_size`: integer
+        Return:
+            rtype: iterator of `mrc.DataStruct`
+        """
+
+        if not self.packed_types and not self.question_to_type:
+            raise ValueError("Queries are required to predict passages with MRC.")
+
+        pending = dict()
+        # Passages in order, which are popped once their answers are out.
+        # A passage whose questions are all skipped or cached has no example, so it is emitted right away.
+        queued = deque()
+
+        def examples():
+            for passage_index, passage in enumerate(passages):
+                example = {
+                    "pid": passage.get("pid", str(passage_index)),
+                    "passage": passage["passage"],
+                    "passage_tokens": passage.get("passage_tokens")
+                    or passage["passage"].split(),
+                    "passage_index": passage_index,
+                }
+                types = passage.get("types")
+                if types is None and self.query_filter is not None:
+                    types = self._filter_types(example["passage_tokens"])
+                # Packed features ask every question at once, which is cached under None.
+                if self.packed_types:
+                    questions = [None] if types is None or types else []
+                else:
+                    questions = [
+                        question
+                        for question, type in self.question_to_type.items()
+                        if types is None or type in types
+                    ]
+                cached = dict()
+                queued.append(
+                    (example, None if types is None else set(types), questions, cached)
+                )
+                for question in questions:
+                    if self.result_cache is not None and not passage.get("no_cache"):
+                        answers = self.result_cache.get(
+                            self.result_cache.key(question, example["passage_tokens"])
+                        )
+                        if answers is not None:
+                            cached[question] = answers
+                            continue
+                    yield (
+                        example
+                        if question is None
+                        else dict(example, question=question)
+                    )
+
+        def features():
+            example_id = 0
+            for chunk in _chunks(examples(), chunk_size):
+                batched_examples = {
+                    key: [example[key] for example in chunk] for key in chunk[0]
+                }
+                indices = list(range(example_id, example_id + len(chunk)))
+                batched_features = self.featurizer.featurize_for_prediction(
+                    batched_examples, indices
+                )
+                pending.update(zip(indices, chunk))
+                example_id += len(chunk)
+                keys = list(batched_features)
+                for values in zip(*(batched_features[key] for key in keys)):
+                    yield dict(zip(keys, values))
+
+        def data_struct(example, types, questions, answers_of_question):
+            return DataStruct(
+                pid=example["pid"],
+                passage=example["passage"],
+                answers=[
+                    ans
+                    for question in questions
+                    for ans in answers_of_question.get(question, ())
+                    if types is None or ans.type in types
+                ],
+            )
+
+        example_answers = self.predict_answers(features(), pending.pop)
+        # Pending writes of the cache are committed however the stream ends, so no write lock outlives a call.
+        try:
+            for passage_index, group in groupby(
+                example_answers, key=lambda x: x[0]["passage_index"]
+            ):
+                while queued[0][0]["passage_index"] < passage_index:
+                    yield data_struct(*queued.popleft())
+                example, types, questions, answers_of_question = queued.popleft()
+                for predicted_example, answers in group:
+                    question = predicted_example.get("question")
+                    answers_of_question[question] = answers
+                    if self.result_cache is not None:
+                        self.result_cache.put(
+                            self.result_cache.key(question, example["passage_tokens"]),
+                            answers,
+                        )
+                yield data_struct(example, types, questions, answers_of_question)
+            while queued:
+                yield data_struct(*queued.popleft())
+        finally:
+            if self.result_cache is not None:
+                self.result_cache.flush()
+
+    def _filter_types(self, passage_tokens: List[str]) -> List[str]:
+        """
+        Types that `query_filter` picks for the passage. Types unknown to the filter are always asked.
+        """
+
+        all_types = self.packed_types or list(self.question_to_type.values())
+        selected = set(self.query_filter.select(passage_tokens))
+        types = [
+            type
+            for type in all_types
+            if type in selected or type not in self.query_filter.lexicon
+        ]
+        self.n_pruned += len(all_types) - len(types)
+        return types
+
+    def predict_answers(
+        self, features: Iterable[Dict], get_example
+    ) -> Iterator[Tuple[Dict, List[AnswerStruct]]]:
+        """
+        Decode answers of each example from features in order.
+        `get_example` returns the example of an example id, which needs `passage_tokens`
+        (and `question` or `answers` to know the type of an MRC example).
+        """
+
+        for example_id, tag_ids in self.predict_tags(features):
+            example = get_example(example_id)
+            passage_tokens = example["passage_tokens"]
+            if self.packed_types:
+                answers = list()
+                for k, type in enumerate(self.packed_types):
+                    answers += spans_to_answers(
+                        decode_spans(tag_ids[:, k], self.id_to_label),
+                        passage_tokens,
+                        type,
+                    )
+            else:
+                answers = spans_to_answers(
+                    decode_spans(tag_ids, self.id_to_label),
+                    passage_tokens,
+                    self.example_type(example),
+                )
+            yield example, answers
+
+    def example_type(self, example: Dict) -> Optional[str]:
+        if example.get("question") in self.question_to_type:
+            return self.question_to_type[example["question"]]
+        answers = example.get("answers")
+        if answers and answers["type"]:
+            return answers["type"][0]
+        return None
+
+    def predict_tags(
+        self, features: Iterable[Dict]
+    ) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        Word-level tag ids of each example, of shape (n_words,), or (n_words, K) for packed features.
+        """
+
+        for example_id, probs in self.predict_scores(features):
+            yield example_id, probs.argmax(axis=-1)
+
+    def predict_scores(
+        self, features: Iterable[Dict]
+    ) -> Iterator[Tuple[int, np.ndarray]]:
+        """
+        Word-level probabilities of each example, stitched from its windows.
+        Only the windows of the current example are kept until it is complete.
+        """
+
+        current_id, window_logits, window_word_ids = None, list(), list()
+        for batch in self._batches(features):
+            for feature, (word_ids, logits) in zip(batch, self._forward(batch)):
+                if feature["example_id"] != current_id:
+                    if current_id is not None:
+                        yield current_id, self._stitch(window_logits, window_word_ids)
+                    current_id, window_logits, window_word_ids = (
+                        feature["example_id"],
+                        list(),
+                        list(),
+                    )
+                window_logits.append(logits)
+                window_word_ids.append(word_ids)
+        if current_id is not None:
+            yield current_id, self._stitch(window_logits, window_word_ids)
+
+    def _stitch(self, window_logits, window_word_ids) -> np.ndarray:
+        n_words = max((int(w.max(initial=-1)) + 1 for w in window_word_ids), default=0)
+        return stitch_windows(
+            window_logits, window_word_ids, n_words, self.stitch_strategy
+        )
+
+    def _batches(self, features: Iterable[Dict]) -> Iterator[List[Dict]]:
+        """
+        Micro-batches of at most `batch_size` features,
+        and at most `max_tokens_per_batch` tokens after padding to the longest feature if it is set.
+        """
+
+        batch, max_length = list(), 0
+        for feature in features:
+            length = len(feature["input_ids"])
+            if batch and (
+                len(batch) == self.batch_size
+                or (
+                    self.max_tokens_per_batch
+                    and (len(batch) + 1) * max(max_length, length)
+                    > self.max_tokens_per_batch
+                )
+            ):
+                yield batch
+                batch, max_length = list(), 0
+            batch.append(feature)
+            max_length = max(max_length, length)
+        if batch:
+            yield batch
+
+    def _forward(self, batch: List[Dict]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Word ids and logits of the first subword of each passage word, for each feature in a batch.
+        """
+
+        inputs = self.collator(
+            [{key: f[key] for key in MODEL_INPUT_NAMES if key in f} for f in batch]
+        )
+        self.n_features += len(batch)
+        self.n_tokens += int(inputs["attention_mask"].sum())
+        with torch.no_grad():
+            logits = self.model(
+                **{key: value.to(self.device) for key, value in inputs.items()}
+            )[0]
+        logits = logits.float().cpu().numpy()
+        outputs = list()
+        for idx, f in enumerate(batch):
+            word_ids = np.asarray(f["word_ids"], dtype=np.int64)
+            positions = np.flatnonzero(word_ids >= 0)
+            outputs.append((word_ids[positions], logits[idx, positions]))
+        return outputs
+
+
+def _chunks(iterable: Iterable, size: int) -> Iterator[List]:
+    chunk = list()
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = list()
+    if chunk:
+        yield chunk
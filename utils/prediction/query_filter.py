@@ -0,0 +1,188 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: A lexicon of answer words that decides which entity types to ask of a passage
+
+import json
+import logging
+import os
+import sys
+
+sys.path.append(os.getcwd())
+from collections import Counter, defaultdict
+from itertools import groupby
+from typing import Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+QUERY_FILTER_NAME = "query_filter.json"
+
+
+def group_passages(examples: Iterable[Dict]) -> Iterator[Dict]:
+    """
+    Merge consecutive examples of the same pid (queries of a passage in MRC configs) into one passage,
+    and drop the `start_pos: -1` placeholders of examples without answers.
+
+    Args:
+        `examples`: Examples with `pid`, `passage`, `passage_tokens` and `answers` of a loading script.
+    Type:
+        `examples`: iterable of dict
+    Return:
+        Passages with `pid`, `passage`, `passage_tokens` and `answers` (a list of dict).
+        rtype: iterator of dict
+    """
+
+    for pid, group in groupby(examples, key=lambda example: example["pid"]):
+        group = list(group)
+        answers = list()
+        for example in group:
+            answer_columns = example["answers"]
+            for i in range(len(answer_columns["type"])):
+                if answer_columns["start_pos"][i] >= 0:
+                    answers.append(
+                        {key: answer_columns[key][i] for key in answer_columns}
+                    )
+        yield {
+            "pid": pid,
+            "passage": group[0]["passage"],
+            "passage_tokens": group[0]["passage_tokens"],
+            "answers": answers,
+        }
+
+
+class LexiconQueryFilter:
+    """
+    A cheap pre-filter of (passage, entity type) pairs before the encoder runs.
+    For each type, a word scores the fraction of training passages containing it in which it is inside an answer of the type,
+        score(type, word) = n_passages(word in an answer of type) / (n_passages(word) + smoothing).
+    A passage asks the question of a type only if its best word scores at least `threshold`,
+    so a threshold of 0 asks every type, and higher thresholds trade recall for fewer forward passes.
+
+    Args:
+        `lexicon`: A map from a type to the scores of its words.
+        `threshold`: The lowest score of a passage to ask a type.
+        `lowercase`: Whether words are lowercased before lookup.
+    Type:
+        `lexicon`: dict
+        `threshold`: float
+        `lowercase`: bool
+    """
+
+    def __init__(
+        self,
+        lexicon: Dict[str, Dict[str, float]],
+        threshold: float = 0.0,
+        lowercase: bool = True,
+    ):
+        self.lexicon = lexicon
+        self.threshold = threshold
+        self.lowercase = lowercase
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(types={list(self.lexicon)}, "
+            f"words={sum(map(len, self.lexicon.values()))}, threshold={self.threshold})"
+        )
+
+    @classmethod
+    def fit(
+        cls,
+        passages: Iterable[Dict],
+        types: Optional[List[str]] = None,
+        smoothing: float = 1.0,
+        min_count: int = 1,
+        lowercase: bool = True,
+    ):
+        """
+        Build the lexicon from passages of `group_passages` over the train split.
+
+        Args:
+            `passages`: Passages with `passage_tokens` and `answers`.
+            `types`: All entity types, including those without any training answer. Default to types of answers.
+            `smoothing`: Added to the passage count of a word, so rare words score lower.
+            `min_count`: The fewest passages in which a word is inside an answer of a type to keep it.
+            `lowercase`: Whether words are lowercased.
+        Type:
+            `passages`: iterable of dict
+            `types`: list of string
+            `smoothing`: float
+            `min_count`: integer
+            `lowercase`: bool
+        """
+
+        document_frequency = Counter()
+        answer_frequency = defaultdict(Counter)
+        for passage in passages:
+            tokens = passage["passage_tokens"]
+            if lowercase:
+                tokens = [token.lower() for token in tokens]
+            document_frequency.update(set(tokens))
+            answer_words = defaultdict(set)
+            for ans in passage["answers"]:
+                end_pos = max(ans["end_pos"], ans["start_pos"] + 1)
+                answer_words[ans["type"]].update(tokens[ans["start_pos"] : end_pos])
+            for type, words in answer_words.items():
+                answer_frequency[type].update(words)
+
+        lexicon = {type: dict() for type in types or sorted(answer_frequency)}
+        for type, counter in answer_frequency.items():
+            lexicon.setdefault(type, dict())
+            for word, count in counter.items():
+                if count >= min_count:
+                    lexicon[type][word] = count / (document_frequency[word] + smoothing)
+        return cls(lexicon, lowercase=lowercase)
+
+    @classmethod
+    def from_pretrained(cls, pretrained_dir: str, **kwargs):
+        """
+        Load a filter saved by `save_pretrained`. `kwargs` override the saved settings, e.g. `threshold`.
+        """
+
+        with open(
+            os.path.join(pretrained_dir, QUERY_FILTER_NAME), "r", encoding="utf-8"
+        ) as f:
+            config = json.load(f)
+        config.update(kwargs)
+        return cls(**config)
+
+    def save_pretrained(self, save_directory: str):
+        os.makedirs(save_directory, exist_ok=True)
+        with open(
+            os.path.join(save_directory, QUERY_FILTER_NAME), "w", encoding="utf-8"
+        ) as f:
+            json.dump(
+                {
+                    "lexicon": self.lexicon,
+                    "threshold": self.threshold,
+                    "lowercase": self.lowercase,
+                },
+                f,
+                indent=4,
+                ensure_ascii=False,
+            )
+
+    def scores(self, passage_tokens: List[str]) -> Dict[str, float]:
+        """
+        The best word score of the passage for each type.
+        """
+
+        words = set(
+            token.lower() if self.lowercase else token for token in passage_tokens
+        )
+        return {
+            type: max((scores.get(word, 0.0) for word in words), default=0.0)
+            for type, scores in self.lexicon.items()
+        }
+
+    def select(
+        self, passage_tokens: List[str], threshold: Optional[float] = None
+    ) -> List[str]:
+        """
+        Types to ask of the passage.
+        """
+
+        threshold = self.threshold if threshold is None else threshold
+        return [
+            type
+            for type, score in self.scores(passage_tokens).items()
+            if score >= threshold
+        ]
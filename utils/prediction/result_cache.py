@@ -0,0 +1,220 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: LRU cache of decoded answers keyed by model, question and passage tokens
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+
+sys.path.append(os.getcwd())
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from utils.data_structure.mrc import AnswerStruct
+from utils.feature_generation.feature_store import tokenizer_digest
+
+logger = logging.getLogger(__name__)
+
+# Files that decide the outputs of a model dir; reports such as eval_results.json are left out.
+MODEL_FILES = (
+    "config.json",
+    "featurizer_config.json",
+    "packed_queries.json",
+    "pytorch_model.bin",
+    "model.safetensors",
+    "model.onnx",
+    "pytorch_model_int8.bin",
+)
+
+
+def model_fingerprint(
+    model_dir: str, tokenizer=None, extra: Optional[Dict] = None
+) -> str:
+    """
+    A digest of the model files of a model dir, its tokenizer, and other settings that change answers,
+    e.g. the backend and the stitch strategy.
+
+    Args:
+        `model_dir`: A dir saved by run_ner (or export_onnx, quantize).
+        `tokenizer`: The tokenizer of the model.
+        `extra`: Other settings, which must be json serializable.
+    Type:
+        `model_dir`: string
+        `tokenizer`: `transformers.PreTrainedTokenizerBase`
+        `extra`: dict
+    Return:
+        rtype: string
+    """
+
+    h = hashlib.sha256()
+    for name in MODEL_FILES:
+        file_path = os.path.join(model_dir, name)
+        if not os.path.isfile(file_path):
+            continue
+        h.update(name.encode("utf-8"))
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    if tokenizer is not None:
+        h.update(tokenizer_digest(tokenizer).encode("utf-8"))
+    h.update(json.dumps(extra or dict(), sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    A bounded LRU cache from (model fingerprint, question, passage tokens) to decoded answers,
+    optionally backed by a sqlite file that persists across runs.
+    A lookup that misses memory falls back to the file, and a hit there is brought back into memory.
+    Entries evicted from memory stay in the file.
+    The file is opened in WAL mode, so several processes (e.g. `run/predict.py` and `run/serve.py`) can share it:
+    readers never block, and a writer waits up to `timeout` seconds for the lock.
+    If the file is still locked (or broken), the error is logged and the cache goes on in memory only.
+
+    Args:
+        `fingerprint`: The fingerprint of the model (see `model_fingerprint`).
+        `max_size`: The maximum number of entries in memory.
+        `store_path`: A path of the sqlite file, or None to keep the cache in memory only.
+        `commit_every`: The number of writes between commits of the sqlite file.
+            The write lock is held until a commit, so keep it small when the file is shared.
+        `timeout`: Seconds to wait for the lock of the sqlite file.
+    Type:
+        `fingerprint`: string
+        `max_size`: integer
+        `store_path`: string
+        `commit_every`: integer
+        `timeout`: float
+    """
+
+    def __init__(
+        self,
+        fingerprint: str,
+        max_size: int = 10000,
+        store_path: Optional[str] = None,
+        commit_every: int = 1,
+        timeout: float = 30.0,
+    ):
+        self.fingerprint = fingerprint
+        self.max_size = max_size
+        self.store_path = store_path
+        self.commit_every = commit_every
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._n_uncommitted = 0
+        self._db = None
+        if store_path:
+            dir = os.path.abspath(os.path.dirname(store_path))
+            os.makedirs(dir, exist_ok=True)
+            # The predictor runs on one thread at a time, which may not be the one that opens the file.
+            self._db = sqlite3.connect(
+                store_path, timeout=timeout, check_same_thread=False
+            )
+            self._db.execute("PRAGMA journal_mode=WAL")
+            # Commits of WAL only sync at checkpoints, so a commit per write stays cheap.
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, answers TEXT)"
+            )
+            self._db.commit()
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(max_size={self.max_size}, store_path={self.store_path}, "
+            f"fingerprint={self.fingerprint[:16]})"
+        )
+
+    def __len__(self):
+        return len(self.entries)
+
+    def key(self, question: Optional[str], passage_tokens: List[str]) -> str:
+        """
+        The key of a question on a passage; `question` is None for packed models, which ask every question at once.
+        """
+
+        return hashlib.sha256(
+            json.dumps(
+                [self.fingerprint, question, list(passage_tokens)], ensure_ascii=False
+            ).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[List[AnswerStruct]]:
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return list(self.entries[key])
+        if self._db is not None:
+            try:
+                row = self._db.execute(
+                    "SELECT answers FROM results WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Skip the lookup of {self.store_path}: {e}")
+                row = None
+            if row is not None:
+                answers = [AnswerStruct(*ans) for ans in json.loads(row[0])]
+                self._remember(key, answers)
+                self.hits += 1
+                self.disk_hits += 1
+                return list(answers)
+        self.misses += 1
+        return None
+
+    def put(self, key: str, answers: List[AnswerStruct]):
+        self._remember(key, tuple(answers))
+        if self._db is not None:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, answers) VALUES (?, ?)",
+                    (
+                        key,
+                        json.dumps([list(ans) for ans in answers], ensure_ascii=False),
+                    ),
+                )
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Keep {key[:16]} in memory only: {e}")
+                return
+            self._n_uncommitted += 1
+            if self._n_uncommitted >= self.commit_every:
+                self.flush()
+
+    def _remember(self, key: str, answers):
+        self.entries[key] = tuple(answers)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def flush(self):
+        if self._db is not None and self._n_uncommitted:
+            try:
+                self._db.commit()
+            except sqlite3.OperationalError as e:
+                # Drop the pending writes, so the lock is released; they are still in memory.
+                logger.warning(
+                    f"Drop {self._n_uncommitted} uncommitted writes of {self.store_path}: {e}"
+                )
+                self._db.rollback()
+            self._n_uncommitted = 0
+
+    def close(self):
+        if self._db is not None:
+            self.flush()
+            self._db.close()
+            self._db = None
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,310 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Asyncio HTTP server that coalesces concurrent requests into dynamic batches
+
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.getcwd())
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from utils.data_structure.mrc import DataStruct
+
+logger = logging.getLogger(__name__)
+
+HTTP_STATUS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class ServerMetrics:
+    """
+    Latencies of recent requests and the histogram of batch sizes (the number of passages per batch).
+
+    Args:
+        `window`: The number of recent requests to compute latency percentiles over.
+    Type:
+        `window`: integer
+    """
+
+    def __init__(self, window: int = 10000):
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = Counter()
+        self.n_requests = 0
+        self.n_passages = 0
+        self.n_errors = 0
+
+    def observe_request(self, latency: float, n_passages: int):
+        self.latencies.append(latency)
+        self.n_requests += 1
+        self.n_passages += n_passages
+
+    def observe_batch(self, n_passages: int):
+        self.batch_sizes[n_passages] += 1
+
+    def report(self) -> Dict:
+        latencies = np.asarray(self.latencies) * 1000
+        return {
+            "requests": self.n_requests,
+            "passages": self.n_passages,
+            "errors": self.n_errors,
+            "batches": sum(self.batch_sizes.values()),
+            "latency_ms": {
+                "p50": (
+                    round(float(np.percentile(latencies, 50)), 3)
+                    if len(latencies)
+                    else None
+                ),
+                "p99": (
+                    round(float(np.percentile(latencies, 99)), 3)
+                    if len(latencies)
+                    else None
+                ),
+                "mean": round(float(latencies.mean()), 3) if len(latencies) else None,
+            },
+            "batch_size_histogram": {
+                str(size): count for size, count in sorted(self.batch_sizes.items())
+            },
+        }
+
+
+class DynamicBatcher:
+    """
+    Collect passages of concurrent requests into one batch, until the batch has `max_batch_size` passages
+    or `max_wait_ms` has passed since its first request, then run the batch on a worker thread.
+    Answers are handed back to each request in the order of its passages.
+
+    Args:
+        `predictor`: A `Predictor` to run batches.
+        `max_batch_size`: The maximum number of passages per batch.
+        `max_wait_ms`: How long the first request of a batch waits for others.
+        `metrics`: Metrics to record batch sizes into.
+    Type:
+        `predictor`: `predictor.Predictor`
+        `max_batch_size`: integer
+        `max_wait_ms`: float
+        `metrics`: `ServerMetrics`
+    """
+
+    def __init__(
+        self,
+        predictor,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 10.0,
+        metrics: Optional[ServerMetrics] = None,
+    ):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.metrics = metrics or ServerMetrics()
+        # One worker thread, so the model runs one batch at a time.
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.queue = None
+
+    async def submit(self, passages: List[Dict]) -> List[DataStruct]:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue().put((passages, future))
+        return await future
+
+    def _queue(self) -> asyncio.Queue:
+        # Created inside the running event loop.
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        return self.queue
+
+    async def run(self):
+        self._queue()
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = [await self.queue.get()]
+            n_passages = len(requests[0][0])
+            deadline = loop.time() + self.max_wait
+            while n_passages < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                requests.append(request)
+                n_passages += len(request[0])
+
+            passages = [passage for request, _ in requests for passage in request]
+            self.metrics.observe_batch(len(passages))
+            try:
+                results = await loop.run_in_executor(
+                    self.executor,
+                    lambda: list(self.predictor.predict_passages(passages)),
+                )
+            except Exception as e:
+                logger.exception("Failed to run a batch")
+                for _, future in requests:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            offset = 0
+            for request, future in requests:
+                if not future.done():
+                    future.set_result(results[offset : offset + len(request)])
+                offset += len(request)
+
+
+class InferenceServer:
+    """
+    A small HTTP/1.1 server on asyncio streams.
+        POST /predict : {"passages": [{"pid": ..., "passage": ..., "types": [...]}, ...]}
+                        or {"passage": ..., "types": [...]}, where `pid` and `types` are optional.
+                        `types` is a list of entity types of the queries (or the packed model) of the predictor.
+                        `"no_cache": true` of a request or a passage bypasses the result cache.
+                        Return {"data": [{"pid": ..., "passage": ..., "answers": [AnswerStruct, ...]}, ...]}.
+        GET /metrics  : Latency percentiles, the histogram of batch sizes, and stats of the result cache.
+        GET /health   : {"status": "ok"}.
+
+    Args:
+        `batcher`: A `DynamicBatcher` to run requests.
+        `host`: The host to bind.
+        `port`: The port to bind.
+        `max_body_bytes`: A request whose body is larger is rejected with 413 before its body is read.
+    Type:
+        `batcher`: `DynamicBatcher`
+        `host`: string
+        `port`: integer
+        `max_body_bytes`: integer
+    """
+
+    def __init__(
+        self,
+        batcher: DynamicBatcher,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        max_body_bytes: int = 1 << 20,
+    ):
+        self.batcher = batcher
+        self.metrics = batcher.metrics
+        self.host = host
+        self.port = port
+        self.max_body_bytes = max_body_bytes
+        predictor = batcher.predictor
+        self.types = set(
+            getattr(predictor, "packed_types", None)
+            or getattr(predictor, "question_to_type", dict()).values()
+        )
+
+    async def serve_forever(self):
+        batcher_task = asyncio.ensure_future(self.batcher.run())
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        logger.info(f"Serving on http://{self.host}:{self.port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher_task.cancel()
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = dict()
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                key, _, value = line.partition(":")
+                headers[key.strip().lower()] = value.strip()
+            content_length = headers.get("content-length", "0")
+            if not content_length.isdigit():
+                status, payload = 400, {"error": "Invalid Content-Length"}
+            elif int(content_length) > self.max_body_bytes:
+                # The body is never read, so a huge Content-Length cannot exhaust memory.
+                status, payload = 413, {
+                    "error": f"Body of {content_length} bytes exceeds {self.max_body_bytes} bytes"
+                }
+            elif len(request_line) < 2:
+                status, payload = 400, {"error": "Malformed request line"}
+            else:
+                body = await reader.readexactly(int(content_length))
+                status, payload = await self.route(
+                    request_line[0], request_line[1], body
+                )
+        except Exception as e:
+            logger.exception("Failed to handle a request")
+            status, payload = 500, {"error": str(e)}
+        if status >= 400:
+            self.metrics.n_errors += 1
+        content = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        writer.write(
+            (
+                f"HTTP/1.1 {status} {HTTP_STATUS[status]}\r\n"
+                "Content-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(content)}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode("latin-1")
+            + content
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def route(self, method: str, path: str, body: bytes) -> Tuple[int, Dict]:
+        path = path.split("?")[0]
+        if path == "/health":
+            return 200, {"status": "ok"}
+        if path == "/metrics":
+            report = self.metrics.report()
+            result_cache = getattr(self.batcher.predictor, "result_cache", None)
+            if result_cache is not None:
+                report["result_cache"] = result_cache.stats()
+            return 200, report
+        if path != "/predict":
+            return 404, {"error": f"Unknown path {path}"}
+        if method != "POST":
+            return 405, {"error": "Use POST for /predict"}
+
+        try:
+            request = json.loads(body.decode("utf-8"))
+            passages = request["passages"] if "passages" in request else [request]
+            for idx, passage in enumerate(passages):
+                if request.get("no_cache"):
+                    passage["no_cache"] = True
+                if not isinstance(passage.get("passage"), str):
+                    raise ValueError("Each passage needs a `passage` string")
+                types = passage.get("types")
+                if types is not None:
+                    if not isinstance(types, list) or not all(
+                        isinstance(t, str) for t in types
+                    ):
+                        raise ValueError("`types` must be a list of entity types")
+                    unknown = [t for t in types if t not in self.types]
+                    if unknown:
+                        raise ValueError(
+                            f"Unknown types {unknown}, expected some of {sorted(self.types)}"
+                        )
+                passage.setdefault("pid", str(idx))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return 400, {"error": f"Invalid request: {e}"}
+
+        start = time.perf_counter()
+        data = await self.batcher.submit(passages)
+        self.metrics.observe_request(time.perf_counter() - start, len(passages))
+        return 200, {
+            "data": [
+                {
+                    "pid": d.pid,
+                    "passage": d.passage,
+                    "answers": [dict(ans._asdict()) for ans in d.answers],
+                }
+                for d in data
+            ]
+        }
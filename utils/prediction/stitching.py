@@ -0,0 +1,97 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Stitch logits of overlapping windows back into word-level scores of a passage
+
+import logging
+import os
+import sys
+
+sys.path.append(os.getcwd())
+from typing import List
+import numpy as np
+from utils.feature_generation.strategy import StitchStrategy
+
+logger = logging.getLogger(__name__)
+
+
+def softmax(logits: np.ndarray) -> np.ndarray:
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def stitch_windows(
+    window_logits: List[np.ndarray],
+    window_word_ids: List[np.ndarray],
+    n_words: int,
+    stitch_strategy: StitchStrategy = StitchStrategy.MEAN,
+) -> np.ndarray:
+    """
+    Map logits of every window of a passage back to word positions and combine the positions
+    that several windows cover (the `doc_stride` overlaps), all in one vectorized pass.
+        `mean`  : Average the probabilities of all windows that cover a word.
+        `max`   : Keep the probabilities of the window that is the most confident on a word.
+        `centre`: Keep the probabilities of the window in which a word is the farthest from the edges,
+                  i.e. the window that gives the word the most context on both sides.
+    Ties go to the earlier window.
+
+    Args:
+        `window_logits`: Logits of each token of each window, of shape (seq_len, num_labels),
+                         or (seq_len, K, num_labels) for packed queries.
+        `window_word_ids`: Word id of each token of each window. -1 except on the first subword of passage words.
+        `n_words`: The number of words of the passage.
+        `stitch_strategy`: `mean`, `max` or `centre`.
+    Type:
+        `window_logits`: list of np.ndarray
+        `window_word_ids`: list of np.ndarray
+        `n_words`: integer
+        `stitch_strategy`: `strategy.StitchStrategy`
+    Return:
+        Probabilities of each word, of shape (n_words, num_labels) or (n_words, K, num_labels).
+        Words that no window covers get all zeros.
+        rtype: np.ndarray
+    """
+
+    stitch_strategy = StitchStrategy(stitch_strategy)
+    word_ids = [np.asarray(w) for w in window_word_ids]
+    positions = [np.flatnonzero(w >= 0) for w in word_ids]
+    words = np.concatenate(
+        [w[p] for w, p in zip(word_ids, positions)] or [np.zeros(0, dtype=np.int64)]
+    ).astype(np.int64)
+    probs = softmax(
+        np.concatenate([l[p] for l, p in zip(window_logits, positions)])
+        if positions
+        else np.zeros((0, 1), dtype=np.float32)
+    )
+    # Treat every (word, query) as a cell: probs of shape (n_rows, n_columns, num_labels).
+    trailing_shape = probs.shape[1:]
+    n_columns = int(np.prod(trailing_shape[:-1]))
+    probs = probs.reshape(len(words), n_columns, trailing_shape[-1])
+
+    if stitch_strategy == StitchStrategy.MEAN:
+        output = np.zeros((n_words,) + probs.shape[1:], dtype=probs.dtype)
+        np.add.at(output, words, probs)
+        counts = np.bincount(words, minlength=n_words)
+        output /= np.maximum(counts, 1)[:, None, None]
+        return output.reshape((n_words,) + trailing_shape)
+
+    if stitch_strategy == StitchStrategy.MAX:
+        scores = probs.max(axis=-1)
+    else:
+        # Distance of each word to the nearest edge of its window, counted in words.
+        sizes = np.fromiter(map(len, positions), dtype=np.int64, count=len(positions))
+        ranks = np.arange(len(words)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        distances = np.minimum(ranks, np.repeat(sizes, sizes) - 1 - ranks)
+        scores = np.repeat(distances[:, None], n_columns, axis=1).astype(np.float64)
+
+    # Pick the best row of each cell; rows are in window order, so the stable sort keeps ties on the earlier one.
+    best = np.full((n_words, n_columns), -np.inf)
+    np.maximum.at(best, words, scores)
+    rows, columns = np.nonzero(scores >= best[words])
+    cells = words[rows] * n_columns + columns
+    order = np.argsort(cells, kind="stable")
+    _, first = np.unique(cells[order], return_index=True)
+    rows, columns = rows[order][first], columns[order][first]
+
+    output = np.zeros((n_words,) + probs.shape[1:], dtype=probs.dtype)
+    output[words[rows], columns] = probs[rows, columns]
+    return output.reshape((n_words,) + trailing_shape)
@@ -0,0 +1,68 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Write predictions as a json file of MRCStruct, one DataStruct at a time
+
+import json
+import logging
+import os
+import sys
+
+sys.path.append(os.getcwd())
+from utils.data_structure.mrc import DataStruct
+
+logger = logging.getLogger(__name__)
+
+
+class MRCStructWriter:
+    """
+    Stream `DataStruct`s into a json file in the schema of `MRCStruct`,
+    so predictions of a large dataset are never held in memory at once.
+    The file is the same as `json.dumps(trans2dict(mrc), indent=4, ensure_ascii=False)`.
+
+    Args:
+        `output_file_path`: A path of output file.
+        `built_time`: A time when predictions are built.
+        `version`: A version of predictions.
+    Type:
+        `output_file_path`: string
+        `built_time`: string
+        `version`: string
+    """
+
+    def __init__(self, output_file_path: str, built_time: str, version: str):
+        self.output_file_path = output_file_path
+        self.built_time = built_time
+        self.version = version
+        self.n_data = 0
+        self._fout = None
+
+    def __enter__(self):
+        dir = os.path.abspath(os.path.dirname(self.output_file_path))
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+        self._fout = open(self.output_file_path, "w", encoding="utf-8")
+        self._fout.write(
+            "{\n"
+            f'    "built_time": {json.dumps(self.built_time, ensure_ascii=False)},\n'
+            f'    "version": {json.dumps(self.version, ensure_ascii=False)},\n'
+            '    "data": ['
+        )
+        return self
+
+    def write(self, data: DataStruct):
+        data_dict = {
+            "pid": data.pid,
+            "passage": data.passage,
+            "answers": [dict(ans._asdict()) for ans in data.answers],
+        }
+        out = json.dumps(data_dict, indent=4, ensure_ascii=False)
+        out = "\n".join(" " * 8 + line for line in out.splitlines())
+        self._fout.write(("," if self.n_data else "") + "\n" + out)
+        self.n_data += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._fout.write("\n    ]\n}" if self.n_data else "]\n}")
+        self._fout.close()
+        logger.info(
+            f"ALREADY SAVE {self.n_data} PREDICTIONS INTO {self.output_file_path}."
+        )
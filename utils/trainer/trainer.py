@@ -0,0 +1,191 @@
+# encoding=utf-8
+# Author: Yu-Lun Chiang
+# Description: Trainer with samplers that are aware of feature lengths
+
+import logging
+import os
+import sys
+
+sys.path.append(os.getcwd())
+from typing import Any, Dict, List, Optional, Tuple, Union
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Dataset, Sampler
+from transformers import EvalPrediction, Trainer
+from utils.evaluation.evaluation import select_label_ids, unpack_results
+from utils.evaluation.span_metric import SpanMetric
+from utils.feature_generation.sampler import (
+    LengthGroupedSampler,
+    TokenBudgetBatchSampler,
+)
+from utils.model.packed_query_model import PackedQueryModelForTokenClassification
+
+logger = logging.getLogger(__name__)
+
+
+def get_lengths(dataset) -> List[int]:
+    """
+    The number of tokens of each feature (without padding).
+    It reads the `length` column written by `Featurizer` and falls back to counting `attention_mask`.
+    """
+
+    if "length" in dataset.column_names:
+        return dataset["length"]
+    return [sum(mask) for mask in dataset["attention_mask"]]
+
+
+class QASLTrainer(Trainer):
+    """
+    `transformers.Trainer` that groups features of similar lengths into the same batch
+    when `group_by_length` of `TrainingArguments` is set.
+    The lengths come from the `length` column of features, so they are not recomputed by reading every feature.
+    Evaluation batches are grouped too (sorted by length); test datasets keep their order.
+    With `max_tokens_per_batch`, batches of training, evaluation and prediction are filled up to a token budget
+    by `TokenBudgetBatchSampler` instead of holding a fixed number of features.
+    A packed-query model is saved with its configs, so it can be loaded back by `from_pretrained`.
+    With `argmax_logits`, logits of each evaluation batch are reduced to int8 label ids before they are gathered,
+    so the host holds (n_features, seq_len) bytes instead of (n_features, seq_len, num_labels) floats.
+    With `streaming_metric`, each batch is reduced further to the counts of `SpanMetric.count`,
+    and `compute_metrics` is replaced by scoring their sum.
+
+    Args:
+        `max_tokens_per_batch`: The maximum number of tokens (with paddings) of a batch, if not None.
+        `argmax_logits`: Whether to gather label ids instead of logits during evaluation.
+        `streaming_metric`: The metric whose counts are gathered instead of logits during evaluation, if not None.
+        `kwargs`: Arguments of `transformers.Trainer`.
+    Type:
+        `max_tokens_per_batch`: integer
+        `argmax_logits`: bool
+        `streaming_metric`: `SpanMetric`
+    """
+
+    def __init__(
+        self,
+        *args,
+        max_tokens_per_batch: Optional[int] = None,
+        argmax_logits: bool = False,
+        streaming_metric: Optional[SpanMetric] = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.argmax_logits = argmax_logits
+        self.streaming_metric = streaming_metric
+        if streaming_metric is not None:
+            self.compute_metrics = self.compute_streamed_metrics
+
+    def _save(self, output_dir: Optional[str] = None):
+        super()._save(output_dir)
+        if isinstance(self.model, PackedQueryModelForTokenClassification):
+            self.model.save_config(output_dir or self.args.output_dir)
+
+    def prediction_step(
+        self,
+        model: nn.Module,
+        inputs: Dict[str, Union[torch.Tensor, Any]],
+        prediction_loss_only: bool,
+        ignore_keys: Optional[List[str]] = None,
+    ) -> Tuple[Optional[torch.Tensor], Optional[torch.Tensor], Optional[torch.Tensor]]:
+        loss, logits, labels = super().prediction_step(
+            model, inputs, prediction_loss_only, ignore_keys=ignore_keys
+        )
+        if not isinstance(logits, torch.Tensor) or not isinstance(labels, torch.Tensor):
+            return loss, logits, labels
+        if self.streaming_metric is not None:
+            counts = self.streaming_metric.count(
+                *select_label_ids(
+                    logits.argmax(dim=-1).cpu().numpy(), labels.cpu().numpy()
+                )
+            )
+            # One row per batch, so the rows are concatenated (and gathered across processes) like logits.
+            counts = torch.as_tensor(counts, device=labels.device).unsqueeze(0)
+            return loss, counts, counts
+        if self.argmax_logits:
+            # Label ids and the -100 of ignored positions (and paddings of gathering) fit in int8.
+            return (
+                loss,
+                logits.argmax(dim=-1).to(torch.int8),
+                labels.to(torch.int8),
+            )
+        return loss, logits, labels
+
+    def compute_streamed_metrics(self, p: EvalPrediction) -> Dict[str, float]:
+        counts = p.predictions
+        # Gatherers may pad the rows up to the number of features with -100.
+        counts = counts[counts[:, 0] >= 0].sum(axis=0)
+        return unpack_results(self.streaming_metric.score(counts))
+
+    def _get_train_sampler(self) -> Optional[Sampler]:
+        if not self.args.group_by_length or self.args.world_size > 1:
+            return super()._get_train_sampler()
+        return LengthGroupedSampler(
+            get_lengths(self.train_dataset), self.args.train_batch_size, shuffle=True
+        )
+
+    def _get_eval_sampler(self, eval_dataset: Dataset) -> Optional[Sampler]:
+        if (
+            not self.args.group_by_length
+            or self.args.local_rank != -1
+            or eval_dataset is not self.eval_dataset
+        ):
+            return super()._get_eval_sampler(eval_dataset)
+        return LengthGroupedSampler(
+            get_lengths(eval_dataset), self.args.eval_batch_size, shuffle=False
+        )
+
+    def get_train_dataloader(self) -> DataLoader:
+        return self._token_budget_dataloader(
+            super().get_train_dataloader(), self.train_dataset, shuffle=True
+        )
+
+    def get_eval_dataloader(self, eval_dataset: Optional[Dataset] = None) -> DataLoader:
+        eval_dataset = eval_dataset if eval_dataset is not None else self.eval_dataset
+        return self._token_budget_dataloader(
+            super().get_eval_dataloader(eval_dataset), eval_dataset, shuffle=False
+        )
+
+    def get_test_dataloader(self, test_dataset: Dataset) -> DataLoader:
+        # Predictions are returned in the order of batches, so test features keep their order.
+        return self._token_budget_dataloader(
+            super().get_test_dataloader(test_dataset),
+            test_dataset,
+            shuffle=False,
+            group_by_length=False,
+        )
+
+    def _token_budget_dataloader(
+        self,
+        dataloader: DataLoader,
+        dataset: Dataset,
+        shuffle: bool,
+        group_by_length: Optional[bool] = None,
+    ) -> DataLoader:
+        """
+        Rebuild a dataloader of `transformers.Trainer` with `TokenBudgetBatchSampler`,
+        keeping its dataset (with unused columns removed), collator and workers.
+        """
+
+        if not self.max_tokens_per_batch:
+            return dataloader
+        if self.args.world_size > 1:
+            logger.warning(
+                "max_tokens_per_batch is not supported in distributed training; batches keep a fixed size."
+            )
+            return dataloader
+        batch_sampler = TokenBudgetBatchSampler(
+            get_lengths(dataset),
+            self.max_tokens_per_batch,
+            shuffle=shuffle,
+            group_by_length=(
+                self.args.group_by_length
+                if group_by_length is None
+                else group_by_length
+            ),
+        )
+        return DataLoader(
+            dataloader.dataset,
+            batch_sampler=batch_sampler,
+            collate_fn=dataloader.collate_fn,
+            num_workers=dataloader.num_workers,
+            pin_memory=dataloader.pin_memory,
+        )